@@ -0,0 +1,98 @@
+"""
+Throughput of calc_simulated_energy() in turbine-hours per second: the fused energy kernel with
+and without dask compared to the previous graph of separate xarray operations (one intermediate
+array per operation).
+"""
+
+import time
+import logging
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from wind_repower_usa.calculations import calc_simulated_energy, calc_capacity_scaling
+from wind_repower_usa.energy_kernel import calc_building_dates, calc_energy_dask
+from wind_repower_usa.energy_kernel import calc_energy_numpy
+from wind_repower_usa.logging_config import setup_logging
+from wind_repower_usa.power_curves import PowerCurve
+from wind_repower_usa.turbine_models import ge15_77
+
+
+def calc_simulated_energy_unfused(wind_speed, turbines, power_curve):
+    """Previous implementation of calc_simulated_energy(sum_along='time')."""
+    simulated_energy = xr.apply_ufunc(power_curve, wind_speed, dask='parallelized',
+                                      output_dtypes=[np.float64])
+
+    building_dates = turbines.p_year.astype(int).astype(str).astype(np.datetime64)
+    nanosecs_of_year = (simulated_energy.time - building_dates).astype(
+        'timedelta64[ns]').astype(np.float64)
+    proportion_of_year = nanosecs_of_year / (365.25 * 24 * 60 * 60 * 1e9)
+    building_this_year = simulated_energy.time.dt.year == turbines.p_year
+    simulated_energy = simulated_energy.where(~building_this_year,
+                                              simulated_energy * proportion_of_year)
+    already_built = simulated_energy.time.dt.year >= turbines.p_year
+    simulated_energy = simulated_energy.where(already_built, 0)
+
+    simulated_energy *= calc_capacity_scaling(turbines)
+    simulated_energy = simulated_energy.sortby('time') * 1e-6
+    return simulated_energy.sum(dim='time').compute()
+
+
+def timeit(func, *args, **kwargs):
+    t0 = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - t0, result
+
+
+def main():
+    setup_logging(fname=None)
+
+    num_turbines = 2000
+    time_index = pd.date_range('2016-01-01', '2016-12-31 23:00', freq='h')
+    turbine_hours = num_turbines * len(time_index)
+
+    np.random.seed(42)
+    wind_speed = xr.DataArray(np.random.weibull(2., size=(len(time_index), num_turbines)) * 8.,
+                              dims=('time', 'turbines'),
+                              coords={'time': time_index, 'turbines': np.arange(num_turbines)})
+    turbines = xr.Dataset({
+        'p_year': ('turbines', np.random.randint(2000, 2018, size=num_turbines).astype(float)),
+        't_cap': ('turbines', np.random.choice([1500., 2000., np.nan], size=num_turbines)),
+    },
+        coords={'turbines': np.arange(num_turbines)}
+    )
+
+    time_ns = time_index.values.astype('datetime64[ns]').astype(np.int64)
+    building_start, building_end = calc_building_dates(turbines)
+    kwargs = dict(building_start=building_start, building_end=building_end,
+                  capacity_factor=calc_capacity_scaling(turbines).values,
+                  time_offsets=np.array([0]))
+
+    for power_curve_name, power_curve in (
+            ('interp1d', ge15_77.power_curve),
+            ('PowerCurve', PowerCurve.from_interp1d(ge15_77.power_curve))):
+        time_unfused, expected = timeit(calc_simulated_energy_unfused,
+                                        wind_speed.chunk({'time': 24 * 31}), turbines,
+                                        power_curve)
+        time_numpy, energy_numpy = timeit(calc_energy_numpy, wind_speed.values, time_ns,
+                                          power_curve, **kwargs)
+        time_dask, energy_dask = timeit(calc_energy_dask,
+                                        wind_speed.chunk({'time': 24 * 31}).data, time_ns,
+                                        power_curve, **kwargs)
+        time_total, _ = timeit(calc_simulated_energy, wind_speed, turbines, power_curve,
+                               sum_along='time')
+
+        max_difference = max(np.max(np.abs(energy_numpy[0] - expected.values)),
+                             np.max(np.abs(energy_dask[0] - expected.values)))
+
+        logging.info("%s: unfused: %.1fM turbine-hours/s, fused (numpy): %.1fM turbine-hours/s, "
+                     "fused (dask): %.1fM turbine-hours/s, calc_simulated_energy(): "
+                     "%.1fM turbine-hours/s, max difference: %.2gGWh", power_curve_name,
+                     turbine_hours / time_unfused * 1e-6, turbine_hours / time_numpy * 1e-6,
+                     turbine_hours / time_dask * 1e-6, turbine_hours / time_total * 1e-6,
+                     max_difference)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Measure startup time, i.e. the time needed to import the package in a fresh interpreter. Importing
+must not parse the NREL SAM table of turbine models, this is done only on first access.
+"""
+
+import sys
+import time
+import logging
+import subprocess
+
+from wind_repower_usa.logging_config import setup_logging
+
+
+def import_time(module, repetitions=5):
+    times = []
+    for _ in range(repetitions):
+        t0 = time.time()
+        subprocess.run([sys.executable, '-c', f'import {module}'], check=True)
+        times.append(time.time() - t0)
+    return min(times)
+
+
+def main():
+    setup_logging(fname=None)
+
+    baseline = import_time('xarray')
+    logging.info("Import xarray (baseline): %.3fs", baseline)
+
+    for module in ('wind_repower_usa.turbine_models', 'wind_repower_usa.load_data',
+                   'wind_repower_usa.calculations'):
+        logging.info("Import %s: %.3fs", module, import_time(module))
+
+    from wind_repower_usa import turbine_models
+    t0 = time.time()
+    turbine_models.se_34m114
+    logging.info("First access to a NREL SAM turbine model: %.3fs", time.time() - t0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Compare interpolation of ERA5 wind velocity at turbine locations using ``xr.Dataset.interp()`` with
+the precomputed sparse interpolation stencil. Uses synthetic data of similar size as one month of
+ERA5 data for the USA.
+"""
+
+import time
+import logging
+
+import numpy as np
+import xarray as xr
+
+from wind_repower_usa.calculations import calc_wind_speed_at_turbines
+from wind_repower_usa.interpolation import calc_interpolation_stencil, stencil_to_sparse
+from wind_repower_usa.load_data import NUM_TURBINES
+from wind_repower_usa.logging_config import setup_logging
+
+
+def synthetic_data(num_time_stamps=744, num_turbines=NUM_TURBINES):
+    np.random.seed(42)
+
+    # ERA5 grid with 0.25° resolution, latitude is descending like in downloaded files
+    latitude = np.arange(67.75, 16.75, -0.25)
+    longitude = np.arange(-172.75, -64.5, 0.25)
+
+    shape = num_time_stamps, len(latitude), len(longitude)
+    wind_velocity = xr.Dataset({
+        'u100': (('time', 'latitude', 'longitude'), np.random.rand(*shape).astype(np.float32)),
+        'v100': (('time', 'latitude', 'longitude'), np.random.rand(*shape).astype(np.float32)),
+    },
+        coords={
+            'time': np.arange(num_time_stamps),
+            'latitude': latitude,
+            'longitude': longitude,
+        }
+    )
+
+    turbines = xr.Dataset({
+        'xlong': ('turbines', np.random.uniform(-125., -67., size=num_turbines)),
+        'ylat': ('turbines', np.random.uniform(25., 49., size=num_turbines)),
+    },
+        coords={'turbines': np.arange(num_turbines)}
+    )
+    return wind_velocity, turbines
+
+
+def main():
+    setup_logging(fname=None)
+
+    wind_velocity, turbines = synthetic_data()
+    num_months = 228
+
+    t0 = time.time()
+    wind_speed_interp = calc_wind_speed_at_turbines(wind_velocity, turbines).compute()
+    time_interp = time.time() - t0
+    logging.info("xr.Dataset.interp(): %.2fs per month", time_interp)
+
+    t0 = time.time()
+    stencil = calc_interpolation_stencil(turbines, wind_velocity.latitude,
+                                         wind_velocity.longitude)
+    weights = stencil_to_sparse(stencil)
+    time_stencil = time.time() - t0
+    logging.info("Calculating stencil (once): %.2fs", time_stencil)
+
+    t0 = time.time()
+    wind_speed_sparse = calc_wind_speed_at_turbines(wind_velocity, turbines, stencil=stencil,
+                                                    weights=weights).compute()
+    time_sparse = time.time() - t0
+    logging.info("Sparse stencil: %.2fs per month", time_sparse)
+
+    logging.info("Speedup: %.1fx per month, %.1fx for %s months",
+                 time_interp / time_sparse,
+                 (num_months * time_interp) / (time_stencil + num_months * time_sparse),
+                 num_months)
+    logging.info("Max absolute difference: %s m/s",
+                 float(np.abs(wind_speed_interp - wind_speed_sparse).max()))
+
+
+if __name__ == '__main__':
+    main()
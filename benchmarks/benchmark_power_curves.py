@@ -0,0 +1,65 @@
+"""
+Compare accuracy and speed of lookup table power curves (PowerCurve) with the ``interp1d`` power
+curves defined in turbine_models.
+"""
+
+import time
+import logging
+
+import numpy as np
+
+from wind_repower_usa.logging_config import setup_logging
+from wind_repower_usa.power_curves import PowerCurve, PowerCurves
+from wind_repower_usa.turbine_models import ge15_77, e138ep3, se_42m140, e126
+
+
+TURBINE_MODELS = ge15_77, e138ep3, se_42m140, e126
+
+# 0.7 is not a divisor of breakpoints of the power curves, i.e. the lookup table is not exact
+RESOLUTIONS = 0.001, 0.01, 0.1, 0.7
+
+
+def timeit(func, *args, repetitions=3, **kwargs):
+    times = []
+    for _ in range(repetitions):
+        t0 = time.time()
+        func(*args, **kwargs)
+        times.append(time.time() - t0)
+    return min(times)
+
+
+def main():
+    setup_logging(fname=None)
+
+    num_samples = 10_000_000
+    np.random.seed(42)
+    wind_speeds = (np.random.weibull(2., size=num_samples) * 8.).astype(np.float32)
+    wind_speeds64 = wind_speeds.astype(np.float64)
+    out = np.empty_like(wind_speeds)
+
+    for turbine_model in TURBINE_MODELS:
+        expected = turbine_model.power_curve(wind_speeds64)
+        time_interp1d = timeit(turbine_model.power_curve, wind_speeds)
+        logging.info("%s: interp1d: %.1fM samples/s", turbine_model.file_name,
+                     num_samples / time_interp1d * 1e-6)
+
+        for resolution in RESOLUTIONS:
+            power_curve = PowerCurve.from_interp1d(turbine_model.power_curve, resolution)
+            time_lookup = timeit(power_curve, wind_speeds, out=out)
+            max_error_kw = np.max(np.abs(power_curve(wind_speeds64) - expected))
+            max_error_kw_float32 = np.max(np.abs(power_curve(wind_speeds) - expected))
+            logging.info("%s: lookup table (resolution=%sm/s): %.1fM samples/s (%.1fx), "
+                         "max error: %.2gkW (float64), %.2gkW (float32)",
+                         turbine_model.file_name, resolution, num_samples / time_lookup * 1e-6,
+                         time_interp1d / time_lookup, max_error_kw, max_error_kw_float32)
+
+    time_interp1d = sum(timeit(turbine_model.power_curve, wind_speeds)
+                        for turbine_model in TURBINE_MODELS)
+    power_curves = PowerCurves([turbine_model.power_curve for turbine_model in TURBINE_MODELS])
+    time_lookup = timeit(power_curves, wind_speeds)
+    logging.info("All %s models at once: interp1d: %.2fs, lookup table: %.2fs (%.1fx)",
+                 len(TURBINE_MODELS), time_interp1d, time_lookup, time_interp1d / time_lookup)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Compare wind rose histograms and prevailing wind direction calculated for all turbines at once
+with the previous loop over turbines (np.histogram() and uniform_filter() per turbine).
+"""
+
+import time
+import logging
+
+import numpy as np
+from scipy.ndimage import uniform_filter, uniform_filter1d
+
+from wind_repower_usa.load_data import NUM_TURBINES
+from wind_repower_usa.logging_config import setup_logging
+from wind_repower_usa.wind_direction import calc_direction_histograms
+
+BINS = 70
+BOXCAR_WIDTH = 3
+
+# 8000 samples for all turbines as in calc_prevail_wind_direction.py needs ~7GB for directions and
+# energy, so the benchmark uses less samples
+NUM_SAMPLES = 2000
+
+# the loop is slow, runs only for a subset of turbines and time is extrapolated
+NUM_TURBINES_LOOP = 2000
+
+
+def wind_rose_loop(directions, energy):
+    wind_roses = []
+    prevail_wind_direction = []
+    for turbine_idx in range(directions.shape[1]):
+        values, bin_edges = np.histogram(directions[:, turbine_idx],
+                                         weights=energy[:, turbine_idx],
+                                         range=(-np.pi, np.pi), bins=BINS, density=True)
+        wind_roses.append(values)
+        convoluted = uniform_filter(values, BOXCAR_WIDTH, mode='wrap')
+        prevail_wind_direction.append(np.argmax(convoluted))
+    return np.array(wind_roses), np.array(prevail_wind_direction)
+
+
+def wind_rose_vectorized(directions, energy):
+    wind_roses, bin_edges = calc_direction_histograms(directions, energy, bins=BINS)
+    convoluted = uniform_filter1d(wind_roses, BOXCAR_WIDTH, axis=1, mode='wrap')
+    return wind_roses, np.argmax(convoluted, axis=1)
+
+
+def main():
+    setup_logging(fname=None)
+
+    np.random.seed(42)
+    shape = NUM_SAMPLES, NUM_TURBINES
+    directions = np.arctan2(np.random.normal(size=shape), np.random.normal(size=shape) + 0.5)
+    energy = np.random.weibull(2., size=shape)
+
+    t0 = time.time()
+    wind_roses, prevail_wind_direction = wind_rose_vectorized(directions, energy)
+    time_vectorized = time.time() - t0
+
+    t0 = time.time()
+    wind_roses_loop, prevail_wind_direction_loop = wind_rose_loop(
+        directions[:, :NUM_TURBINES_LOOP], energy[:, :NUM_TURBINES_LOOP])
+    time_loop = (time.time() - t0) * NUM_TURBINES / NUM_TURBINES_LOOP
+
+    is_identical = (np.array_equal(wind_roses_loop, wind_roses[:NUM_TURBINES_LOOP]) and
+                    np.array_equal(prevail_wind_direction_loop,
+                                   prevail_wind_direction[:NUM_TURBINES_LOOP]))
+
+    logging.info("%s samples x %s turbines: loop: %.1fs (extrapolated), vectorized: %.1fs "
+                 "(%.0fx), identical: %s", NUM_SAMPLES, NUM_TURBINES, time_loop, time_vectorized,
+                 time_loop / time_vectorized, is_identical)
+
+
+if __name__ == '__main__':
+    main()
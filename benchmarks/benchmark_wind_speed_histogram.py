@@ -0,0 +1,62 @@
+"""
+Compare energy generation per location calculated from hourly wind speed with energy calculated
+from wind speed histograms (one year, all turbine locations).
+"""
+
+import time
+import logging
+
+import dask.array as da
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from wind_repower_usa.calculations import calc_simulated_energy
+from wind_repower_usa.load_data import NUM_TURBINES
+from wind_repower_usa.logging_config import setup_logging
+from wind_repower_usa.turbine_models import ge15_77, e138ep3, e126
+from wind_repower_usa.wind_speed_histogram import calc_wind_speed_histogram
+from wind_repower_usa.wind_speed_histogram import calc_simulated_energy_from_histogram
+
+
+TURBINE_MODELS = ge15_77, e138ep3, e126
+
+
+def main():
+    setup_logging(fname=None)
+
+    # generated lazily chunk by chunk, one year for all turbines does not fit into memory
+    num_time_stamps = 24 * 365
+    wind_speed = xr.DataArray(
+        da.random.RandomState(42).weibull(2., size=(num_time_stamps, NUM_TURBINES),
+                                          chunks=(num_time_stamps, 1000)) * 8.,
+        dims=('time', 'turbines'),
+        coords={'time': pd.date_range('2017-01-01', periods=num_time_stamps, freq='h'),
+                'turbines': np.arange(NUM_TURBINES)})
+    turbines = xr.Dataset(coords={'turbines': np.arange(NUM_TURBINES)})
+
+    t0 = time.time()
+    wind_speed_histogram = calc_wind_speed_histogram(wind_speed)
+    logging.info("Histogram: %.1fs", time.time() - t0)
+
+    for turbine_model in TURBINE_MODELS:
+        t0 = time.time()
+        expected = calc_simulated_energy(wind_speed, turbines,
+                                         power_curve=turbine_model.power_curve,
+                                         sum_along='time', capacity_scaling=False,
+                                         only_built_turbines=False)
+        time_hourly = time.time() - t0
+
+        t0 = time.time()
+        simulated_energy_gwh = calc_simulated_energy_from_histogram(wind_speed_histogram,
+                                                                    turbine_model.power_curve)
+        time_histogram = time.time() - t0
+
+        max_rel_error = np.max(np.abs(simulated_energy_gwh.values / expected.values - 1))
+        logging.info("%s: hourly: %.2fs, histogram: %.1fms (%.0fx), max relative error: %.2g",
+                     turbine_model.file_name, time_hourly, time_histogram * 1e3,
+                     time_hourly / time_histogram, max_rel_error)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,31 @@
 import logging
 
-from wind_repower_usa.config import INTERIM_DIR, MONTHS
-from wind_repower_usa.load_data import load_turbines, load_wind_velocity, load_wind_speed
-from wind_repower_usa.wind_direction import calc_wind_rose
+import numpy as np
+import xarray as xr
+
+from wind_repower_usa.config import INTERIM_DIR, MONTHS, YEARS
+from wind_repower_usa.load_data import load_turbines
+from wind_repower_usa.wind_direction import calc_wind_rose_streaming, calc_directivity_profile
 from wind_repower_usa.logging_config import setup_logging
 
 
 setup_logging()
 
-years = range(2000, 2018)
-num_samples = 8_000
+years = YEARS
+
+# in degree, for directivity profiles
+directivity_widths = np.arange(5, 185, 5)
 
-logging.info(f"Calculate prevailing wind direction from years={years}, "
-             f"num_samples={num_samples}...")
+logging.info(f"Calculate prevailing wind direction from all hours of years={years}...")
 
 turbines = load_turbines()
-wind_velocity = load_wind_velocity(year=years, month=MONTHS)
-wind_speed = load_wind_speed(years=years, months=MONTHS)
 
-wind_rose, prevail_wind_direction, directivity = calc_wind_rose(turbines,
-                                                                wind_speed,
-                                                                wind_velocity,
-                                                                power_curve=None,
-                                                                bins=70,
-                                                                directivity_width=15,
-                                                                num_samples=num_samples)
+wind_rose, prevail_wind_direction, directivity = calc_wind_rose_streaming(turbines,
+                                                                          years=years,
+                                                                          months=MONTHS,
+                                                                          power_curve=None,
+                                                                          bins=70,
+                                                                          directivity_width=15)
 
 
 # TODO should have the parameters in file name or better not?
@@ -32,4 +33,11 @@ prevail_wind_direction.to_netcdf(INTERIM_DIR / 'wind-direction' / 'prevail_wind_
 wind_rose.to_netcdf(INTERIM_DIR / 'wind-direction' / 'wind_rose.nc')
 directivity.to_netcdf(INTERIM_DIR / 'wind-direction' / 'directivity.nc')
 
+logging.info("Calculate directivity profiles...")
+prevail_wind_direction_profile, directivity_profile = calc_directivity_profile(wind_rose,
+                                                                               directivity_widths)
+xr.Dataset({'prevail_wind_direction': prevail_wind_direction_profile,
+            'directivity': directivity_profile}).to_netcdf(
+    INTERIM_DIR / 'wind-direction' / 'directivity_profile.nc')
+
 logging.info("Done...!")
@@ -1,39 +1,56 @@
 import logging
 
-from wind_repower_usa.calculations import calc_simulated_energy
-from wind_repower_usa.config import MONTHS, INTERIM_DIR
-from wind_repower_usa.load_data import load_wind_speed, load_turbines
+from wind_repower_usa.calculations import calc_simulated_energy_per_location_years
+from wind_repower_usa.calculations import calc_capacity_scaling
+from wind_repower_usa.config import INTERIM_DIR, YEARS
+from wind_repower_usa.load_data import load_turbines
 from wind_repower_usa.logging_config import setup_logging
 from wind_repower_usa.turbine_models import ge15_77, new_turbine_models
 
 setup_logging()
 
-year = 2017
+years = YEARS
 turbines = load_turbines()
 turbine_models = [ge15_77] + list(new_turbine_models())
 
-for turbine_model in turbine_models:
+
+def output_fname(turbine_model, per_year=False):
     # simulates the power generation in the current situation for first turbine
     capacity_scaling = turbine_model == ge15_77
-
     scaling_str = '' if not capacity_scaling else '_capacity_scaled'
-    fname = (INTERIM_DIR / 'simulated_energy_per_location' /
-             f'simulated_energy_{turbine_model.file_name}{scaling_str}_gwh.nc')
+    per_year_str = '' if not per_year else '_per_year'
+    return (INTERIM_DIR / 'simulated_energy_per_location' /
+            f'simulated_energy_{turbine_model.file_name}{scaling_str}{per_year_str}_gwh.nc')
+
 
-    if fname.exists():
-        logging.info("Skipping %s, file already exists", fname)
+missing_turbine_models = []
+for turbine_model in turbine_models:
+    if output_fname(turbine_model).exists() and output_fname(turbine_model, per_year=True).exists():
+        logging.info("Skipping %s, file already exists", output_fname(turbine_model))
         continue
+    missing_turbine_models.append(turbine_model)
+turbine_models = missing_turbine_models
+
+if turbine_models:
+    logging.info("Calculating simulated energy for %s, years=%s",
+                 ', '.join(turbine_model.name for turbine_model in turbine_models), years)
+
+    # power generation per turbine and year, all turbine models in one pass over the data
+    simulated_energy_gwh_per_year = calc_simulated_energy_per_location_years(
+        years, turbine_models, turbines)
 
-    logging.info("Calculating simulated energy for %s", turbine_model.name)
+    for turbine_model in turbine_models:
+        simulated_energy_gwh_model = simulated_energy_gwh_per_year.sel(
+            turbine_model=turbine_model.file_name, drop=True)
 
-    # power generation per turbine for one year
-    wind_speed = load_wind_speed(year, MONTHS)
+        if turbine_model == ge15_77:
+            simulated_energy_gwh_model = (simulated_energy_gwh_model *
+                                          calc_capacity_scaling(turbines))
+            simulated_energy_gwh_model.name = simulated_energy_gwh_per_year.name
 
-    # FIXME this is not in gwh, but in gwh/yr or whatever time range wind_speed is!
-    simulated_energy_gwh = calc_simulated_energy(wind_speed, turbines,
-                                                 power_curve=turbine_model.power_curve,
-                                                 sum_along='time',
-                                                 capacity_scaling=capacity_scaling,
-                                                 only_built_turbines=False)
+        simulated_energy_gwh_model.attrs['years'] = f'{years[0]}-{years[-1]}'
+        simulated_energy_gwh_model.to_netcdf(output_fname(turbine_model, per_year=True))
 
-    simulated_energy_gwh.to_netcdf(fname)
+        # long-term annual mean, used for optimization and repower potential
+        simulated_energy_gwh_model.mean(dim='year', keep_attrs=True).to_netcdf(
+            output_fname(turbine_model))
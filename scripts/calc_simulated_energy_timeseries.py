@@ -1,14 +1,28 @@
-from wind_repower_usa.config import YEARS, INTERIM_DIR
+from wind_repower_usa.config import YEARS, INTERIM_DIR, NUM_PROCESSES
 from wind_repower_usa.logging_config import setup_logging
 from wind_repower_usa.calculations import calc_simulated_energy_years
 from wind_repower_usa.turbine_models import ge15_77
 
-setup_logging()
 
-turbine_model = ge15_77
+def main():
+    setup_logging()
 
-simulated_energy_gwh = calc_simulated_energy_years(YEARS, power_curve=turbine_model.power_curve)
+    turbine_model = ge15_77
 
-simulated_energy_gwh.to_netcdf(
-    INTERIM_DIR / 'simulated_energy_timeseries' /
-    f'simulated_energy_timeseries_{turbine_model.file_name}_gwh.nc')
+    # months are calculated in parallel, finished months are kept in checkpoint_dir, i.e. the
+    # script can be restarted if interrupted (remove checkpoint_dir if input data changes!)
+    checkpoint_dir = (INTERIM_DIR / 'simulated_energy_timeseries' /
+                      f'checkpoints_{turbine_model.file_name}')
+
+    simulated_energy_gwh = calc_simulated_energy_years(YEARS,
+                                                       power_curve=turbine_model.power_curve,
+                                                       num_processes=NUM_PROCESSES,
+                                                       checkpoint_dir=checkpoint_dir)
+
+    simulated_energy_gwh.to_netcdf(
+        INTERIM_DIR / 'simulated_energy_timeseries' /
+        f'simulated_energy_timeseries_{turbine_model.file_name}_gwh.nc')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,191 @@
 """
-Generate wind speed data from wind velocity.
+Generate wind speed and wind direction data from wind velocity.
 """
 
+import time
 import logging
+
+import xarray as xr
 from dask.diagnostics import ProgressBar
 
-from wind_repower_usa.config import YEARS, MONTHS, INTERIM_DIR
-from wind_repower_usa.load_data import load_turbines
+from wind_repower_usa.config import YEARS, MONTHS, INTERIM_DIR, WIND_SPEED_STORAGE
+from wind_repower_usa.config import NUM_PROCESSES
+from wind_repower_usa.interpolation import calc_interpolation_stencil, stencil_to_sparse
+from wind_repower_usa.interpolation import calc_grid_cells
+from wind_repower_usa.load_data import load_turbines, load_interpolation_stencil
 from wind_repower_usa.load_data import load_wind_velocity
-from wind_repower_usa.calculations import calc_wind_speed_at_turbines
+from wind_repower_usa.calculations import calc_wind_speed_and_direction_at_turbines
+from wind_repower_usa.pipeline import create_pool, prefetch_months, get_worker_data
+from wind_repower_usa.pipeline import set_worker_data
+from wind_repower_usa.storage import append_wind_speed, append_wind_velocity_cells, stored_months
+from wind_repower_usa.storage import WIND_VELOCITY_CELLS_STORE, write_wind_speed
+from wind_repower_usa.storage import write_wind_direction
 
 from wind_repower_usa.logging_config import setup_logging
 
 
-def main():
-    setup_logging()
+def wind_speed_fname(year, month):
+    return (INTERIM_DIR / 'wind_speed_usa_era5' /
+            'wind_speed_usa_era5-{}-{:02d}.nc'.format(year, month))
+
+
+def wind_direction_fname(year, month):
+    return (INTERIM_DIR / 'wind_direction_usa_era5' /
+            'wind_direction_usa_era5-{}-{:02d}.nc'.format(year, month))
+
+
+def is_converted(year, month, months_in_store):
+    """Wind speed of a month is either in the store or in a monthly file not appended yet."""
+    return (wind_direction_fname(year, month).exists() and
+            ((year, month) in months_in_store or wind_speed_fname(year, month).exists()))
+
+
+def load_wind_velocity_month(year, month):
+    return load_wind_velocity(year=year, month=month)[['u100', 'v100']].load()
+
+
+def convert_wind_velocity(year, month, wind_velocity):
+    """Interpolate wind velocity of one month at turbine locations and write wind speed and wind
+    direction to netCDF files (atomically, i.e. files exist only if they have been written
+    completely, see write_wind_speed()). Turbines, stencil and weights are taken from
+    get_worker_data(). Returns timings for computation and writing in seconds."""
+    t0 = time.time()
+    wind_speed, wind_direction = calc_wind_speed_and_direction_at_turbines(
+        wind_velocity, get_worker_data('turbines'), stencil=get_worker_data('stencil'),
+        weights=get_worker_data('weights'))
+    wind_speed = wind_speed.load()
+    wind_direction = wind_direction.load()
+
+    t1 = time.time()
+    write_wind_direction(wind_direction, wind_direction_fname(year, month))
+    write_wind_speed(wind_speed, wind_speed_fname(year, month))
+
+    return t1 - t0, time.time() - t1
+
+
+def convert_month(year_month):
+    """Read and convert one month, runs in worker processes. Returns timings in seconds."""
+    year, month = year_month
+
+    t0 = time.time()
+    wind_velocity = load_wind_velocity_month(year, month)
+    time_read = time.time() - t0
+
+    return (year, month, time_read) + convert_wind_velocity(year, month, wind_velocity)
+
+
+def convert_months_prefetched(year_months):
+    """Same as ``map(convert_month, year_months)``, but in the current process: the next month
+    is read on a background thread while the current month is converted. Read time is the time
+    spent waiting for data."""
+    t0 = time.time()
+    for year, month, wind_velocity in prefetch_months(load_wind_velocity_month, year_months):
+        time_read = time.time() - t0
+        yield (year, month, time_read) + convert_wind_velocity(year, month, wind_velocity)
+        t0 = time.time()
+
+
+def calc_wind_speed_turbines(turbines, stencil, num_processes=NUM_PROCESSES):
+    """Interpolate wind speed and wind direction at turbine locations, write one file per month
+    each and append wind speed to the wind speed store. Months are converted in parallel
+    processes (or with prefetching if ``num_processes`` is 1), i.e. reading a file overlaps with
+    computations on other files. Appending to the store happens in order in the main process, the
+    monthly wind speed file is removed afterwards to not keep the data twice."""
+    # sent once to each worker process, not with every month
+    worker_data = {'turbines': turbines, 'stencil': stencil, 'weights': stencil_to_sparse(stencil)}
+    months_in_store = stored_months()
+
+    year_months = [(year, month) for year in YEARS for month in MONTHS]
+
+    # here is a poor man Makefile, because it takes some while to convert all files: files are
+    # written atomically, so existing files are complete
+    months_to_convert = [(year, month) for year, month in year_months
+                         if not is_converted(year, month, months_in_store)]
+    logging.info("Converting %s months (%s converted already) in %s processes...",
+                 len(months_to_convert), len(year_months) - len(months_to_convert), num_processes)
+
+    if num_processes == 1:
+        set_worker_data(worker_data)
+        converted = convert_months_prefetched(months_to_convert)
+    else:
+        pool = create_pool(num_processes, worker_data=worker_data)
+        converted = pool.imap(convert_month, months_to_convert)
+
+    # decided once before starting: workers write files while this loop runs, so checking
+    # whether a file exists here would skip results of months converted in the meantime
+    months_to_convert = set(months_to_convert)
+
+    try:
+        converted = iter(converted)
+        for year, month in year_months:
+            if (year, month) in months_to_convert:
+                # imap returns results in order, i.e. this waits until the month is converted
+                converted_year, converted_month, time_read, time_compute, time_write = next(
+                    converted)
+                if (converted_year, converted_month) != (year, month):
+                    raise RuntimeError(f"expected {year}-{month:02d}, got "
+                                       f"{converted_year}-{converted_month:02d}")
+                logging.info("Converted %s-%02d: read %.1fs, compute %.1fs, write %.1fs", year,
+                             month, time_read, time_compute, time_write)
+
+            # months need to be appended in order, the store is used by load_wind_speed()
+            fname = wind_speed_fname(year, month)
+            if (year, month) not in months_in_store:
+                logging.info("Appending %s-%02d to wind speed store...", year, month)
+                with xr.open_dataarray(fname) as wind_speed:
+                    append_wind_speed(wind_speed)
+
+            # also removes files left over if interrupted after appending
+            if fname.exists():
+                fname.unlink()
+    finally:
+        if num_processes != 1:
+            pool.terminate()
+
+
+def calc_wind_velocity_cells(stencil):
+    """Store wind velocity only for grid cells needed for interpolation at turbine locations,
+    load_wind_speed() interpolates on demand."""
+    grid_cells = calc_grid_cells(stencil)
+    logging.info("Storing %s grid cells for %s turbines",
+                 grid_cells.sizes['cells'], grid_cells.sizes['turbines'])
+
+    months_in_store = stored_months(WIND_VELOCITY_CELLS_STORE)
 
-    turbines = load_turbines()
     with ProgressBar():
         for year in YEARS:
             for month in MONTHS:
-                fname = (INTERIM_DIR / 'wind_speed_usa_era5' /
-                         'wind_speed_usa_era5-{}-{:02d}.nc'.format(year, month))
-
-                # here is a poor man Makefile, because it takes some while to convert all files
-                if fname.exists():
-                    logging.debug("Skipping %s", fname)
+                if (year, month) in months_in_store:
+                    logging.debug("Skipping %s-%02d", year, month)
                     continue
 
-                logging.info("Processing %s...", fname)
-
+                logging.info("Appending %s-%02d to wind velocity store...", year, month)
                 wind_velocity = load_wind_velocity(year=year, month=month)
-                wind_speed = calc_wind_speed_at_turbines(wind_velocity, turbines)
+                append_wind_velocity_cells(wind_velocity, grid_cells)
+
+
+def main():
+    setup_logging()
+
+    turbines = load_turbines(columns=['xlong', 'ylat'])
+
+    # interpolation weights depend only on grid and turbine locations, no need to calculate them
+    # again for every month
+    stencil_fname = INTERIM_DIR / 'interpolation' / 'interpolation_stencil_era5.nc'
+    if not stencil_fname.exists():
+        logging.info("Calculating interpolation stencil %s...", stencil_fname)
+        wind_velocity = load_wind_velocity(year=YEARS[0], month=MONTHS[0])
+        stencil = calc_interpolation_stencil(turbines,
+                                             latitude=wind_velocity.latitude.values,
+                                             longitude=wind_velocity.longitude.values)
+        stencil.to_netcdf(stencil_fname)
+
+    stencil = load_interpolation_stencil()
 
-                wind_speed.to_netcdf(fname)
+    if WIND_SPEED_STORAGE == 'grid_cells':
+        calc_wind_velocity_cells(stencil)
+    else:
+        calc_wind_speed_turbines(turbines, stencil)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,35 @@
+"""
+Calculate the distribution of wind speeds for each turbine location. Energy generation per location
+for any power curve can be derived from the histogram quickly, see
+calc_simulated_energy_from_histogram().
+"""
+
+import logging
+
+from wind_repower_usa.config import INTERIM_DIR, MONTHS, YEARS
+from wind_repower_usa.load_data import load_wind_speed
+from wind_repower_usa.logging_config import setup_logging
+from wind_repower_usa.wind_speed_histogram import calc_wind_speed_histogram
+
+
+def main():
+    setup_logging()
+
+    years = YEARS
+    fname = (INTERIM_DIR / 'wind_speed_histogram' /
+             f'wind_speed_histogram_{years[0]}-{years[-1]}.nc')
+
+    if fname.exists():
+        logging.info("Skipping %s, file already exists", fname)
+        return
+
+    logging.info("Calculating wind speed histogram for years=%s...", years)
+    wind_speed = load_wind_speed(years, MONTHS, reduce_along='time')
+    wind_speed_histogram = calc_wind_speed_histogram(wind_speed)
+    wind_speed_histogram.to_netcdf(fname)
+
+    logging.info("Done...!")
+
+
+if __name__ == '__main__':
+    main()
@@ -17,7 +17,7 @@ def main():
 
     download_dir = EXTERNAL_DIR / 'wind_velocity_usa_era5'
 
-    turbines = load_turbines()
+    turbines = load_turbines(columns=['xlong', 'ylat'])
     north, west, south, east = calc_bounding_box_usa(turbines)
 
     # Format for downloading ERA5: North/West/South/East
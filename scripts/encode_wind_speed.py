@@ -0,0 +1,52 @@
+"""
+Re-encode wind speed written before WIND_SPEED_ENCODING was introduced (float64, uncompressed) in
+place: monthly netCDF files and Zarr stores. Can be interrupted and restarted at any time, files
+and stores which are encoded already are skipped, interrupted swaps of stores are finished or
+rolled back.
+"""
+
+import logging
+
+import xarray as xr
+
+from wind_repower_usa.config import INTERIM_DIR
+from wind_repower_usa.logging_config import setup_logging
+from wind_repower_usa.storage import encode_wind_speed_store, is_encoded, write_wind_speed
+from wind_repower_usa.storage import recover_store_swap
+from wind_repower_usa.storage import WIND_SPEED_STORE, WIND_SPEED_STORE_TURBINE_MAJOR
+
+
+def encode_wind_speed_files():
+    fnames = sorted((INTERIM_DIR / 'wind_speed_usa_era5').glob('wind_speed_usa_era5-*.nc'))
+    for fname in fnames:
+        with xr.open_dataarray(fname) as wind_speed:
+            if is_encoded(wind_speed):
+                logging.debug("Skipping %s, encoded already", fname)
+                continue
+            wind_speed = wind_speed.load()
+
+        size_before = fname.stat().st_size
+        write_wind_speed(wind_speed, fname)
+        logging.info("Encoded %s: %.0fMB -> %.0fMB", fname, size_before / 1e6,
+                     fname.stat().st_size / 1e6)
+
+
+def main():
+    setup_logging()
+
+    encode_wind_speed_files()
+
+    for store in (WIND_SPEED_STORE, WIND_SPEED_STORE_TURBINE_MAJOR):
+        # a crash between moving the store away and moving the encoded copy in leaves no store
+        recover_store_swap(store)
+        if not store.exists():
+            continue
+        logging.info("Encoding %s...", store)
+        if not encode_wind_speed_store(store):
+            logging.info("Skipping %s, encoded already", store)
+
+    logging.info("Done...!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+"""
+Write a second copy of the wind speed store with a turbine-major layout, i.e. with chunks covering
+a long time range for a small number of turbines. Used by reductions along time over all years at
+once, i.e. calc_wind_speed_histogram.py, see load_wind_speed(). Optional, per location energy and
+wind roses are accumulated month by month from the time-major store.
+"""
+
+from wind_repower_usa.logging_config import setup_logging
+from wind_repower_usa.storage import rechunk_wind_speed
+
+
+def main():
+    setup_logging()
+    rechunk_wind_speed()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""
+Quantify the difference of simulated energy calculated in float32 instead of float64 (see
+COMPUTE_DTYPE in config) for one year of data.
+"""
+
+import logging
+
+from wind_repower_usa.calculations import calc_precision_report
+from wind_repower_usa.config import INTERIM_DIR, MONTHS
+from wind_repower_usa.load_data import load_wind_speed, load_turbines, stored_wind_speed_dtype
+from wind_repower_usa.logging_config import setup_logging
+
+
+def main():
+    setup_logging()
+
+    year = 2017
+    turbines = load_turbines()
+
+    logging.info("Validating float32 computation for year=%s...", year)
+    # load_wind_speed() always returns COMPUTE_DTYPE, rounding on disk is not visible there
+    stored_dtype = stored_wind_speed_dtype(year, MONTHS[0])
+    if stored_dtype != 'float64':
+        logging.warning("Wind speed is stored as %s, difference to float64 input is not "
+                        "contained in the report", stored_dtype)
+
+    wind_speed = load_wind_speed(year, MONTHS)
+
+    report = calc_precision_report(wind_speed, turbines)
+
+    fname = INTERIM_DIR / 'validation' / f'float32_report_{year}.csv'
+    report.to_csv(fname)
+    logging.info("Difference float32 vs float64:\n%s", report.to_string())
+
+    logging.info("Done...!")
+
+
+if __name__ == '__main__':
+    main()
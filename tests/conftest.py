@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+
+@pytest.fixture
+def synthetic_wind_speed():
+    """Factory for reproducible Weibull distributed wind speed with dims time, turbines, takes the
+    time index (or start and number of hours) and the number of turbines."""
+    def create(time=None, num_turbines=30, start='2017-01-01', periods=24 * 10):
+        if time is None:
+            time = pd.date_range(start, periods=periods, freq='h')
+        np.random.seed(42)
+        return xr.DataArray(np.random.weibull(2., size=(len(time), num_turbines)) * 9.,
+                            dims=('time', 'turbines'),
+                            coords={'time': time, 'turbines': np.arange(num_turbines)})
+    return create
+
+
+@pytest.fixture
+def commissioned_turbines():
+    """Five turbines commissioned in different years, one of them without commissioning year and
+    one without capacity."""
+    return xr.Dataset({'p_year': ('turbines', [2015., 2016., 2017., 2018., np.nan]),
+                       't_cap': ('turbines', [1500., 3000., np.nan, 1500., 1500.])},
+                      coords={'turbines': np.arange(5)})
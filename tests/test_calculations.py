@@ -1,9 +1,18 @@
 import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
 
 from wind_repower_usa.load_data import load_turbines, load_wind_speed
 from wind_repower_usa.load_data import load_wind_velocity
 from wind_repower_usa.calculations import calc_bounding_box_usa, calc_simulated_energy
 from wind_repower_usa.calculations import calc_wind_speed_at_turbines
+from wind_repower_usa import calculations
+from wind_repower_usa.calculations import calc_simulated_energy_models, calc_precision_report
+from wind_repower_usa.calculations import calc_simulated_energy_per_location_years
+from wind_repower_usa.calculations import calc_simulated_energy_years
+from wind_repower_usa.energy_kernel import BufferPool
+from wind_repower_usa.turbine_models import ge15_77, e138ep3, se_42m140, e126
 
 
 def test_calc_wind_speed_at_turbines():
@@ -29,3 +38,175 @@ def test_calc_simulated_energy():
     simulated_energy_timeseries_gwh = calc_simulated_energy(wind_speed, turbines)
     np.testing.assert_almost_equal(simulated_energy_timeseries_gwh.isel(time=0).values,
                                    15773.1596734)
+
+
+@pytest.mark.parametrize('chunks', [None, {'time': 48, 'turbines': 7}])
+def test_calc_simulated_energy_models(chunks, synthetic_wind_speed):
+    wind_speed = synthetic_wind_speed()
+    turbines = xr.Dataset(coords={'turbines': np.arange(30)})
+    if chunks is not None:
+        wind_speed = wind_speed.chunk(chunks)
+
+    turbine_models = [ge15_77, e138ep3, se_42m140, e126]
+    simulated_energy_gwh = calc_simulated_energy_models(wind_speed, turbines, turbine_models)
+
+    assert simulated_energy_gwh.dims == ('turbine_model', 'turbines')
+    assert list(simulated_energy_gwh.turbine_model.values) == [
+        turbine_model.file_name for turbine_model in turbine_models]
+
+    for turbine_model in turbine_models:
+        expected = calc_simulated_energy(wind_speed.copy(deep=True), turbines,
+                                         power_curve=turbine_model.power_curve,
+                                         sum_along='time', capacity_scaling=False,
+                                         only_built_turbines=False)
+        np.testing.assert_allclose(
+            simulated_energy_gwh.sel(turbine_model=turbine_model.file_name).values,
+            expected.values, rtol=1e-9)
+
+
+@pytest.mark.parametrize('chunks', [None, {'time': 24 * 30, 'turbines': 2}])
+def test_calc_simulated_energy_only_built_turbines(chunks, synthetic_wind_speed,
+                                                   commissioned_turbines):
+    time = pd.date_range('2015-12-01', '2017-01-31 23:00', freq='h')
+    wind_speed = synthetic_wind_speed(time, num_turbines=5)
+    turbines = commissioned_turbines
+
+    # expected: 0 before commission year, proportion of year in commission year, 1 after
+    building_dates = np.array(['2015', '2016', '2017', '2018', '2200'], dtype='datetime64[ns]')
+    proportion_of_year = ((time.values[:, np.newaxis] - building_dates).astype(np.float64) /
+                          (365.25 * 24 * 60 * 60 * 1e9))
+    year = time.year.values[:, np.newaxis]
+    p_year = turbines.p_year.values
+    weight = np.where(year == p_year, proportion_of_year, (year > p_year).astype(float))
+    expected = (ge15_77.power_curve(wind_speed.values) * weight).sum(axis=0) * 1e-6
+
+    if chunks is not None:
+        wind_speed = wind_speed.chunk(chunks)
+
+    simulated_energy_gwh = calc_simulated_energy(wind_speed, turbines, sum_along='time',
+                                                 capacity_scaling=False)
+
+    np.testing.assert_allclose(simulated_energy_gwh.values, expected, rtol=1e-12)
+    assert simulated_energy_gwh.values[3] == simulated_energy_gwh.values[4] == 0.
+
+
+@pytest.mark.parametrize('chunks', [None, {'time': 24 * 30, 'turbines': 2}])
+def test_calc_simulated_energy_monthly(chunks, synthetic_wind_speed, commissioned_turbines):
+    time = pd.date_range('2015-12-01', '2017-01-31 23:00', freq='h')
+    wind_speed = synthetic_wind_speed(time, num_turbines=5)
+    turbines = commissioned_turbines
+
+    hourly = calc_simulated_energy(wind_speed, turbines, sum_along='')
+    if chunks is not None:
+        wind_speed = wind_speed.chunk(chunks)
+
+    per_month = calc_simulated_energy(wind_speed, turbines, sum_along='turbines')
+    per_month_turbine = calc_simulated_energy(wind_speed, turbines, sum_along='month')
+
+    expected = hourly.resample(time='1MS').sum()
+    assert per_month.sizes['time'] == per_month_turbine.sizes['time'] == 14
+    np.testing.assert_array_equal(per_month.time, expected.time)
+    np.testing.assert_allclose(per_month, expected.sum(dim='turbines'), rtol=1e-12)
+    np.testing.assert_allclose(per_month_turbine.transpose('time', 'turbines'), expected,
+                               rtol=1e-12)
+
+
+@pytest.mark.parametrize('chunks', [None, {'time': 24 * 30, 'turbines': 2}])
+def test_calc_simulated_energy_float32(chunks, synthetic_wind_speed, commissioned_turbines):
+    time = pd.date_range('2016-01-01', '2016-12-31 23:00', freq='h')
+    wind_speed = synthetic_wind_speed(time, num_turbines=5)
+    turbines = commissioned_turbines
+
+    wind_speed_float32 = wind_speed.astype(np.float32)
+    if chunks is not None:
+        wind_speed = wind_speed.chunk(chunks)
+        wind_speed_float32 = wind_speed_float32.chunk(chunks)
+
+    hourly = calc_simulated_energy(wind_speed_float32, turbines, sum_along='')
+    assert hourly.dtype == np.float32
+
+    for sum_along in ('time', 'turbines', 'month'):
+        expected = calc_simulated_energy(wind_speed, turbines, sum_along=sum_along)
+        simulated_energy = calc_simulated_energy(wind_speed_float32, turbines,
+                                                 sum_along=sum_along)
+        assert simulated_energy.dtype == np.float64
+        np.testing.assert_allclose(simulated_energy, expected, rtol=1e-5)
+
+    report = calc_precision_report(wind_speed, turbines)
+    assert len(report) == 3
+    assert (report.max_rel_diff < 1e-5).all()
+
+
+def test_calc_simulated_energy_per_location_years(monkeypatch, synthetic_wind_speed):
+    time = pd.date_range('2015-01-01', '2016-12-31 23:00', freq='h')
+    wind_speed = synthetic_wind_speed(time, num_turbines=3)
+    turbines = xr.Dataset(coords={'turbines': np.arange(3)})
+
+    def load_wind_speed(years, months, reduce_along=None):
+        return wind_speed.sel(time=f'{years}-{months:02d}')
+
+    monkeypatch.setattr(calculations, 'load_wind_speed', load_wind_speed)
+
+    turbine_models = [ge15_77, e126]
+    simulated_energy = calc_simulated_energy_per_location_years([2015, 2016], turbine_models,
+                                                                turbines)
+
+    assert simulated_energy.dims == ('year', 'turbine_model', 'turbines')
+    np.testing.assert_array_equal(simulated_energy.year, [2015, 2016])
+    for year in (2015, 2016):
+        expected = calc_simulated_energy_models(wind_speed.sel(time=str(year)), turbines,
+                                                turbine_models)
+        np.testing.assert_allclose(simulated_energy.sel(year=year), expected, rtol=1e-12)
+
+
+def test_calc_simulated_energy_years_parallel(tmp_path, monkeypatch, synthetic_wind_speed,
+                                              commissioned_turbines):
+    time = pd.date_range('2016-01-01', '2016-12-31 23:00', freq='h')
+    wind_speed = synthetic_wind_speed(time, num_turbines=5)
+
+    def load_wind_speed(years, months, reduce_along=None):
+        return wind_speed.sel(time=np.isin(wind_speed.time.dt.year, years) &
+                              np.isin(wind_speed.time.dt.month, months))
+
+    monkeypatch.setattr(calculations, 'load_wind_speed', load_wind_speed)
+
+    expected = calc_simulated_energy_years([2016], commissioned_turbines)
+    simulated_energy = calc_simulated_energy_years([2016], commissioned_turbines,
+                                                   num_processes=1, checkpoint_dir=tmp_path)
+
+    assert simulated_energy.sizes['time'] == 12
+    np.testing.assert_allclose(simulated_energy, expected, rtol=1e-12)
+
+
+def test_calc_simulated_energy_years_buffers(tmp_path, monkeypatch, synthetic_wind_speed,
+                                             commissioned_turbines):
+    time = pd.date_range('2016-01-01', '2016-12-31 23:00', freq='h')
+    wind_speed = synthetic_wind_speed(time, num_turbines=5)
+
+    def load_wind_speed(years, months, reduce_along=None):
+        return wind_speed.sel(time=np.isin(wind_speed.time.dt.year, years) &
+                              np.isin(wind_speed.time.dt.month, months))
+
+    # memory addresses of all buffers after each call
+    addresses = []
+
+    def calc_simulated_energy_spy(*args, buffers=None, **kwargs):
+        result = calc_simulated_energy(*args, buffers=buffers, **kwargs)
+        addresses.append({name: buffer.ctypes.data
+                          for name, buffer in buffers._buffers.items()})
+        return result
+
+    monkeypatch.setattr(calculations, 'load_wind_speed', load_wind_speed)
+    monkeypatch.setattr(calculations, 'calc_simulated_energy', calc_simulated_energy_spy)
+
+    # January is the longest month, all later months re-use its buffers
+    calc_simulated_energy_years([2016], commissioned_turbines, num_processes=1,
+                                checkpoint_dir=tmp_path)
+    assert len(addresses) == 12
+    assert addresses[0] and all(address == addresses[0] for address in addresses)
+
+    addresses.clear()
+    buffers = BufferPool()
+    for _ in range(2):
+        calc_simulated_energy_years([2016], commissioned_turbines, buffers=buffers)
+    assert addresses[0] and addresses[0] == addresses[1]
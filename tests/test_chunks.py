@@ -0,0 +1,74 @@
+import os
+
+import dask
+import numpy as np
+import xarray as xr
+
+from wind_repower_usa.chunks import plan_chunks, chunk_for_reduction, disk_chunks, \
+    CHUNK_MEMORY_FACTOR, num_scheduler_threads
+
+
+def _memory_budget(max_chunk_bytes):
+    return max_chunk_bytes * CHUNK_MEMORY_FACTOR * num_scheduler_threads()
+
+
+def test_plan_chunks_reduce_along():
+    sizes = {'time': 1000, 'turbines': 500}
+    memory_budget = _memory_budget(100 * 50 * 8)
+
+    chunks = plan_chunks(sizes, 8, reduce_along='time', memory_budget=memory_budget)
+    assert chunks == {'time': 1000, 'turbines': 5}
+
+    chunks = plan_chunks(sizes, 8, reduce_along='turbines', memory_budget=memory_budget)
+    assert chunks == {'time': 10, 'turbines': 500}
+
+
+def test_plan_chunks_synchronous():
+    sizes = {'time': 1000, 'turbines': 500}
+    memory_budget = 100 * 50 * 8 * CHUNK_MEMORY_FACTOR
+
+    # one chunk at a time, e.g. in worker processes of a pool
+    with dask.config.set(scheduler='synchronous'):
+        assert num_scheduler_threads() == 1
+        chunks = plan_chunks(sizes, 8, reduce_along='time', memory_budget=memory_budget)
+    assert chunks == {'time': 1000, 'turbines': 5}
+
+    with dask.config.set(scheduler='threads', num_workers=4):
+        assert num_scheduler_threads() == 4
+        chunks = plan_chunks(sizes, 8, reduce_along='time', memory_budget=4 * memory_budget)
+    assert chunks == {'time': 1000, 'turbines': 5}
+
+    with dask.config.set(scheduler='threads'):
+        assert num_scheduler_threads() == os.cpu_count()
+
+
+def test_plan_chunks_disk_chunks():
+    sizes = {'time': 1000, 'turbines': 500}
+    memory_budget = _memory_budget(100 * 50 * 8)
+
+    # multiples of chunks on disk only
+    chunks = plan_chunks(sizes, 8, reduce_along='time', disk_chunks={'time': 24, 'turbines': 3},
+                         memory_budget=memory_budget)
+    assert chunks == {'time': 1000, 'turbines': 3}
+
+    # cannot be smaller than chunks on disk
+    chunks = plan_chunks(sizes, 8, reduce_along='time', disk_chunks={'time': 24, 'turbines': 500},
+                         memory_budget=memory_budget)
+    assert chunks == {'time': 24, 'turbines': 500}
+
+    # everything fits into memory
+    chunks = plan_chunks(sizes, 8, reduce_along='turbines', memory_budget=_memory_budget(1e9))
+    assert chunks == sizes
+
+
+def test_chunk_for_reduction(tmp_path):
+    data = xr.DataArray(np.zeros((100, 20)), dims=('time', 'turbines'), name='wind_speed')
+    assert chunk_for_reduction(data, 'time') is data
+
+    fname = tmp_path / 'data.nc'
+    data.to_netcdf(fname, encoding={'wind_speed': {'chunksizes': (10, 20)}})
+    with xr.open_dataarray(fname, chunks={}) as data:
+        assert disk_chunks(data) == {'time': 10, 'turbines': 20}
+        data_chunked = chunk_for_reduction(data, 'time')
+        assert data_chunked.chunks[0][0] % 10 == 0
+        assert data_chunked.chunks[1] == (20,)
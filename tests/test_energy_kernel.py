@@ -0,0 +1,143 @@
+import dask.array as da
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from wind_repower_usa.energy_kernel import calc_building_dates, calc_energy_dask, BufferPool
+from wind_repower_usa.energy_kernel import calc_energy_numpy, calc_month_offsets
+from wind_repower_usa.power_curves import PowerCurve
+from wind_repower_usa.turbine_models import ge15_77
+
+
+def _inputs():
+    time = pd.date_range('2015-12-01', '2017-01-31 23:00', freq='h')
+    np.random.seed(42)
+    wind_speed = np.random.weibull(2., size=(len(time), 5)) * 9.
+    # before commissioning, energy is 0 even for missing values
+    wind_speed[3, 2] = np.nan
+    turbines = xr.Dataset({'p_year': ('turbines', [2015., 2016., 2017., 2018., np.nan])})
+    building_start, building_end = calc_building_dates(turbines)
+    capacity_factor = np.array([1., 2., 0.5, 1., 1.])
+    time = time.values.astype('datetime64[ns]').astype(np.int64)
+    return wind_speed, time, building_start, building_end, capacity_factor
+
+
+def _expected(wind_speed, time, power_curve, building_start, building_end, capacity_factor):
+    time = time[:, np.newaxis]
+    proportion_of_year = (time - building_start) / (365.25 * 24 * 60 * 60 * 1e9)
+    energy = power_curve(wind_speed)
+    energy = np.where(time < building_end, energy * proportion_of_year, energy)
+    energy = np.where(time < building_start, 0., energy)
+    return energy * capacity_factor * 1e-6
+
+
+def test_calc_building_dates():
+    turbines = xr.Dataset({'p_year': ('turbines', [2015., np.nan])})
+    building_start, building_end = calc_building_dates(turbines)
+    assert building_start[0] == np.datetime64('2015-01-01', 'ns').astype(np.int64)
+    assert building_end[0] == np.datetime64('2016-01-01', 'ns').astype(np.int64)
+    assert building_start[1] == building_end[1] == np.iinfo(np.int64).max
+
+
+def test_calc_month_offsets():
+    time = pd.date_range('2015-12-30', '2016-03-01 23:00', freq='h').values
+    time_offsets, months = calc_month_offsets(time)
+    np.testing.assert_array_equal(time_offsets, [0, 48, 48 + 31 * 24, 48 + 60 * 24])
+    np.testing.assert_array_equal(months, np.array(['2015-12', '2016-01', '2016-02', '2016-03'],
+                                                   dtype='datetime64[ns]'))
+
+
+def _sum_per_month(values, time_offsets):
+    return np.array([values[start:stop].sum(axis=0) for start, stop in
+                     zip(time_offsets, list(time_offsets[1:]) + [len(values)])])
+
+
+@pytest.mark.parametrize('aggregation', ['none', 'time', 'turbines', 'month', 'month_turbines'])
+@pytest.mark.parametrize('power_curve', [ge15_77.power_curve,
+                                         PowerCurve.from_interp1d(ge15_77.power_curve)],
+                         ids=['interp1d', 'PowerCurve'])
+def test_calc_energy(aggregation, power_curve):
+    wind_speed, time, building_start, building_end, capacity_factor = _inputs()
+    wind_speed_orig = wind_speed.copy()
+    month_offsets, _ = calc_month_offsets(time.astype('datetime64[ns]'))
+
+    expected = _expected(wind_speed, time, power_curve, building_start, building_end,
+                         capacity_factor)
+
+    time_offsets = None
+    sum_turbines = aggregation in ('turbines', 'month_turbines')
+    if aggregation == 'time':
+        time_offsets = np.array([0])
+    elif aggregation in ('month', 'month_turbines'):
+        time_offsets = month_offsets
+
+    if sum_turbines:
+        expected = expected.sum(axis=1)
+    if time_offsets is not None:
+        expected = _sum_per_month(expected, time_offsets)
+
+    kwargs = dict(building_start=building_start, building_end=building_end,
+                  capacity_factor=capacity_factor, time_offsets=time_offsets,
+                  sum_turbines=sum_turbines)
+
+    energy_numpy = calc_energy_numpy(wind_speed, time, power_curve, **kwargs)
+    energy_dask = calc_energy_dask(da.from_array(wind_speed, chunks=(500, 2)), time, power_curve,
+                                   **kwargs)
+
+    # input is not modified
+    np.testing.assert_array_equal(wind_speed, wind_speed_orig)
+
+    if aggregation == 'none':
+        np.testing.assert_array_equal(energy_numpy, expected)
+        np.testing.assert_array_equal(energy_dask, expected)
+    else:
+        np.testing.assert_allclose(energy_numpy, expected, rtol=1e-12)
+        np.testing.assert_allclose(energy_dask, expected, rtol=1e-12)
+
+
+def test_calc_energy_identity_power_curve():
+    # the power curve returns its input, energy_block() works in place on the result
+    wind_speed, time, *_ = _inputs()
+    wind_speed_orig = wind_speed.copy()
+
+    energy = calc_energy_numpy(wind_speed, time, lambda x: x)
+
+    np.testing.assert_array_equal(wind_speed, wind_speed_orig)
+    np.testing.assert_array_equal(energy, wind_speed_orig * 1e-6)
+
+
+def test_calc_energy_buffers():
+    wind_speed, time, building_start, building_end, capacity_factor = _inputs()
+    power_curve = PowerCurve.from_interp1d(ge15_77.power_curve)
+    kwargs = dict(building_start=building_start, building_end=building_end,
+                  capacity_factor=capacity_factor)
+
+    expected = calc_energy_numpy(wind_speed, time, power_curve, **kwargs)
+
+    buffers = BufferPool()
+    out = np.full(wind_speed.shape, np.nan)
+    energy = calc_energy_numpy(wind_speed, time, power_curve, out=out, buffers=buffers, **kwargs)
+    assert energy is out
+    np.testing.assert_array_equal(energy, expected)
+
+    # second month: shorter, buffers are re-used
+    nbytes = buffers.nbytes
+    month_offsets, _ = calc_month_offsets(time.astype('datetime64[ns]'))
+    energy = calc_energy_numpy(wind_speed[:100], time[:100], power_curve,
+                               time_offsets=month_offsets[:1], buffers=buffers, **kwargs)
+    assert buffers.nbytes == nbytes
+    np.testing.assert_allclose(energy, expected[:100].sum(axis=0, keepdims=True), rtol=1e-12)
+
+    with pytest.raises(ValueError):
+        calc_energy_numpy(wind_speed, time, power_curve, out=out[:10], **kwargs)
+
+
+def test_buffer_pool():
+    buffers = BufferPool()
+    buffer = buffers.get('a', (3, 4))
+    assert buffer.shape == (3, 4)
+    assert np.shares_memory(buffers.get('a', (2, 5)), buffer)
+    assert not np.shares_memory(buffers.get('b', (2, 5)), buffer)
+    assert buffers.get('a', (5, 5)).shape == (5, 5)
+    assert buffers.get('a', (2,), dtype=np.float32).dtype == np.float32
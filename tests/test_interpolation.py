@@ -0,0 +1,144 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from wind_repower_usa.calculations import calc_wind_speed_at_turbines
+from wind_repower_usa.calculations import calc_wind_speed_and_direction_at_turbines
+from wind_repower_usa.interpolation import calc_interpolation_stencil, stencil_to_sparse
+from wind_repower_usa.interpolation import interpolate_at_turbines, calc_grid_cells
+from wind_repower_usa.interpolation import select_grid_cells, interpolate_cells_at_turbines
+
+
+def _wind_velocity(num_time_stamps=5):
+    np.random.seed(42)
+    latitude = np.arange(50., 20., -0.25)  # descending like ERA5
+    longitude = np.arange(-130., -60., 0.25)
+    shape = num_time_stamps, len(latitude), len(longitude)
+    wind_velocity = xr.Dataset({
+        'u100': (('time', 'latitude', 'longitude'), np.random.rand(*shape).astype(np.float32)),
+        'v100': (('time', 'latitude', 'longitude'), np.random.rand(*shape).astype(np.float32)),
+    },
+        coords={
+            'time': np.arange(num_time_stamps),
+            'latitude': latitude,
+            'longitude': longitude,
+        }
+    )
+    return wind_velocity
+
+
+def _turbines(xlong, ylat):
+    return xr.Dataset({
+        'xlong': ('turbines', np.asarray(xlong, dtype=np.float64)),
+        'ylat': ('turbines', np.asarray(ylat, dtype=np.float64)),
+    },
+        coords={'turbines': np.arange(len(xlong))}
+    )
+
+
+def test_calc_interpolation_stencil():
+    wind_velocity = _wind_velocity()
+    # includes points on the grid and on the boundary of the grid
+    turbines = _turbines([-100.1, -130., -60.25, -75.],
+                         [33.33, 50., 20.25, 40.])
+    stencil = calc_interpolation_stencil(turbines, wind_velocity.latitude,
+                                         wind_velocity.longitude)
+
+    assert stencil.weight.dims == ('turbines', 'corner')
+    np.testing.assert_allclose(stencil.weight.sum(dim='corner'), 1.)
+    assert np.all(stencil.weight >= 0.)
+
+    weights = stencil_to_sparse(stencil)
+    assert weights.shape == (4, wind_velocity.latitude.size * wind_velocity.longitude.size)
+
+
+def test_calc_interpolation_stencil_outside_grid():
+    wind_velocity = _wind_velocity()
+    turbines = _turbines([-100.], [55.])
+    with pytest.raises(ValueError):
+        calc_interpolation_stencil(turbines, wind_velocity.latitude, wind_velocity.longitude)
+
+
+def test_interpolate_at_turbines():
+    wind_velocity = _wind_velocity()
+    np.random.seed(23)
+    num_turbines = 200
+    turbines = _turbines(np.random.uniform(-130., -60.25, size=num_turbines),
+                         np.random.uniform(20.25, 50., size=num_turbines))
+    stencil = calc_interpolation_stencil(turbines, wind_velocity.latitude,
+                                         wind_velocity.longitude)
+
+    u100_interp = wind_velocity.u100.interp(
+        longitude=xr.DataArray(turbines.xlong.values, dims='turbines'),
+        latitude=xr.DataArray(turbines.ylat.values, dims='turbines'),
+        method='linear')
+    u100_stencil = interpolate_at_turbines(wind_velocity.u100, stencil)
+
+    assert u100_stencil.dims == ('time', 'turbines')
+    np.testing.assert_allclose(u100_stencil, u100_interp, rtol=1e-12)
+
+    # also works lazily for chunked data
+    u100_dask = interpolate_at_turbines(wind_velocity.u100.chunk({'time': 2}), stencil)
+    np.testing.assert_allclose(u100_dask.compute(), u100_interp, rtol=1e-12)
+
+
+def test_interpolate_at_turbines_wrong_grid():
+    wind_velocity = _wind_velocity()
+    turbines = _turbines([-100.1], [33.33])
+    stencil = calc_interpolation_stencil(turbines, wind_velocity.latitude,
+                                         wind_velocity.longitude)
+    with pytest.raises(ValueError):
+        interpolate_at_turbines(wind_velocity.u100.isel(latitude=slice(1, None)), stencil)
+
+
+def test_calc_wind_speed_at_turbines_stencil():
+    wind_velocity = _wind_velocity()
+    turbines = _turbines([-100.1, -70.3, -88.88], [33.33, 44.4, 21.])
+    stencil = calc_interpolation_stencil(turbines, wind_velocity.latitude,
+                                         wind_velocity.longitude)
+
+    wind_speed_interp = calc_wind_speed_at_turbines(wind_velocity, turbines)
+    wind_speed_stencil = calc_wind_speed_at_turbines(wind_velocity, turbines, stencil=stencil)
+
+    np.testing.assert_allclose(wind_speed_stencil, wind_speed_interp, rtol=1e-12)
+    np.testing.assert_array_equal(wind_speed_stencil.longitude, turbines.xlong)
+
+
+def test_calc_wind_speed_and_direction_at_turbines():
+    wind_velocity = _wind_velocity()
+    turbines = _turbines([-100.1, -70.3, -88.88], [33.33, 44.4, 21.])
+    stencil = calc_interpolation_stencil(turbines, wind_velocity.latitude,
+                                         wind_velocity.longitude)
+
+    wind_speed, wind_direction = calc_wind_speed_and_direction_at_turbines(
+        wind_velocity, turbines, stencil=stencil)
+
+    np.testing.assert_array_equal(wind_speed, calc_wind_speed_at_turbines(wind_velocity, turbines,
+                                                                          stencil=stencil))
+
+    wind_velocity_interp = wind_velocity.interp(
+        longitude=xr.DataArray(turbines.xlong.values, dims='turbines'),
+        latitude=xr.DataArray(turbines.ylat.values, dims='turbines'))
+    np.testing.assert_allclose(wind_direction, np.arctan2(wind_velocity_interp.v100,
+                                                          wind_velocity_interp.u100), rtol=1e-6)
+
+
+def test_interpolate_cells_at_turbines():
+    wind_velocity = _wind_velocity()
+    np.random.seed(23)
+    num_turbines = 300
+    # clustered turbines: few grid cells for many turbines
+    turbines = _turbines(np.random.uniform(-100., -99., size=num_turbines),
+                         np.random.uniform(40., 41., size=num_turbines))
+    stencil = calc_interpolation_stencil(turbines, wind_velocity.latitude,
+                                         wind_velocity.longitude)
+    grid_cells = calc_grid_cells(stencil)
+
+    assert grid_cells.sizes['cells'] == 5 * 5
+
+    u100_cells = select_grid_cells(wind_velocity.u100, grid_cells)
+    assert u100_cells.dims == ('time', 'cells')
+
+    np.testing.assert_allclose(interpolate_cells_at_turbines(u100_cells, grid_cells),
+                               interpolate_at_turbines(wind_velocity.u100, stencil),
+                               rtol=1e-12)
@@ -1,7 +1,9 @@
+import pandas as pd
 import xarray as xr
 import numpy as np
 
 from wind_repower_usa import load_data
+from wind_repower_usa.storage import write_wind_direction, write_wind_speed
 
 
 def test_load_turbines():
@@ -32,3 +34,69 @@ def test_load_wind_velocity():
     assert (float(wind_velocity.u100.isel(time=0,
                                           longitude=3,
                                           latitude=2)) == 3.368373394012451)
+
+
+def test_load_wind_direction(tmp_path, monkeypatch):
+    monkeypatch.setattr(load_data, 'INTERIM_DIR', tmp_path)
+    (tmp_path / 'wind_direction_usa_era5').mkdir()
+
+    time = pd.date_range('2016-01-01', periods=4, freq='h')
+    wind_direction = xr.DataArray([[-np.pi, 0.], [np.pi, 1.], [3.14159, -3.14159], [2., -2.]],
+                                  dims=('time', 'turbines'), coords={'time': time})
+    write_wind_direction(wind_direction, tmp_path / 'wind_direction_usa_era5' /
+                         'wind_direction_usa_era5-2016-01.nc')
+
+    # +/-pi are rounded to +/-3.1416 when stored, but must stay in range
+    wind_direction_loaded = load_data.load_wind_direction(2016, 1)
+    assert wind_direction_loaded.dims == ('time', 'turbines')
+    assert np.all(np.abs(wind_direction_loaded.values) <= np.pi)
+    np.testing.assert_allclose(wind_direction_loaded, wind_direction, rtol=0, atol=0.5e-4)
+
+
+def test_stored_wind_speed_dtype(tmp_path, monkeypatch):
+    monkeypatch.setattr(load_data, 'INTERIM_DIR', tmp_path)
+    monkeypatch.setattr(load_data, 'WIND_SPEED_STORE', tmp_path / 'wind_speed.zarr')
+    (tmp_path / 'wind_speed_usa_era5').mkdir()
+
+    time = pd.date_range('2016-01-01', periods=4, freq='h')
+    wind_speed = xr.DataArray(np.random.rand(4, 3) * 10., dims=('time', 'turbines'),
+                              coords={'time': time})
+
+    # monthly files written with WIND_SPEED_ENCODING
+    write_wind_speed(wind_speed, tmp_path / 'wind_speed_usa_era5' /
+                     'wind_speed_usa_era5-2016-01.nc')
+    assert load_data.stored_wind_speed_dtype(2016, 1) == np.int16
+    assert load_data.load_wind_speed(2016, 1).dtype == np.float64
+
+    wind_speed.astype(np.float32).rename('wind_speed').to_dataset().to_zarr(
+        str(tmp_path / 'wind_speed.zarr'), consolidated=True)
+    assert load_data.stored_wind_speed_dtype(2016, 1) == np.float32
+
+
+def test_read_csv_cached(tmp_path):
+    fname = tmp_path / 'data.csv'
+    cache_dir = tmp_path / 'cache'
+    dataframe = pd.DataFrame({
+        'case_id': [3, 1, 2],
+        't_cap': [1500., np.nan, 2000.],
+        't_manu': ['GE Wind', np.nan, 'Vestas'],
+        'xlong': [-100.1, -101.2, -102.3],
+    })
+    dataframe.to_csv(fname, index=False)
+
+    cached = load_data.read_csv_cached(fname, cache_dir=cache_dir)
+    assert len(list(cache_dir.glob('data-*.npz'))) == 1
+    pd.testing.assert_frame_equal(cached, pd.read_csv(fname), check_dtype=False)
+
+    # second call reads from the cache
+    cached = load_data.read_csv_cached(fname, columns=['t_manu', 'xlong'], cache_dir=cache_dir)
+    assert list(cached.columns) == ['t_manu', 'xlong']
+    assert cached.t_manu[0] == 'GE Wind'
+    assert np.isnan(cached.t_manu[1])
+
+    # cache is invalidated if the content changes
+    dataframe.loc[0, 't_cap'] = 3000.
+    dataframe.to_csv(fname, index=False)
+    cached = load_data.read_csv_cached(fname, cache_dir=cache_dir)
+    assert cached.t_cap[0] == 3000.
+    assert len(list(cache_dir.glob('data-*.npz'))) == 1
@@ -0,0 +1,88 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from wind_repower_usa.pipeline import calc_months_parallel, checkpoint_fname, prefetch_months
+from wind_repower_usa.pipeline import create_pool, get_worker_data
+
+
+def calc_month(year, month):
+    time = pd.date_range(f'{year}-{month:02d}-01', periods=3, freq='D')
+    return xr.DataArray(np.full(3, year * 100 + month, dtype=float), dims='time',
+                        coords={'time': time}, name='value')
+
+
+@pytest.mark.parametrize('num_processes', [1, 2])
+def test_calc_months_parallel(tmp_path, num_processes):
+    result = calc_months_parallel(calc_month, [2016, 2017], [2, 1], tmp_path,
+                                  num_processes=num_processes)
+
+    assert result.name == 'value'
+    assert result.indexes['time'].is_monotonic_increasing
+    np.testing.assert_array_equal(result.values[::3], [201601, 201602, 201701, 201702])
+    assert sorted(fname.name for fname in tmp_path.iterdir()) == [
+        'checkpoint-2016-01.nc', 'checkpoint-2016-02.nc',
+        'checkpoint-2017-01.nc', 'checkpoint-2017-02.nc']
+
+
+def test_calc_months_parallel_resume(tmp_path):
+    # a checkpoint from an interrupted run is used instead of calculating the month again
+    calc_month(2016, 1).where(False, -1.).to_netcdf(checkpoint_fname(tmp_path, 2016, 1))
+
+    result = calc_months_parallel(calc_month, [2016], [1, 2], tmp_path, num_processes=1)
+
+    np.testing.assert_array_equal(result.values, [-1.] * 3 + [201602.] * 3)
+
+
+def scaled_by_worker_data(value):
+    return value * get_worker_data('factor')
+
+
+def test_create_pool_worker_data():
+    with create_pool(2, memory_budget_bytes=1e9, worker_data={'factor': 3}) as pool:
+        assert pool.map(scaled_by_worker_data, range(4)) == [0, 3, 6, 9]
+
+
+def test_prefetch_months():
+    year_months = [(2016, 12), (2017, 1), (2017, 2)]
+    loaded = []
+
+    def load_month(year, month):
+        loaded.append((year, month))
+        return year * 100 + month
+
+    months = prefetch_months(load_month, year_months, depth=1)
+    assert list(months) == [(2016, 12, 201612), (2017, 1, 201701), (2017, 2, 201702)]
+    assert loaded == year_months
+
+
+def test_prefetch_months_bounded():
+    # loading does not run ahead more than depth months
+    num_loaded = []
+
+    def load_month(year, month):
+        num_loaded.append(month)
+        return month
+
+    months = prefetch_months(load_month, [(2016, month) for month in range(1, 13)], depth=2)
+    next(months)
+    time.sleep(0.5)
+
+    # one month consumed, two in the queue, one blocking in put()
+    assert len(num_loaded) <= 4
+    months.close()
+
+
+def test_prefetch_months_exception():
+    def load_month(year, month):
+        if month == 2:
+            raise FileNotFoundError(f"no data for {year}-{month:02d}")
+        return month
+
+    months = prefetch_months(load_month, [(2016, 1), (2016, 2), (2016, 3)])
+    assert next(months) == (2016, 1, 1)
+    with pytest.raises(FileNotFoundError):
+        next(months)
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from scipy.interpolate import interp1d
+
+from wind_repower_usa.power_curves import PowerCurve, PowerCurves, compile_power_curve
+from wind_repower_usa.power_curves import is_on_grid
+from wind_repower_usa.turbine_models import ge15_77, e138ep3, se_42m140, e126
+
+
+TURBINE_MODELS = ge15_77, e138ep3, se_42m140, e126
+
+
+def _wind_speeds(dtype=np.float64):
+    np.random.seed(42)
+    wind_speeds = np.random.weibull(2., size=(100, 50)) * 9.
+    wind_speeds[0, :3] = 0., 26.99, 40.
+    return wind_speeds.astype(dtype)
+
+
+@pytest.mark.parametrize('turbine_model', TURBINE_MODELS, ids=lambda t: t.file_name)
+def test_power_curve(turbine_model):
+    wind_speeds = _wind_speeds()
+    power_curve = PowerCurve.from_interp1d(turbine_model.power_curve)
+    np.testing.assert_allclose(power_curve(wind_speeds), turbine_model.power_curve(wind_speeds),
+                               rtol=1e-10, atol=1e-9)
+
+
+@pytest.mark.parametrize('turbine_model', TURBINE_MODELS, ids=lambda t: t.file_name)
+def test_power_curve_float32_in_place(turbine_model):
+    wind_speeds = _wind_speeds(np.float32)
+    expected = turbine_model.power_curve(wind_speeds)
+
+    power_curve = compile_power_curve(turbine_model.power_curve)
+    generation = power_curve(wind_speeds, out=wind_speeds)
+
+    assert generation is wind_speeds
+    assert generation.dtype == np.float32
+    np.testing.assert_allclose(generation, expected, rtol=1e-5, atol=1e-2)
+
+
+@pytest.mark.filterwarnings('error')
+def test_power_curve_nan_and_clipping():
+    power_curve = PowerCurve([0., 3., 10., 25.], [0., 0., 1000., 1000.], resolution=0.5)
+    generation = power_curve(np.array([np.nan, -1., 6.5, 100.]))
+    np.testing.assert_array_equal(generation, [np.nan, 0., 500., 1000.])
+
+
+def test_power_curves():
+    wind_speeds = _wind_speeds()
+    power_curves = PowerCurves([turbine_model.power_curve for turbine_model in TURBINE_MODELS])
+
+    generation = power_curves(wind_speeds)
+
+    assert generation.shape == (len(TURBINE_MODELS),) + wind_speeds.shape
+    for generation_model, turbine_model in zip(generation, TURBINE_MODELS):
+        np.testing.assert_allclose(generation_model, turbine_model.power_curve(wind_speeds),
+                                   rtol=1e-10, atol=1e-9)
+
+
+def test_compile_power_curve():
+    power_curve = compile_power_curve(ge15_77.power_curve)
+    assert compile_power_curve(power_curve) is power_curve
+    with pytest.raises(TypeError):
+        compile_power_curve(lambda x: x)
+
+
+def test_power_curves_off_grid():
+    # breakpoints at 3.005 and 12.333m/s are not multiples of 0.01m/s
+    power_curve_off_grid = interp1d([0., 3.005, 12.333, 25., 70.], [0., 0., 2000., 2000., 0.])
+    assert not is_on_grid(power_curve_off_grid.x)
+    assert is_on_grid(ge15_77.power_curve.x)
+
+    wind_speeds = np.hstack((_wind_speeds()[:, 0], [3.005, 3.0075, 12.333, 12.3335]))
+    expected = power_curve_off_grid(wind_speeds)
+
+    # the lookup table differs near breakpoints
+    lookup = PowerCurve.from_interp1d(power_curve_off_grid)
+    assert np.abs(lookup(wind_speeds) - expected).max() > 1e-3
+
+    assert compile_power_curve(power_curve_off_grid) is power_curve_off_grid
+    assert isinstance(compile_power_curve(lookup), interp1d)
+    np.testing.assert_allclose(compile_power_curve(lookup)(wind_speeds), expected, rtol=1e-12)
+
+    power_curves = PowerCurves([ge15_77.power_curve, power_curve_off_grid, e126.power_curve])
+    generation = power_curves(wind_speeds)
+    np.testing.assert_allclose(generation[1], expected, rtol=1e-12)
+    for generation_model, turbine_model in zip(generation[::2], (ge15_77, e126)):
+        np.testing.assert_allclose(generation_model, turbine_model.power_curve(wind_speeds),
+                                   rtol=1e-10, atol=1e-9)
+    np.testing.assert_allclose(power_curves.sum(wind_speeds), generation.sum(axis=1),
+                               rtol=1e-12)
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_power_curves_sum(dtype):
+    wind_speeds = _wind_speeds(dtype)
+    power_curves = PowerCurves([turbine_model.power_curve for turbine_model in TURBINE_MODELS])
+
+    generation_sum = power_curves.sum(wind_speeds, axis=0)
+
+    assert generation_sum.shape == (len(TURBINE_MODELS), wind_speeds.shape[1])
+    assert generation_sum.dtype == np.float64
+    np.testing.assert_allclose(generation_sum, power_curves(wind_speeds).sum(axis=1),
+                               rtol=1e-5 if dtype == np.float32 else 1e-12)
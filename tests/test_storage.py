@@ -0,0 +1,227 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from wind_repower_usa.storage import append_wind_speed, open_store, select_months
+from wind_repower_usa.calculations import calc_wind_speed_at_turbines
+from wind_repower_usa.calculations import calc_wind_speed_and_direction_at_turbines
+from wind_repower_usa.interpolation import calc_interpolation_stencil, calc_grid_cells
+from wind_repower_usa.interpolation import calc_wind_speed_from_cells
+from wind_repower_usa.interpolation import calc_wind_direction_from_cells
+from wind_repower_usa.storage import stored_months, rechunk_wind_speed, append_wind_velocity_cells
+from wind_repower_usa.storage import write_netcdf_atomic, write_wind_speed, is_encoded
+from wind_repower_usa.storage import write_wind_direction
+from wind_repower_usa.storage import encode_wind_speed_store, WIND_SPEED_ENCODING
+from wind_repower_usa.storage import recover_store_swap
+
+
+def _wind_speed(year, month, num_turbines=13):
+    time = pd.date_range(f'{year}-{month:02d}-01', periods=24 * 2, freq='h')
+    np.random.seed(month)
+    return xr.DataArray(np.random.rand(len(time), num_turbines),
+                        dims=('time', 'turbines'),
+                        coords={'time': time,
+                                'longitude': ('turbines', np.arange(num_turbines, dtype=float))})
+
+
+def test_append_wind_speed(tmp_path):
+    store = tmp_path / 'wind_speed.zarr'
+    assert stored_months(store) == set()
+
+    wind_speeds = [_wind_speed(2003, month) for month in (1, 2, 3)]
+    for wind_speed in wind_speeds:
+        append_wind_speed(wind_speed, store=store)
+
+    assert stored_months(store) == {(2003, 1), (2003, 2), (2003, 3)}
+
+    wind_speed_store = open_store(store).wind_speed
+    assert wind_speed_store.chunks[0] == (24,) * 6
+    assert is_encoded(wind_speed_store)
+    np.testing.assert_allclose(wind_speed_store, xr.concat(wind_speeds, dim='time'), rtol=0,
+                               atol=WIND_SPEED_ENCODING['scale_factor'] / 2 + 1e-12)
+
+    with pytest.raises(ValueError):
+        append_wind_speed(wind_speeds[1], store=store)
+
+
+def test_append_wind_speed_incomplete_days(tmp_path):
+    with pytest.raises(ValueError):
+        append_wind_speed(_wind_speed(2003, 1).isel(time=slice(1, None)),
+                          store=tmp_path / 'wind_speed.zarr')
+
+
+def test_select_months(tmp_path):
+    store = tmp_path / 'wind_speed.zarr'
+    for year in (2003, 2004):
+        for month in (1, 2):
+            append_wind_speed(_wind_speed(year, month), store=store)
+
+    wind_speed = open_store(store).wind_speed
+
+    selected = select_months(wind_speed, years=[2004], months=[1, 2])
+    np.testing.assert_array_equal(selected.time, xr.concat([_wind_speed(2004, 1).time,
+                                                            _wind_speed(2004, 2).time],
+                                                           dim='time'))
+
+    selected = select_months(wind_speed, years=[2003, 2004], months=[2])
+    assert selected.sizes['time'] == 4 * 24
+    np.testing.assert_array_equal(selected.time.dt.month, 2)
+
+    with pytest.raises(ValueError):
+        select_months(wind_speed, years=[2003], months=[3])
+
+
+def test_rechunk_wind_speed(tmp_path):
+    source = tmp_path / 'wind_speed.zarr'
+    target = tmp_path / 'wind_speed-turbine_major.zarr'
+    num_turbines = 13
+    for month in (1, 2, 3):
+        append_wind_speed(_wind_speed(2003, month, num_turbines=num_turbines), store=source)
+
+    # memory budget allows only one chunk at once
+    rechunk_wind_speed(source, target, chunks={'time': 60, 'turbines': 5},
+                       memory_budget_bytes=60 * 5 * 8)
+
+    wind_speed = open_store(source).wind_speed
+    wind_speed_turbine_major = open_store(target).wind_speed
+
+    assert wind_speed_turbine_major.chunks == ((60, 60, 24), (5, 5, 3))
+    xr.testing.assert_identical(wind_speed_turbine_major.load(), wind_speed.load())
+    assert stored_months(target) == stored_months(source)
+
+
+def test_append_wind_velocity_cells(tmp_path):
+    store = tmp_path / 'wind_velocity_cells.zarr'
+
+    latitude = np.arange(50., 40., -0.25)
+    longitude = np.arange(-110., -90., 0.25)
+    time = pd.date_range('2003-01-01', periods=24 * 4, freq='h')
+    shape = len(time), len(latitude), len(longitude)
+    np.random.seed(42)
+    wind_velocity = xr.Dataset({
+        'u100': (('time', 'latitude', 'longitude'), np.random.rand(*shape).astype(np.float32)),
+        'v100': (('time', 'latitude', 'longitude'), np.random.rand(*shape).astype(np.float32)),
+        'u10': (('time', 'latitude', 'longitude'), np.random.rand(*shape).astype(np.float32)),
+    },
+        coords={'time': time, 'latitude': latitude, 'longitude': longitude}
+    )
+
+    num_turbines = 50
+    turbines = xr.Dataset({
+        'xlong': ('turbines', np.random.uniform(-100., -98., size=num_turbines)),
+        'ylat': ('turbines', np.random.uniform(44., 45., size=num_turbines)),
+    })
+    stencil = calc_interpolation_stencil(turbines, latitude, longitude)
+    grid_cells = calc_grid_cells(stencil)
+
+    append_wind_velocity_cells(wind_velocity.isel(time=slice(0, 48)), grid_cells, store=store)
+    append_wind_velocity_cells(wind_velocity.isel(time=slice(48, None)), grid_cells, store=store)
+
+    wind_velocity_cells = open_store(store)
+    assert 'u10' not in wind_velocity_cells
+    assert wind_velocity_cells.u100.dims == ('time', 'cells')
+    assert wind_velocity_cells.u100.dtype == np.float32
+
+    wind_speed = calc_wind_speed_from_cells(wind_velocity_cells)
+    assert wind_speed.dims == ('time', 'turbines')
+    np.testing.assert_allclose(wind_speed,
+                               calc_wind_speed_at_turbines(wind_velocity, turbines, stencil),
+                               rtol=1e-12)
+
+    wind_direction = calc_wind_direction_from_cells(wind_velocity_cells)
+    _, expected_wind_direction = calc_wind_speed_and_direction_at_turbines(wind_velocity, turbines,
+                                                                           stencil)
+    assert wind_direction.dims == ('time', 'turbines')
+    np.testing.assert_allclose(wind_direction, expected_wind_direction, rtol=1e-12)
+
+
+def test_write_netcdf_atomic(tmp_path):
+    fname = tmp_path / 'data.nc'
+    data = xr.DataArray([1., 2.], dims='x', name='data')
+    write_netcdf_atomic(data, fname)
+    assert [f.name for f in tmp_path.iterdir()] == ['data.nc']
+    np.testing.assert_array_equal(xr.open_dataarray(fname).values, [1., 2.])
+
+    # no (partial) file is left if writing fails
+    with pytest.raises(Exception):
+        write_netcdf_atomic(xr.DataArray([object()], dims='x', name='data'), tmp_path / 'x.nc')
+    assert [f.name for f in tmp_path.iterdir()] == ['data.nc']
+
+
+def test_write_wind_speed(tmp_path):
+    fname = tmp_path / 'wind_speed.nc'
+    wind_speed = _wind_speed(2003, 1) * 30.
+    wind_speed[0, 0] = np.nan
+    write_wind_speed(wind_speed, fname)
+
+    with xr.open_dataset(fname, mask_and_scale=False) as raw:
+        assert raw['__xarray_dataarray_variable__'].dtype == np.int16
+
+    # decoded lazily by chunk
+    with xr.open_dataarray(fname, chunks={'time': 24}) as wind_speed_stored:
+        assert is_encoded(wind_speed_stored)
+        assert wind_speed_stored.chunks[0] == (24, 24)
+        assert np.isnan(wind_speed_stored.values[0, 0])
+        np.testing.assert_allclose(wind_speed_stored, wind_speed, rtol=0, atol=0.005 + 1e-12)
+
+
+def test_write_wind_direction(tmp_path):
+    fname = tmp_path / 'wind_direction.nc'
+    wind_direction = (_wind_speed(2003, 1) * 2. - 1.) * np.pi
+    wind_direction.values[0, :3] = -np.pi, np.pi, np.nan
+    write_wind_direction(wind_direction, fname)
+
+    with xr.open_dataset(fname, mask_and_scale=False) as raw:
+        assert raw['__xarray_dataarray_variable__'].dtype == np.int16
+
+    with xr.open_dataarray(fname) as wind_direction_stored:
+        assert np.isnan(wind_direction_stored.values[0, 2])
+        np.testing.assert_allclose(wind_direction_stored, wind_direction, rtol=0,
+                                   atol=0.5e-4 + 1e-12)
+
+
+def test_encode_wind_speed_store(tmp_path):
+    store = tmp_path / 'wind_speed.zarr'
+    wind_speed = xr.concat([_wind_speed(2003, month) for month in (1, 2)], dim='time')
+
+    # store as written before WIND_SPEED_ENCODING existed
+    wind_speed.rename('wind_speed').to_dataset().to_zarr(
+        str(store), consolidated=True, encoding={'wind_speed': {'chunks': (24, 13)}})
+    assert not is_encoded(open_store(store).wind_speed)
+
+    assert encode_wind_speed_store(store)
+
+    wind_speed_store = open_store(store).wind_speed
+    assert is_encoded(wind_speed_store)
+    assert wind_speed_store.chunks == ((24,) * 4, (13,))
+    np.testing.assert_allclose(wind_speed_store, wind_speed, rtol=0, atol=0.005 + 1e-12)
+    assert stored_months(store) == {(2003, 1), (2003, 2)}
+    assert [f.name for f in tmp_path.iterdir()] == ['wind_speed.zarr']
+
+    assert not encode_wind_speed_store(store)
+
+
+@pytest.mark.parametrize('leftovers, expect_encoded', [
+    (('wind_speed.zarr.old', 'wind_speed.zarr.part'), True),  # crash between both os.replace()
+    (('wind_speed.zarr.old',), False),
+    (('wind_speed.zarr', 'wind_speed.zarr.old'), True),  # crash before removing the old store
+    (('wind_speed.zarr', 'wind_speed.zarr.part'), False),  # crash while writing the copy
+])
+def test_recover_store_swap(tmp_path, leftovers, expect_encoded):
+    store = tmp_path / 'wind_speed.zarr'
+    wind_speed = _wind_speed(2003, 1).rename('wind_speed').to_dataset()
+    for name in leftovers:
+        encoding = WIND_SPEED_ENCODING if name.endswith('.part') or (
+            name == store.name and expect_encoded) else {}
+        wind_speed.to_zarr(str(tmp_path / name), consolidated=True,
+                           encoding={'wind_speed': encoding})
+
+    recover_store_swap(store)
+
+    assert [f.name for f in tmp_path.iterdir()] == ['wind_speed.zarr']
+    assert is_encoded(open_store(store).wind_speed) == expect_encoded
+    assert stored_months(store) == {(2003, 1)}
+
+    encode_wind_speed_store(store)
+    assert is_encoded(open_store(store).wind_speed)
@@ -0,0 +1,75 @@
+import sys
+import subprocess
+
+import pandas as pd
+import pytest
+
+from wind_repower_usa import turbine_models
+
+
+def test_import_does_not_parse_nrel_sam_table():
+    # needs a fresh interpreter, other tests might have loaded the table already
+    code = ("import sys; import wind_repower_usa.load_data; "
+            "tm = sys.modules['wind_repower_usa.turbine_models']; "
+            "assert tm.load_nrel_sam_table.cache_info().currsize == 0")
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+
+@pytest.fixture
+def nrel_sam_table(monkeypatch):
+    table = pd.DataFrame({
+        'Name': ['Some: Turbine 1', 'Other Turbine'],
+        'KW Rating': [1500, 3000],
+        'Rotor Diameter': [77, 110],
+        'Wind Speed Array': ['1|2|3|25', '0|4|12|30'],
+        'Power Curve Array': ['0|100|1500|0', '0|500|3000|0'],
+    })
+    monkeypatch.setattr(turbine_models, 'load_nrel_sam_table', lambda: table)
+    turbine_models.nrel_sam_turbine.cache_clear()
+    yield table
+    turbine_models.nrel_sam_turbine.cache_clear()
+
+
+def test_nrel_sam_turbine(nrel_sam_table):
+    turbine = turbine_models.nrel_sam_turbine('Other Turbine')
+    assert turbine.file_name == 'other_turbine'
+    assert turbine.capacity_mw == 3.
+    assert turbine.power_curve(8.) == 1750.
+
+    # cached
+    assert turbine_models.nrel_sam_turbine('Other Turbine') is turbine
+
+    turbine = turbine_models.nrel_sam_turbine(0, file_name='some_turbine')
+    assert turbine.name == 'Some: Turbine 1'
+    assert turbine.power_curve(0.5) == 0.
+
+    with pytest.raises(ValueError):
+        turbine_models.nrel_sam_turbine('Unknown Turbine')
+
+
+def test_module_attributes_lazy(nrel_sam_table):
+    turbine_models.NREL_SAM_TURBINES['some_turbine'] = dict(model=0, name='Some Turbine')
+    try:
+        assert turbine_models.some_turbine.name == 'Some Turbine'
+    finally:
+        del turbine_models.NREL_SAM_TURBINES['some_turbine']
+
+    with pytest.raises(AttributeError):
+        turbine_models.unknown_turbine
+
+
+def test_all_nrel_sam_turbines(nrel_sam_table):
+    nrel_sam_table.loc[2] = ['No Cut-off', 2000, 90, '0|4|12', '0|500|2000']
+    turbines = turbine_models.all_nrel_sam_turbines()
+    assert [turbine.file_name for turbine in turbines] == ['some__turbine_1', 'other_turbine']
+
+    with pytest.raises(ValueError):
+        turbine_models.nrel_sam_turbine(2)
+
+
+def test_all_nrel_sam_turbines_unique_file_names(nrel_sam_table):
+    nrel_sam_table.loc[2] = ['Other-Turbine', 2000, 90, '0|4|12|30', '0|500|2000|0']
+    turbines = turbine_models.all_nrel_sam_turbines()
+    assert [turbine.file_name for turbine in turbines] == ['some__turbine_1', 'other_turbine_1',
+                                                           'other_turbine_2']
+    assert turbines[2].capacity_mw == 2.
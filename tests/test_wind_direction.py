@@ -1,10 +1,22 @@
 import numpy as np
+import pandas as pd
+import pytest
 import xarray as xr
+from scipy.ndimage import uniform_filter1d
 
+from wind_repower_usa import wind_direction
+from wind_repower_usa.calculations import calc_simulated_energy
+from wind_repower_usa.calculations import calc_wind_speed_and_direction_at_turbines
 from wind_repower_usa.constants import EARTH_RADIUS_KM
+from wind_repower_usa.interpolation import calc_interpolation_stencil
 from wind_repower_usa.wind_direction import calc_wind_rose
 from wind_repower_usa.wind_direction import calc_directions
 from wind_repower_usa.wind_direction import calc_dist_in_direction
+from wind_repower_usa.wind_direction import calc_direction_histograms
+from wind_repower_usa.wind_direction import calc_wind_rose_streaming
+from wind_repower_usa.wind_direction import calc_directivity_profile
+from wind_repower_usa.wind_direction import calc_wind_rose_adaptive
+from wind_repower_usa.util import edges_to_center
 
 
 def test_calc_wind_rose():
@@ -143,3 +155,205 @@ def test_calc_dist_in_direction_turbines_in_a_grid():
     np.testing.assert_allclose(distances.sel(turbines=central_turbine.turbines),
                                [[dist, dist * 2**.5, dist, dist * 2**.5,
                                 dist, dist * 10**.5, 3 * dist, np.inf]])
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_calc_direction_histograms(dtype):
+    np.random.seed(42)
+    shape = 500, 30
+    directions = np.arctan2(np.random.normal(size=shape),
+                            np.random.normal(size=shape)).astype(dtype)
+    weights = np.random.weibull(2., size=shape).astype(dtype)
+
+    # values on bin edges, on range boundaries, outside of range and NaN
+    bins = 70
+    directions[0, :] = np.linspace(-np.pi, np.pi, bins + 1)[20:50]
+    directions[1, :] = np.pi
+    directions[2, :] = -np.pi
+    directions[3, :3] = 4., -4., np.nan
+
+    histograms, bin_edges = calc_direction_histograms(directions, weights, bins=bins)
+
+    for turbine_idx in range(shape[1]):
+        expected, expected_bin_edges = np.histogram(directions[:, turbine_idx],
+                                                    weights=weights[:, turbine_idx],
+                                                    range=(-np.pi, np.pi), bins=bins,
+                                                    density=True)
+        np.testing.assert_array_equal(histograms[turbine_idx], expected)
+        np.testing.assert_array_equal(bin_edges, expected_bin_edges)
+
+
+def test_calc_wind_rose_streaming(monkeypatch):
+    time = pd.date_range('2015-01-01', '2015-02-28 23:00', freq='h')
+    latitude = np.arange(50., 40., -0.5)
+    longitude = np.arange(-100., -90., 0.5)
+    np.random.seed(42)
+    shape = len(time), len(latitude), len(longitude)
+    wind_velocity = xr.Dataset({
+        'u100': (('time', 'latitude', 'longitude'), np.random.normal(size=shape) * 6.),
+        'v100': (('time', 'latitude', 'longitude'), np.random.normal(size=shape) * 6. + 2.),
+    },
+        coords={'time': time, 'latitude': latitude, 'longitude': longitude}
+    )
+
+    num_turbines = 30
+    turbines = xr.Dataset({
+        'xlong': ('turbines', np.random.uniform(-99., -91., size=num_turbines)),
+        'ylat': ('turbines', np.random.uniform(41., 49., size=num_turbines)),
+        't_cap': ('turbines', np.random.uniform(1000., 3000., size=num_turbines)),
+    },
+        coords={'turbines': np.arange(num_turbines)}
+    )
+    stencil = calc_interpolation_stencil(turbines, latitude, longitude)
+    wind_speed, directions = calc_wind_speed_and_direction_at_turbines(wind_velocity, turbines,
+                                                                       stencil)
+
+    def load_wind_speed(years, months, reduce_along=None):
+        return wind_speed.sel(time=f'{years}-{months:02d}')
+
+    def load_wind_direction(years, months, reduce_along=None):
+        # stored turbine major
+        return directions.sel(time=f'{years}-{months:02d}').transpose()
+
+    monkeypatch.setattr(wind_direction, 'load_wind_speed', load_wind_speed)
+    monkeypatch.setattr(wind_direction, 'load_wind_direction', load_wind_direction)
+
+    wind_rose, prevail_wind_direction, directivity = calc_wind_rose_streaming(
+        turbines, years=[2015], months=[1, 2], bins=70, directivity_width=15, chunk_hours=100)
+
+    # all hours at once
+    energy = calc_simulated_energy(wind_speed, turbines, sum_along='', only_built_turbines=False)
+    expected, _ = calc_direction_histograms(directions.values, energy.values, bins=70)
+
+    np.testing.assert_allclose(wind_rose, expected, rtol=1e-10)
+    assert wind_rose.num_samples == len(time)
+    assert np.all(wind_rose.turbines == turbines.turbines)
+    np.testing.assert_allclose(wind_rose.sum(dim='direction') * 2 * np.pi / 70, 1)
+    assert prevail_wind_direction.dims == directivity.dims == ('turbines',)
+
+
+def test_calc_directivity_profile():
+    np.random.seed(42)
+    num_turbines, bins = 40, 70
+    bin_edges = np.linspace(-np.pi, np.pi, bins + 1)
+    wind_rose = xr.DataArray(np.random.rand(num_turbines, bins),
+                             dims=('turbines', 'direction'),
+                             coords={'turbines': np.arange(num_turbines) + 5,
+                                     'direction': (bin_edges[1:] + bin_edges[:-1]) / 2})
+
+    directivity_widths = [1, 5, 15, 16, 90, 181, 360]
+    prevail_wind_direction, directivity = calc_directivity_profile(wind_rose, directivity_widths)
+
+    assert prevail_wind_direction.dims == directivity.dims == ('turbines', 'directivity_width')
+    np.testing.assert_array_equal(directivity.directivity_width, directivity_widths)
+
+    for directivity_width in directivity_widths:
+        boxcar_width = int(np.round(directivity_width / 360 * bins))
+        convoluted = wind_rose.values
+        if boxcar_width > 1:
+            convoluted = uniform_filter1d(wind_rose.values, boxcar_width, axis=1, mode='wrap')
+
+        # for 360° all directions are equally prevailing, the maximum is a matter of rounding
+        if directivity_width < 360:
+            np.testing.assert_array_equal(
+                prevail_wind_direction.sel(directivity_width=directivity_width),
+                wind_rose.direction.values[np.argmax(convoluted, axis=1)])
+        np.testing.assert_allclose(directivity.sel(directivity_width=directivity_width),
+                                   convoluted.max(axis=1) * np.radians(directivity_width),
+                                   rtol=1e-12)
+
+    with pytest.raises(ValueError):
+        calc_directivity_profile(wind_rose, [0, 15])
+
+
+def test_prevail_wind_direction_ties(monkeypatch):
+    # few hours with equal energy in a few bins, i.e. many equal maxima of smoothed wind roses
+    np.random.seed(42)
+    num_turbines, bins, directivity_width = 200, 70, 15
+    time = pd.date_range('2015-01-01', periods=48, freq='h')
+    turbines = xr.Dataset({'t_cap': ('turbines', np.full(num_turbines, 2000.))},
+                          coords={'turbines': np.arange(num_turbines)})
+
+    bin_edges = np.linspace(-np.pi, np.pi, bins + 1)
+    bin_centers = edges_to_center(bin_edges)
+    bin_idcs = np.random.randint(0, 8, size=(len(time), num_turbines)) * 7
+    coords = {'time': time, 'turbines': turbines.turbines}
+    wind_directions = xr.DataArray(bin_centers[bin_idcs], dims=('time', 'turbines'),
+                                   coords=coords)
+    wind_speed = xr.DataArray(np.full((len(time), num_turbines), 8.), dims=('time', 'turbines'),
+                              coords=coords)
+
+    monkeypatch.setattr(wind_direction, 'load_wind_speed',
+                        lambda years, months, reduce_along=None: wind_speed)
+    monkeypatch.setattr(wind_direction, 'load_wind_direction',
+                        lambda years, months, reduce_along=None: wind_directions)
+
+    wind_rose, prevail_wind_direction, directivity = calc_wind_rose_streaming(
+        turbines, years=[2015], months=[1], bins=bins, directivity_width=directivity_width)
+
+    # same as smoothing with uniform_filter1d() and taking the maximum
+    boxcar_width = int(np.round(directivity_width / 360 * bins))
+    convoluted = uniform_filter1d(wind_rose.values, boxcar_width, axis=1, mode='wrap')
+    np.testing.assert_array_equal(prevail_wind_direction,
+                                  bin_centers[np.argmax(convoluted, axis=1)])
+
+    # profiles take the first of equal maxima, window sums of counts are exact in integers
+    counts = np.array([np.bincount(bin_idcs[:, turbine], minlength=bins)
+                       for turbine in range(num_turbines)])
+    window_sums = sum(np.roll(counts, boxcar_width // 2 - shift, axis=1)
+                      for shift in range(boxcar_width))
+    assert np.any(np.sum(window_sums == window_sums.max(axis=1, keepdims=True), axis=1) > 1)
+
+    prevail_profile, directivity_profile = calc_directivity_profile(wind_rose,
+                                                                    [directivity_width, 30])
+    np.testing.assert_array_equal(prevail_profile.sel(directivity_width=directivity_width),
+                                  bin_centers[np.argmax(window_sums, axis=1)])
+    np.testing.assert_allclose(directivity_profile.sel(directivity_width=directivity_width),
+                               directivity, rtol=1e-12)
+
+
+def test_calc_wind_rose_adaptive():
+    np.random.seed(42)
+    num_time_stamps, num_turbines, num_uniform = 3000, 20, 5
+    time = pd.date_range('2015-01-01', periods=num_time_stamps, freq='h')
+    turbines = xr.Dataset({'t_cap': ('turbines', np.full(num_turbines, 2000.))},
+                          coords={'turbines': np.arange(num_turbines) + 3})
+
+    shape = num_time_stamps, num_turbines
+    directions = np.random.normal(0.5, 0.1, size=shape)
+    # no prevailing direction for the last turbines
+    directions[:, -num_uniform:] = np.random.uniform(-np.pi, np.pi, (num_time_stamps, num_uniform))
+    coords = {'time': time, 'turbines': turbines.turbines}
+    wind_direction = xr.DataArray(directions, dims=('time', 'turbines'), coords=coords)
+    wind_speed = xr.DataArray(np.random.weibull(2., size=shape) * 9., dims=('time', 'turbines'),
+                              coords=coords)
+
+    wind_rose, prevail_wind_direction, directivity, convergence = calc_wind_rose_adaptive(
+        turbines, wind_speed, wind_direction, bins=70, batch_size=200)
+
+    energy = calc_simulated_energy(wind_speed, turbines, sum_along='', only_built_turbines=False)
+    wind_roses_exact, bin_edges = calc_direction_histograms(directions, energy.values, bins=70)
+
+    # turbines with a prevailing direction converge early and close to the exact direction
+    converged = convergence.converged.values
+    assert np.all(converged[:-num_uniform])
+    assert np.all(convergence.num_samples[:-num_uniform] < num_time_stamps)
+    prevail_exact = edges_to_center(bin_edges)[np.argmax(wind_roses_exact, axis=1)]
+    np.testing.assert_allclose(prevail_wind_direction[:-num_uniform],
+                               prevail_exact[:-num_uniform], atol=2 * np.pi / 70 + 1e-12)
+
+    assert wind_rose.num_samples == convergence.num_samples.max()
+    assert np.all(convergence.turbines == turbines.turbines)
+
+    # all hours are used if turbines do not converge, i.e. the wind rose is exact
+    wind_rose, _, _, convergence = calc_wind_rose_adaptive(
+        turbines, wind_speed, wind_direction, bins=70, batch_size=200,
+        num_stable_batches=num_time_stamps)
+    assert not np.any(convergence.converged)
+    assert np.all(convergence.num_samples == num_time_stamps)
+    np.testing.assert_allclose(wind_rose, wind_roses_exact, rtol=1e-10)
+
+    _, _, _, convergence = calc_wind_rose_adaptive(
+        turbines, wind_speed, wind_direction, bins=70, batch_size=200,
+        num_stable_batches=num_time_stamps, max_samples=500)
+    assert np.all(convergence.num_samples == 500)
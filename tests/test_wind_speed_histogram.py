@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from wind_repower_usa.calculations import calc_simulated_energy
+from wind_repower_usa.turbine_models import ge15_77, e138ep3, se_42m140, e126
+from wind_repower_usa.wind_speed_histogram import calc_wind_speed_histogram
+from wind_repower_usa.wind_speed_histogram import calc_simulated_energy_from_histogram
+
+
+@pytest.fixture
+def wind_speed(synthetic_wind_speed):
+    wind_speed = synthetic_wind_speed()
+    wind_speed[0, 0] = 45.
+    wind_speed[0, 1] = np.nan
+    return wind_speed
+
+
+@pytest.mark.parametrize('chunks', [None, {'time': 48, 'turbines': 7}])
+def test_calc_wind_speed_histogram(chunks, wind_speed):
+    if chunks is not None:
+        wind_speed = wind_speed.chunk(chunks)
+
+    wind_speed_histogram = calc_wind_speed_histogram(wind_speed)
+
+    assert wind_speed_histogram['count'].dims == ('turbines', 'speed_bin')
+    assert wind_speed_histogram.sizes['speed_bin'] == 400
+
+    # NaN is ignored, 45m/s is counted in the last bin
+    counts = wind_speed_histogram['count'].sum(dim='speed_bin').values
+    assert counts[1] == 24 * 10 - 1
+    assert np.all(counts[[0] + list(range(2, 30))] == 24 * 10)
+    assert wind_speed_histogram['count'][0, -1] == 1
+
+    np.testing.assert_allclose(wind_speed_histogram.wind_speed_sum.sum(dim='speed_bin'),
+                               wind_speed.sum(dim='time').values)
+
+    expected_counts, _ = np.histogram(wind_speed.values[:, 5], bins=np.arange(401) * 0.1)
+    np.testing.assert_array_equal(wind_speed_histogram['count'][5], expected_counts)
+
+
+@pytest.mark.parametrize('turbine_model', [ge15_77, e138ep3, se_42m140, e126],
+                         ids=lambda t: t.file_name)
+def test_calc_simulated_energy_from_histogram(turbine_model, wind_speed):
+    # se_42m140 is not defined above 40m/s
+    wind_speed = wind_speed.fillna(0.).clip(max=35.)
+    turbines = xr.Dataset(coords={'turbines': np.arange(30)})
+
+    wind_speed_histogram = calc_wind_speed_histogram(wind_speed)
+    simulated_energy_gwh = calc_simulated_energy_from_histogram(wind_speed_histogram,
+                                                                turbine_model.power_curve)
+
+    expected = calc_simulated_energy(wind_speed.copy(), turbines,
+                                     power_curve=turbine_model.power_curve,
+                                     sum_along='time', capacity_scaling=False,
+                                     only_built_turbines=False)
+
+    np.testing.assert_allclose(simulated_energy_gwh, expected, rtol=1e-9)
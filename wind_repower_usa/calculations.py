@@ -1,34 +1,100 @@
-import time
 import logging
 import warnings
+from functools import partial
 
+import dask.array as da
 import numpy as np
+import pandas as pd
 import xarray as xr
 from dask.diagnostics import ProgressBar
 
-from wind_repower_usa.config import MONTHS
+from wind_repower_usa.chunks import chunk_for_reduction
+from wind_repower_usa.config import MONTHS, COMPUTE_DTYPE
+from wind_repower_usa.energy_kernel import calc_building_dates, calc_energy_dask
+from wind_repower_usa.energy_kernel import calc_energy_numpy, calc_month_offsets
+from wind_repower_usa.energy_kernel import fits_into_memory, BufferPool
+from wind_repower_usa.interpolation import interpolate_at_turbines
 from wind_repower_usa.load_data import load_turbines, load_wind_velocity
 from wind_repower_usa.load_data import load_wind_speed
+from wind_repower_usa.pipeline import calc_months_parallel, get_worker_data, prefetch_months
+from wind_repower_usa.power_curves import PowerCurves
 from wind_repower_usa.turbine_models import ge15_77
 
 
-def calc_wind_speed_at_turbines(wind_velocity, turbines):
-    # interpolate at turbine locations
-    wind_velocity_at_turbines = wind_velocity.interp(
-        longitude=xr.DataArray(turbines.xlong.values, dims='turbines'),
-        latitude=xr.DataArray(turbines.ylat.values, dims='turbines'),
-        method='linear')
+def calc_wind_speed_at_turbines(wind_velocity, turbines, stencil=None, weights=None):
+    """Interpolate wind velocity at turbine locations and calculate wind speed.
+
+    Parameters
+    ----------
+    wind_velocity : xr.Dataset
+        as returned by load_wind_velocity()
+    turbines : xr.DataSet
+        as returned by load_turbines()
+    stencil : xr.Dataset
+        as returned by load_interpolation_stencil(), if None weights for linear interpolation
+        are calculated by ``xr.Dataset.interp()`` (slow if called for many months)
+    weights : scipy.sparse.csr_matrix
+        see interpolate_at_turbines(), avoids re-building the sparse matrix from ``stencil``
+
+    Returns
+    -------
+    xr.DataArray
+        dims = time, turbines, dtype = COMPUTE_DTYPE
+
+    """
+    u100, v100 = _wind_velocity_at_turbines(wind_velocity, turbines, stencil, weights)
 
     # velocity --> speed
-    wind_speed = (wind_velocity_at_turbines.u100**2
-                  + wind_velocity_at_turbines.v100**2)**0.5
+    wind_speed = ((u100**2 + v100**2)**0.5).astype(COMPUTE_DTYPE, copy=False)
 
     return wind_speed
 
 
+def calc_wind_speed_and_direction_at_turbines(wind_velocity, turbines, stencil=None,
+                                              weights=None):
+    """Interpolate wind velocity at turbine locations once and calculate wind speed and wind
+    direction, see calc_wind_speed_at_turbines() for parameters.
+
+    Returns
+    -------
+    wind_speed : xr.DataArray
+        dims = time, turbines, dtype = COMPUTE_DTYPE
+    wind_direction : xr.DataArray
+        direction the wind blows to in rad (between -np.pi and np.pi, i.e. 0 is east, np.pi/2 is
+        north), dims = time, turbines, dtype = COMPUTE_DTYPE
+
+    """
+    u100, v100 = _wind_velocity_at_turbines(wind_velocity, turbines, stencil, weights)
+
+    wind_speed = ((u100**2 + v100**2)**0.5).astype(COMPUTE_DTYPE, copy=False)
+    wind_direction = np.arctan2(v100, u100).astype(COMPUTE_DTYPE, copy=False)
+
+    return wind_speed, wind_direction
+
+
+def _wind_velocity_at_turbines(wind_velocity, turbines, stencil, weights):
+    """Interpolate u100 and v100 at turbine locations, see calc_wind_speed_at_turbines()."""
+    if stencil is None:
+        # interpolate at turbine locations
+        wind_velocity_at_turbines = wind_velocity.interp(
+            longitude=xr.DataArray(turbines.xlong.values, dims='turbines'),
+            latitude=xr.DataArray(turbines.ylat.values, dims='turbines'),
+            method='linear')
+        u100 = wind_velocity_at_turbines.u100
+        v100 = wind_velocity_at_turbines.v100
+    else:
+        if stencil.sizes['turbines'] != turbines.sizes['turbines']:
+            raise ValueError("interpolation stencil was calculated for different turbines")
+        u100 = interpolate_at_turbines(wind_velocity.u100, stencil, weights)
+        v100 = interpolate_at_turbines(wind_velocity.v100, stencil, weights)
+
+    return u100, v100
+
+
 def calc_simulated_energy(wind_speed, turbines, power_curve=None, sum_along='turbines',
-                          capacity_scaling=True, only_built_turbines=True):
-    """Estimate generated energy using wind data and turbine data.
+                          capacity_scaling=True, only_built_turbines=True, out=None, buffers=None,
+                          progress_bar=True):
+    """Estimate generated energy using wind data and turbine data. ``wind_speed`` is not modified.
 
     Parameters
     ----------
@@ -39,20 +105,26 @@ def calc_simulated_energy(wind_speed, turbines, power_curve=None, sum_along='tur
     power_curve : callable
         a function mapping wind speed to power
     sum_along : str
-        sum along turbines or time or emtpy string
+        sum along turbines (monthly sums) or time or emtpy string, 'month' for monthly sums per
+        turbine
     capacity_scaling : bool
         scale power curve to capacity for each turbine (if available)
     only_built_turbines : bool
         calculate energy only for time stamps where commission year is older
+    out : np.ndarray
+        float64 array of the shape of the result to store the result, the returned DataArray
+        wraps ``out``, i.e. don't re-use it while the result is needed
+    buffers : energy_kernel.BufferPool
+        buffers for temporary arrays, pass the same pool for repeated calls (e.g. for each month)
+        to avoid allocations
+    progress_bar : bool
+        show a progress bar if computed with dask
 
     Returns
     -------
     simulated_energy_gwh : xr.DataArray
-        Simulated energy per month [GWh], dims = (time, turbines)
-
-
-    FIXME this modifies the input wind_speed variable! Very dangerous but unclear if solvable
-     without too much memory consumption (via copying)
+        Simulated energy [GWh], dims = (time, turbines) without the dims summed along, for
+        monthly sums time is the first day of each month
 
     """
     if power_curve is None:
@@ -63,69 +135,179 @@ def calc_simulated_energy(wind_speed, turbines, power_curve=None, sum_along='tur
     #  runtime, but where else to put it? pytest ignores warnings.catch_warnings()...
     warnings.filterwarnings('ignore', 'The da.atop function has moved to da.blockwise')
 
-    # TODO this is a bit scary, when does parallelized not work? Which dtype?
-    simulated_energy = xr.apply_ufunc(power_curve, wind_speed,
-                                      dask='parallelized',
-                                      output_dtypes=[np.float64])
+    wind_speed = wind_speed.transpose('time', 'turbines')
+    if not wind_speed.indexes['time'].is_monotonic_increasing:
+        wind_speed = wind_speed.sortby('time')
 
-    simulated_energy = simulated_energy.assign_coords(turbines=turbines.turbines)
+    time = wind_speed.time.values.astype('datetime64[ns]').astype(np.int64)
 
+    building_start = building_end = capacity_factor = None
     if only_built_turbines:
-        # TODO all turbines where year = NaN will be removed that way... :-/
-        # this is the beginning of the year the turbine has been commissioned
-        building_dates = turbines.p_year.astype(int).astype(str).astype(np.datetime64)
+        building_start, building_end = calc_building_dates(turbines)
+    if capacity_scaling:
+        capacity_factor = calc_capacity_scaling(turbines).values
+
+    # monthly sums are accumulated chunk by chunk using precomputed month boundaries
+    is_monthly = sum_along in ('turbines', 'month')
+    time_offsets = None
+    if sum_along == 'time':
+        time_offsets = np.array([0])
+    elif is_monthly:
+        time_offsets, months = calc_month_offsets(wind_speed.time.values)
+
+    # power curve, commissioning, capacity scaling and sum in one sweep per chunk, see
+    # energy_block(), without dask if the data fits into memory
+    if wind_speed.chunks is None or fits_into_memory(wind_speed):
+        calc_energy = partial(calc_energy_numpy, buffers=buffers)
+        wind_speed_data = wind_speed.values
+    else:
+        calc_energy = partial(calc_energy_dask, progress_bar=progress_bar)
+        reduce_along = 'time' if sum_along == 'month' else sum_along or None
+        wind_speed_data = chunk_for_reduction(wind_speed, reduce_along=reduce_along,
+                                              name='wind_speed').data
+
+    if sum_along == 'time' and out is not None:
+        # internally there is a time dim of length one
+        out = out[np.newaxis]
+
+    simulated_energy = calc_energy(wind_speed_data, time, power_curve,
+                                   building_start=building_start,
+                                   building_end=building_end,
+                                   capacity_factor=capacity_factor,
+                                   time_offsets=time_offsets,
+                                   sum_turbines=sum_along == 'turbines',
+                                   out=out)
+    if sum_along == 'time':
+        simulated_energy = simulated_energy[0]
+
+    dims = {'time': ['turbines'], 'turbines': ['time']}.get(sum_along, ['time', 'turbines'])
+    coords = {name: coord for name, coord in wind_speed.coords.items()
+              if set(coord.dims) <= set(dims) and not (is_monthly and 'time' in coord.dims)}
+    if is_monthly:
+        coords['time'] = months
+    simulated_energy_gwh = xr.DataArray(simulated_energy, dims=dims, coords=coords)
+    if 'turbines' in dims:
+        simulated_energy_gwh = simulated_energy_gwh.assign_coords(turbines=turbines.turbines)
+
+    if is_monthly:
+        simulated_energy_gwh.name = "Simulated energy per month [GWh]"
+    elif sum_along == 'time':
+        simulated_energy_gwh.name = "Simulated energy"  # TODO unit depends on time range?
 
-        nanosecs_of_year = (simulated_energy.time - building_dates).astype(np.float)
-        proportion_of_year = nanosecs_of_year / (365.25 * 24 * 60 * 60 * 1e9)
+    return simulated_energy_gwh
 
-        # comparing objects with dim "time" and dim "turbines" results in (time, turbines)
-        building_this_year = simulated_energy.time.dt.year == turbines.p_year
 
-        simulated_energy = simulated_energy.where(~building_this_year,
-                                                  simulated_energy * proportion_of_year)
+def calc_capacity_scaling(turbines):
+    """Factor to scale the power curve of ge15_77 to the capacity of each turbine (1 if capacity
+    is not available)."""
+    # FIXME this should use turbine_model.capacity_mw not 1500!
+    return (turbines.t_cap / 1500.).fillna(1.)
 
-        already_built = simulated_energy.time.dt.year >= turbines.p_year
-        simulated_energy = simulated_energy.where(already_built, 0)
 
-        # Uargh... there is a weired memory leak somewhere, this seems to help a bit at least... :-/
-        del nanosecs_of_year
-        del proportion_of_year
-        del building_this_year
-        del building_dates
-        del already_built
+def calc_simulated_energy_models(wind_speed, turbines, turbine_models):
+    """Estimate generated energy per turbine location for several turbine models at once. Every
+    chunk of ``wind_speed`` is loaded only once and evaluated for all power curves, so the costs
+    are dominated by a single pass over the data, no matter how many models are passed.
+
+    Parameters
+    ----------
+    wind_speed : xr.DataArray
+        see calc_wind_speed_at_turbines()
+    turbines : xr.DataSet
+        see load_turbines()
+    turbine_models : list of Turbine
+        e.g. ``[ge15_77] + list(new_turbine_models())`` or all_nrel_sam_turbines()
+
+    Returns
+    -------
+    simulated_energy_gwh : xr.DataArray
+        Simulated energy summed over time [GWh], dims = (turbine_model, turbines), no capacity
+        scaling and not restricted to built turbines, see calc_capacity_scaling()
+
+    """
+    power_curves = PowerCurves([turbine_model.power_curve for turbine_model in turbine_models])
+
+    wind_speed = chunk_for_reduction(wind_speed.transpose('time', 'turbines'),
+                                     reduce_along='time', name='wind_speed')
+
+    def sum_block(wind_speed_block):
+        # add time dim of length one, one per time chunk, summed up below
+        return power_curves.sum(wind_speed_block, axis=0)[:, np.newaxis, :]
+
+    if wind_speed.chunks is None:
+        simulated_energy = power_curves.sum(wind_speed.values, axis=0)
+    else:
+        data = wind_speed.data
+        simulated_energy = da.map_blocks(
+            sum_block, data,
+            new_axis=0,
+            chunks=((len(power_curves),), (1,) * data.numblocks[0], data.chunks[1]),
+            dtype=np.float64,
+        ).sum(axis=1)
+
+        with ProgressBar():
+            simulated_energy = simulated_energy.compute()
+
+    simulated_energy_gwh = xr.DataArray(
+        simulated_energy * 1e-6,
+        dims=('turbine_model', 'turbines'),
+        coords={'turbine_model': [turbine_model.file_name for turbine_model in turbine_models],
+                'turbines': turbines.turbines},
+        name="Simulated energy",
+    )
+    return simulated_energy_gwh
 
-    if capacity_scaling:
-        # FIXME this should use turbine_model.capacity_mw not 1500!
-        simulated_energy *= (turbines.t_cap / 1500.).fillna(1.)
 
-    # inspired by:
-    # http://xarray.pydata.org/en/stable/examples/weather-data.html#monthly-averaging
+def calc_simulated_energy_per_location_years(years, turbine_models, turbines=None):
+    """Estimate generated energy per turbine location and year for several turbine models (see
+    calc_simulated_energy_models()). Energy is accumulated month by month while the next month is
+    read (see prefetch_months()), i.e. memory usage does not depend on the number of years.
 
-    simulated_energy = simulated_energy.sortby('time') * 1e-6
+    Parameters
+    ----------
+    years : iterable of int
+        eg. range(2000, 2019)
+    turbine_models : list of Turbine
+    turbines : xr.DataSet
+        as returned by load_turbines()
 
-    if sum_along:
-        simulated_energy = simulated_energy.sum(dim=sum_along)
-    if sum_along == 'turbines':
-        simulated_energy = simulated_energy.resample(time='1MS').sum()
+    Returns
+    -------
+    simulated_energy_gwh_per_year : xr.DataArray
+        Simulated energy per year [GWh/yr], dims = (year, turbine_model, turbines), use
+        ``.mean(dim='year')`` for the long-term annual mean, no capacity scaling and not
+        restricted to built turbines
 
-    # Does not work for multiple years:
-    # simulated_energy = simulated_energy.sum(dim='turbines').groupby('time.month').sum() * 1e-6
+    """
+    if turbines is None:
+        turbines = load_turbines()
 
-    with ProgressBar():
-        simulated_energy_gwh = simulated_energy.compute()
+    years = list(years)
+    simulated_energy = None
 
-    if sum_along == 'turbines':
-        simulated_energy_gwh.name = "Simulated energy per month [GWh]"
-    elif sum_along == 'time':
-        simulated_energy_gwh.name = "Simulated energy"  # TODO unit depends on time range?
+    year_months = [(year, month) for year in years for month in MONTHS]
+    for year, month, wind_speed in prefetch_months(_load_wind_speed_month, year_months):
+        logging.info("Calculating simulated energy per location for %s-%02d...", year, month)
+        simulated_energy_month = calc_simulated_energy_models(wind_speed, turbines,
+                                                              turbine_models)
+        if simulated_energy is None:
+            simulated_energy = np.zeros((len(years),) + simulated_energy_month.shape)
+        simulated_energy[years.index(year)] += simulated_energy_month.values
 
-    return simulated_energy_gwh
+    simulated_energy_gwh_per_year = xr.DataArray(
+        simulated_energy,
+        dims=('year',) + simulated_energy_month.dims,
+        coords={'year': years, **simulated_energy_month.coords},
+        name="Simulated energy per year [GWh/yr]",
+    )
+    return simulated_energy_gwh_per_year
 
 
 def calc_simulated_energy_years(years, turbines=None, power_curve=None, capacity_scaling=True,
-                                only_built_turbines=True):
-    """Load wind speed data from processed files and calculate energy in a loop to avoid large
-    data in memory for the parts where dask chunks are not correctly working yet.
+                                only_built_turbines=True, num_processes=None,
+                                checkpoint_dir=None, buffers=None):
+    """Load wind speed data from processed files and calculate monthly energy for all years,
+    either in one chunked pass or month by month in parallel processes.
 
     Parameters
     ----------
@@ -135,41 +317,116 @@ def calc_simulated_energy_years(years, turbines=None, power_curve=None, capacity
         as returned by load_turbines()
     power_curve : callable
         see calc_simulated_energy()
+    num_processes : int
+        if given, months are calculated in a pool of processes, see calc_months_parallel()
+    checkpoint_dir : pathlib.Path
+        results of each month are stored here when calculated in parallel, i.e. an interrupted
+        run can be continued, required if ``num_processes`` is given
+    buffers : energy_kernel.BufferPool
+        buffers for temporary arrays of the single pass, pass the same pool for repeated calls
+        (e.g. for each year) to avoid allocations, each worker process uses its own pool for all
+        of its months
 
     Returns
     -------
     xr.DataArray
 
     """
-    eta = False
-    simulated_energy_gwh = []
     if turbines is None:
         turbines = load_turbines()
 
-    with ProgressBar():
-        for year in years:
-            for month in range(1, 13):
-                t0 = time.time()
-                logging.info("Calculating {}-{:02d}...".format(year, month))
-                wind_speed = load_wind_speed(year, month)
-                simulated_energy_gwh.append(
-                    calc_simulated_energy(
-                        wind_speed=wind_speed,
-                        turbines=turbines,
-                        power_curve=power_curve,
-                        capacity_scaling=capacity_scaling,
-                        only_built_turbines=only_built_turbines
-                    )
-                )
-
-                if not eta:
-                    logging.info("ETA: %s seconds", (time.time() - t0) * 12 * len(years))
-                    eta = True
-
-    simulated_energy_gwh = xr.concat(simulated_energy_gwh, dim='time')
+    if num_processes is not None:
+        if checkpoint_dir is None:
+            raise ValueError("checkpoint_dir is required to calculate months in parallel")
+
+        # turbines and an empty buffer pool are sent once to each worker, not with every month
+        calc_month = partial(_calc_simulated_energy_month,
+                             capacity_scaling=capacity_scaling,
+                             only_built_turbines=only_built_turbines)
+        return calc_months_parallel(calc_month, years, MONTHS, checkpoint_dir,
+                                    num_processes=num_processes,
+                                    worker_data={'turbines': turbines,
+                                                 'power_curve': power_curve,
+                                                 'buffers': BufferPool()})
+
+    logging.info("Calculating simulated energy for years %s...", years)
+    wind_speed = load_wind_speed(years, MONTHS, reduce_along='turbines')
+
+    simulated_energy_gwh = calc_simulated_energy(
+        wind_speed=wind_speed,
+        turbines=turbines,
+        power_curve=power_curve,
+        capacity_scaling=capacity_scaling,
+        only_built_turbines=only_built_turbines,
+        buffers=buffers,
+    )
     return simulated_energy_gwh
 
 
+def _load_wind_speed_month(year, month):
+    return load_wind_speed(year, month, reduce_along='turbines').load()
+
+
+def _calc_simulated_energy_month(year, month, capacity_scaling, only_built_turbines):
+    wind_speed = load_wind_speed(year, month, reduce_along='turbines')
+    return calc_simulated_energy(wind_speed, get_worker_data('turbines'),
+                                 power_curve=get_worker_data('power_curve'),
+                                 capacity_scaling=capacity_scaling,
+                                 only_built_turbines=only_built_turbines,
+                                 buffers=get_worker_data('buffers'),
+                                 progress_bar=False)
+
+
+def calc_precision_report(wind_speed, turbines, power_curve=None):
+    """Compare aggregated outputs of calc_simulated_energy() for wind speed in float32 and float64
+    (see COMPUTE_DTYPE in config), i.e. rounding of wind speed to float32 and hourly energy
+    calculated in float32.
+
+    Parameters
+    ----------
+    wind_speed : xr.DataArray
+        as returned by load_wind_speed()
+    turbines : xr.DataSet
+        as returned by load_turbines()
+    power_curve : callable
+        see calc_simulated_energy()
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per aggregation, maximum absolute difference [GWh], maximum relative difference
+        (ignoring zeros) and relative difference of the total
+
+    """
+    aggregations = {
+        'monthly time series': 'turbines',
+        'energy per location': 'time',
+        'monthly energy per location': 'month',
+    }
+
+    report = []
+    for aggregation, sum_along in aggregations.items():
+        logging.info("Comparing float32 and float64 for %s...", aggregation)
+        simulated_energy = {
+            dtype: calc_simulated_energy(wind_speed.astype(dtype), turbines,
+                                         power_curve=power_curve, sum_along=sum_along).values
+            for dtype in (np.float32, np.float64)
+        }
+        difference = np.abs(simulated_energy[np.float32] - simulated_energy[np.float64])
+        is_nonzero = simulated_energy[np.float64] != 0
+        total = simulated_energy[np.float64].sum()
+
+        report.append({
+            'aggregation': aggregation,
+            'max_abs_diff_gwh': difference.max(),
+            'max_rel_diff': (difference[is_nonzero] /
+                             np.abs(simulated_energy[np.float64][is_nonzero])).max(),
+            'total_rel_diff': abs(simulated_energy[np.float32].sum() - total) / abs(total),
+        })
+
+    return pd.DataFrame(report).set_index('aggregation')
+
+
 def calc_bounding_box_usa(turbines, extension=1.):
     # Bounding box can be also manually selected:
     #   https://boundingbox.klokantech.com/
@@ -218,7 +475,7 @@ def calc_wind_speed_probablity(num_samples=200, year=2016, bins=150):
 
 
 def calc_mean_wind_speed(years, sample_size=200):
-    wind_velocity = load_wind_velocity(years, MONTHS)
+    wind_velocity = load_wind_velocity(years, MONTHS, reduce_along='time')
     idcs_time = np.random.choice(wind_velocity.time.shape[0],
                                  size=sample_size, replace=False)
 
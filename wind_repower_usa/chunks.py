@@ -0,0 +1,144 @@
+import os
+import logging
+
+import dask
+import numpy as np
+import psutil
+
+from wind_repower_usa.config import MEMORY_BUDGET_BYTES, NUM_PROCESSES
+
+# dask computations hold several chunks per thread in memory (input, intermediate results, output)
+CHUNK_MEMORY_FACTOR = 8
+
+# overrides MEMORY_BUDGET_BYTES for the current process, see set_memory_budget()
+_memory_budget_bytes = None
+
+
+def set_memory_budget(memory_budget_bytes):
+    """Set the memory budget for the current process, e.g. in worker processes of a pool. None
+    resets to the default, see calc_memory_budget()."""
+    global _memory_budget_bytes
+    _memory_budget_bytes = memory_budget_bytes
+
+
+def calc_memory_budget():
+    """Memory in bytes available for one process: the value passed to set_memory_budget() or
+    MEMORY_BUDGET_BYTES if configured, otherwise the currently available RAM shared between
+    NUM_PROCESSES processes."""
+    if _memory_budget_bytes is not None:
+        return _memory_budget_bytes
+    if MEMORY_BUDGET_BYTES is not None:
+        return MEMORY_BUDGET_BYTES
+    return psutil.virtual_memory().available / NUM_PROCESSES
+
+
+def num_scheduler_threads():
+    """Number of chunks processed at the same time by the dask scheduler of the current process,
+    i.e. 1 for the synchronous scheduler used in worker processes of a pool (see create_pool())."""
+    scheduler = dask.config.get('scheduler', None)
+    if scheduler in ('synchronous', 'sync', 'single-threaded') or scheduler is dask.get:
+        return 1
+    return dask.config.get('num_workers', None) or os.cpu_count()
+
+
+def disk_chunks(variable):
+    """Chunk sizes of a variable in the file it was loaded from.
+
+    Parameters
+    ----------
+    variable : xr.DataArray or xr.Variable
+        opened from netCDF or Zarr
+
+    Returns
+    -------
+    dict
+        dim --> chunk size, empty dict if the file is not chunked
+
+    """
+    chunks = variable.encoding.get('chunks') or variable.encoding.get('chunksizes')
+    if chunks is None:
+        return {}
+    return dict(zip(variable.dims, chunks))
+
+
+def plan_chunks(sizes, itemsize, reduce_along=None, disk_chunks=None, memory_budget=None,
+                num_threads=None, name='data'):
+    """Choose dask chunk sizes such that chunks fit into memory, are aligned to chunks on disk and
+    are as large as possible along the dimension which is going to be reduced.
+
+    Starting with the chunks on disk, chunks are extended along ``reduce_along`` first (in
+    multiples of the chunk size on disk) as long as they fit into memory and then along the other
+    dimensions (last dimension first).
+
+    Parameters
+    ----------
+    sizes : dict
+        dim --> size of the data
+    itemsize : int
+        bytes per element
+    reduce_along : str or None
+        dimension which is going to be reduced by the caller, e.g. 'time' or 'turbines'
+    disk_chunks : dict
+        dim --> chunk size on disk, see disk_chunks()
+    memory_budget : float
+        bytes available for the computation, default: calc_memory_budget()
+    num_threads : int
+        number of chunks computed at the same time sharing ``memory_budget``, default:
+        num_scheduler_threads()
+    name : str
+        used for logging only
+
+    Returns
+    -------
+    dict
+        dim --> chunk size
+
+    """
+    if memory_budget is None:
+        memory_budget = calc_memory_budget()
+    if disk_chunks is None:
+        disk_chunks = {}
+    if num_threads is None:
+        num_threads = num_scheduler_threads()
+
+    max_chunk_bytes = memory_budget / (CHUNK_MEMORY_FACTOR * num_threads)
+
+    chunks = {dim: min(disk_chunks.get(dim, 1), size) for dim, size in sizes.items()}
+
+    dims = [dim for dim in reversed(list(sizes)) if dim != reduce_along]
+    if reduce_along in sizes:
+        dims = [reduce_along] + dims
+
+    for dim in dims:
+        other_bytes = itemsize * np.prod([chunks[d] for d in sizes if d != dim])
+        num_disk_chunks = max(1, int(max_chunk_bytes // (other_bytes * chunks[dim])))
+        chunks[dim] = min(sizes[dim], num_disk_chunks * chunks[dim])
+
+    chunk_bytes = itemsize * np.prod(list(chunks.values()))
+    logging.info("Chunk plan for %s (reduce along %s): %s, %.1fMB per chunk, "
+                 "memory budget %.1fMB", name, reduce_along, chunks, chunk_bytes * 1e-6,
+                 memory_budget * 1e-6)
+
+    return chunks
+
+
+def chunk_for_reduction(data, reduce_along, name='data'):
+    """Rechunk a dask backed xarray object for a reduction along ``reduce_along``, see
+    plan_chunks(). Data in memory is returned unchanged.
+
+    Parameters
+    ----------
+    data : xr.DataArray
+    reduce_along : str or None
+
+    Returns
+    -------
+    xr.DataArray
+
+    """
+    if data.chunks is None:
+        return data
+
+    chunks = plan_chunks(dict(data.sizes), data.dtype.itemsize, reduce_along=reduce_along,
+                         disk_chunks=disk_chunks(data), name=name)
+    return data.chunk(chunks)
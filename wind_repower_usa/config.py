@@ -2,12 +2,28 @@ import pathlib
 
 NUM_PROCESSES = 8
 
+# memory in bytes available per process for dask chunks, None: available RAM / NUM_PROCESSES
+MEMORY_BUDGET_BYTES = None
+
+# number of months loaded in advance while the current month is processed, see prefetch_months()
+PREFETCH_DEPTH = 1
+
+# 'float32': keep wind speed, wind directions and hourly energy in single precision (half memory
+#     and disk space, ERA5 data is float32 anyway), sums are always accumulated in float64,
+#     see scripts/validate_float32.py for the difference to 'float64'
+COMPUTE_DTYPE = 'float64'
+
 # used for downloading, calculation of time series etc
 YEARS = range(2000, 2019)
 MONTHS = range(1, 13)
 
 DISTANCE_FACTORS = 2, 3, 4, 6
 
+# 'turbines': store interpolated wind speed for each turbine location
+# 'grid_cells': store ERA5 wind velocity only for grid cells around turbines, wind speed at turbine
+#     locations is interpolated on demand when loading (needs much less disk space)
+WIND_SPEED_STORAGE = 'turbines'
+
 LOG_FILE = pathlib.Path(__file__).parent.parent / 'data' / 'logfile.log'
 
 INTERIM_DIR = pathlib.Path(__file__).parent.parent / 'data' / 'interim'
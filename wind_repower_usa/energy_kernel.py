@@ -0,0 +1,359 @@
+from contextlib import nullcontext
+
+import dask.array as da
+import numpy as np
+from dask.diagnostics import ProgressBar
+
+from wind_repower_usa.chunks import calc_memory_budget
+from wind_repower_usa.power_curves import PowerCurve
+
+NANOSECONDS_PER_YEAR = 365.25 * 24 * 60 * 60 * 1e9
+
+# in-memory data is processed without dask, if input, output and buffers fit into memory
+FAST_PATH_MEMORY_FACTOR = 4
+
+# size of blocks processed at once by calc_energy_numpy(), small enough to keep buffers in cache
+KERNEL_BLOCK_BYTES = 2**22
+KERNEL_BLOCK_TURBINES = 1024
+
+
+class BufferPool:
+    """Named buffers re-used for calculations of the same kind, e.g. for each month: a buffer is
+    allocated only if no buffer of this name is large enough yet. Buffers returned by ``get()``
+    are views of the same memory, i.e. the previous content is overwritten by the next user."""
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name, shape, dtype=np.float64):
+        """Uninitialized buffer of given shape and dtype.
+
+        Parameters
+        ----------
+        name : str
+            buffers of different names do not share memory
+        shape : tuple of int
+        dtype : np.dtype
+
+        Returns
+        -------
+        np.ndarray
+
+        """
+        size = int(np.prod(shape))
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.dtype != dtype or buffer.size < size:
+            buffer = np.empty(size, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer[:size].reshape(shape)
+
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+
+def calc_building_dates(turbines):
+    """Begin of the commission year and begin of the following year for each turbine as
+    nanoseconds since epoch (int64). Turbines without commission year are never built.
+
+    Parameters
+    ----------
+    turbines : xr.DataSet
+        as returned by load_turbines()
+
+    Returns
+    -------
+    building_start, building_end : np.ndarray
+
+    """
+    p_year = turbines.p_year.values
+    is_known = ~np.isnan(p_year)
+
+    never = np.iinfo(np.int64).max
+    building_start = np.full(p_year.shape, never, dtype=np.int64)
+    building_end = np.full(p_year.shape, never, dtype=np.int64)
+
+    years = p_year[is_known].astype(int).astype(str)
+    building_start[is_known] = years.astype('datetime64[ns]').astype(np.int64)
+    building_end[is_known] = (years.astype('datetime64[Y]') + 1).astype(
+        'datetime64[ns]').astype(np.int64)
+
+    return building_start, building_end
+
+
+def energy_dtype(wind_speed):
+    """Hourly energy is calculated in float32 for float32 wind speed, otherwise in float64. Sums
+    are always accumulated in float64."""
+    return np.float32 if wind_speed.dtype == np.float32 else np.float64
+
+
+def energy_block(wind_speed, time, power_curve, building_start=None, building_end=None,
+                 capacity_factor=None, out=None, scratch=None):
+    """Simulated energy in GWh for a block of wind speed: power curve, commissioning weights,
+    capacity scaling and unit conversion in one sweep, modifying a single output array in place.
+    ``wind_speed`` is never modified, also not if ``power_curve`` returns its input.
+
+    Parameters
+    ----------
+    wind_speed : np.ndarray
+        dims = (time, turbines), not modified
+    time : np.ndarray
+        nanoseconds since epoch (int64), shape (time, 1)
+    power_curve : callable
+        a function mapping wind speed to power, PowerCurve writes directly to ``out``
+    building_start, building_end : np.ndarray
+        shape (turbines,) see calc_building_dates(), None to ignore commissioning dates
+    capacity_factor : np.ndarray
+        shape (turbines,) see calc_capacity_scaling(), None for no capacity scaling
+    out : np.ndarray
+        buffer of the shape of ``wind_speed`` for the result, see energy_dtype()
+    scratch : np.ndarray
+        buffer of the shape and dtype of ``out`` for commissioning weights
+
+    Returns
+    -------
+    np.ndarray
+        shape of ``wind_speed``, dtype see energy_dtype()
+
+    """
+    if isinstance(power_curve, PowerCurve):
+        if out is None:
+            out = np.empty(wind_speed.shape, dtype=energy_dtype(wind_speed))
+        energy = power_curve(wind_speed, out=out)
+    else:
+        energy = power_curve(wind_speed)
+        if out is not None:
+            out[...] = energy
+            energy = out
+        elif np.may_share_memory(energy, wind_speed):
+            energy = np.array(energy, dtype=energy_dtype(wind_speed))
+
+    if building_start is not None:
+        if scratch is None:
+            scratch = np.empty(wind_speed.shape, dtype=energy.dtype)
+
+        # proportion of the year passed in the commission year, 1 afterwards, 0 before
+        proportion_of_year = np.subtract(time, building_start, out=scratch)
+        proportion_of_year /= NANOSECONDS_PER_YEAR
+        np.copyto(proportion_of_year, 1., where=time >= building_end)
+        energy *= proportion_of_year
+        np.copyto(energy, 0., where=time < building_start)
+
+    if capacity_factor is not None:
+        energy *= capacity_factor
+
+    energy *= 1e-6
+
+    return energy
+
+
+def fits_into_memory(wind_speed):
+    """True if the simulated energy for ``wind_speed`` can be calculated without dask."""
+    return (wind_speed.size * np.dtype(energy_dtype(wind_speed)).itemsize *
+            FAST_PATH_MEMORY_FACTOR < calc_memory_budget())
+
+
+def calc_month_offsets(time):
+    """Index of the first time stamp of each month, i.e. boundaries for monthly aggregation.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        sorted datetime64 values
+
+    Returns
+    -------
+    time_offsets : np.ndarray
+        int, index in ``time``
+    months : np.ndarray
+        datetime64[ns], first day of each month
+
+    """
+    months = time.astype('datetime64[ns]').astype('datetime64[M]')
+    is_first_of_month = np.ones(months.shape, dtype=bool)
+    is_first_of_month[1:] = months[1:] != months[:-1]
+    time_offsets = np.flatnonzero(is_first_of_month)
+    return time_offsets, months[time_offsets].astype('datetime64[ns]')
+
+
+def _sum_time_bins(energy, time_start, time_offsets):
+    """Sum a block of energy starting at index ``time_start`` along time for each time bin
+    overlapping the block, bins are defined by their first index ``time_offsets``. Returns the
+    index of the first overlapping bin and the sums (one row per overlapping bin)."""
+    time_stop = time_start + len(energy)
+    first_bin = np.searchsorted(time_offsets, time_start, side='right') - 1
+    stop_bin = np.searchsorted(time_offsets, time_stop, side='left')
+    bin_starts = np.maximum(time_offsets[first_bin:stop_bin], time_start) - time_start
+    return first_bin, np.add.reduceat(energy, bin_starts, axis=0, dtype=np.float64)
+
+
+def _result_shape(wind_speed, time_offsets, sum_turbines):
+    num_time_stamps, num_turbines = wind_speed.shape
+    num_rows = num_time_stamps if time_offsets is None else len(time_offsets)
+    return (num_rows,) if sum_turbines else (num_rows, num_turbines)
+
+
+def calc_energy_numpy(wind_speed, time, power_curve, building_start=None, building_end=None,
+                      capacity_factor=None, time_offsets=None, sum_turbines=False, out=None,
+                      buffers=None):
+    """Apply energy_block() block by block to an array in memory, buffers are allocated once and
+    re-used for all blocks. Each block is reduced into a fixed size accumulator immediately. With
+    ``out`` and ``buffers`` given, nothing is allocated (except for small temporary arrays).
+
+    Parameters
+    ----------
+    wind_speed : np.ndarray
+        dims = (time, turbines)
+    time : np.ndarray
+        nanoseconds since epoch (int64), shape (time,)
+    power_curve, building_start, building_end, capacity_factor
+        see energy_block()
+    time_offsets : np.ndarray
+        sum along time for bins starting at these indices, e.g. ``[0]`` to sum over all time
+        stamps or calc_month_offsets() for monthly sums, None for no sum along time
+    sum_turbines : bool
+        sum along turbines
+    out : np.ndarray
+        float64 array of the shape of the result to write the result to
+    buffers : BufferPool
+        to re-use buffers for blocks between calls, e.g. when called for each month
+
+    Returns
+    -------
+    np.ndarray
+        dims = (time or time bins, turbines), dim turbines is dropped if ``sum_turbines``, sums
+        are float64, hourly energy see energy_dtype()
+
+    """
+    if buffers is None:
+        buffers = BufferPool()
+
+    num_time_stamps, num_turbines = wind_speed.shape
+    dtype = energy_dtype(wind_speed)
+    turbines_per_block = min(num_turbines, KERNEL_BLOCK_TURBINES)
+    time_per_block = KERNEL_BLOCK_BYTES // (np.dtype(dtype).itemsize * turbines_per_block)
+    chunks = {'turbines': turbines_per_block,
+              'time': min(num_time_stamps, max(1, time_per_block))}
+
+    write_in_place = time_offsets is None and not sum_turbines
+    result = _result_array(wind_speed, time_offsets, sum_turbines, out)
+    if not write_in_place:
+        result[...] = 0.
+
+    buffer_shape = chunks['time'], chunks['turbines']
+    energy_buffer = buffers.get('energy_block', buffer_shape, dtype=dtype)
+    scratch = (buffers.get('scratch', buffer_shape, dtype=dtype)
+               if building_start is not None else None)
+
+    time = time[:, np.newaxis]
+
+    for time_start in range(0, num_time_stamps, chunks['time']):
+        time_slice = slice(time_start, min(time_start + chunks['time'], num_time_stamps))
+        for turbines_start in range(0, num_turbines, chunks['turbines']):
+            turbines_slice = slice(turbines_start,
+                                   min(turbines_start + chunks['turbines'], num_turbines))
+
+            block_shape = (time_slice.stop - time_slice.start,
+                           turbines_slice.stop - turbines_slice.start)
+            out_block = (result[time_slice, turbines_slice] if write_in_place else
+                         energy_buffer[:block_shape[0], :block_shape[1]])
+
+            energy = energy_block(
+                wind_speed[time_slice, turbines_slice],
+                time[time_slice],
+                power_curve,
+                *_select_turbines(turbines_slice, building_start, building_end, capacity_factor),
+                out=out_block,
+                scratch=None if scratch is None else scratch[:block_shape[0], :block_shape[1]])
+
+            if write_in_place:
+                continue
+
+            if sum_turbines:
+                energy = energy.sum(axis=1, dtype=np.float64)
+
+            if time_offsets is None:
+                rows = time_slice
+            else:
+                first_bin, energy = _sum_time_bins(energy, time_start, time_offsets)
+                rows = slice(first_bin, first_bin + len(energy))
+
+            if sum_turbines:
+                result[rows] += energy
+            else:
+                result[rows, turbines_slice] += energy
+
+    return result
+
+
+def calc_energy_dask(wind_speed, time, power_curve, building_start=None, building_end=None,
+                     capacity_factor=None, time_offsets=None, sum_turbines=False, out=None,
+                     progress_bar=True):
+    """Same as calc_energy_numpy(), but for a dask array: energy_block() is applied to each chunk
+    (in parallel) and each chunk is reduced to sums per time bin. Time bins overlapping several
+    chunks are added up after computing. Buffers for chunks are allocated by dask. Pass
+    ``progress_bar=False`` in worker processes, progress bars of workers would be interleaved."""
+    time = time[:, np.newaxis]
+
+    def energy_chunk(wind_speed_chunk, block_info=None):
+        (time_start, time_stop), (turbines_start, turbines_stop) = (
+            block_info[0]['array-location'])
+        turbines_slice = slice(turbines_start, turbines_stop)
+
+        energy = energy_block(
+            wind_speed_chunk,
+            time[time_start:time_stop],
+            power_curve,
+            *_select_turbines(turbines_slice, building_start, building_end, capacity_factor))
+
+        if sum_turbines:
+            energy = energy.sum(axis=1, keepdims=True, dtype=np.float64)
+        if time_offsets is not None:
+            _, energy = _sum_time_bins(energy, time_start, time_offsets)
+        return energy
+
+    chunks_time, chunks_turbines = wind_speed.chunks
+    if time_offsets is not None:
+        # one row per time bin overlapping the chunk, bin index of each row in row_bins
+        chunk_starts = np.cumsum((0,) + chunks_time[:-1])
+        row_bins = []
+        for chunk_start, chunk_size in zip(chunk_starts, chunks_time):
+            first_bin = np.searchsorted(time_offsets, chunk_start, side='right') - 1
+            stop_bin = np.searchsorted(time_offsets, chunk_start + chunk_size, side='left')
+            row_bins.append(np.arange(first_bin, stop_bin))
+        chunks_time = tuple(len(bins) for bins in row_bins)
+    if sum_turbines:
+        chunks_turbines = (1,) * len(chunks_turbines)
+
+    is_sum = sum_turbines or time_offsets is not None
+    energy = da.map_blocks(energy_chunk, wind_speed, chunks=(chunks_time, chunks_turbines),
+                           dtype=np.float64 if is_sum else energy_dtype(wind_speed))
+    if sum_turbines:
+        energy = energy.sum(axis=1)
+
+    with ProgressBar() if progress_bar else nullcontext():
+        energy = energy.compute()
+
+    if time_offsets is None and out is None:
+        return energy
+
+    result = _result_array(wind_speed, time_offsets, sum_turbines, out)
+    if time_offsets is None:
+        result[...] = energy
+    else:
+        result[...] = 0.
+        np.add.at(result, np.concatenate(row_bins), energy)
+    return result
+
+
+def _result_array(wind_speed, time_offsets, sum_turbines, out):
+    result_shape = _result_shape(wind_speed, time_offsets, sum_turbines)
+    if out is None:
+        is_sum = sum_turbines or time_offsets is not None
+        return np.empty(result_shape, dtype=np.float64 if is_sum else energy_dtype(wind_speed))
+    if out.shape != result_shape:
+        raise ValueError(f"out has shape {out.shape}, but result has shape {result_shape}")
+    return out
+
+
+def _select_turbines(turbines_slice, *per_turbine):
+    return [None if values is None else values[turbines_slice] for values in per_turbine]
@@ -0,0 +1,308 @@
+import numpy as np
+import scipy.sparse
+import xarray as xr
+
+from wind_repower_usa.config import COMPUTE_DTYPE
+
+
+def _linear_weights(coords, points):
+    """Find the two neighboring grid points and the linear weight of the upper one for each point.
+    Works also for descending coordinates (ERA5 latitude is stored from north to south).
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        1D grid coordinates (strictly monotone)
+    points : np.ndarray
+        coordinates of points to be interpolated
+
+    Returns
+    -------
+    lower_idcs, upper_idcs, fraction : np.ndarray
+        indices refer to ``coords``, fraction is the weight of ``upper_idcs``
+
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    points = np.asarray(points, dtype=np.float64)
+
+    order = np.argsort(coords)
+    coords_sorted = coords[order]
+
+    if np.any(points < coords_sorted[0]) or np.any(points > coords_sorted[-1]):
+        raise ValueError("points outside of grid, cannot interpolate: "
+                         f"grid range=({coords_sorted[0]}, {coords_sorted[-1]}), "
+                         f"points range=({points.min()}, {points.max()})")
+
+    idcs = np.searchsorted(coords_sorted, points, side='right') - 1
+    idcs = np.clip(idcs, 0, len(coords_sorted) - 2)
+
+    lower = coords_sorted[idcs]
+    upper = coords_sorted[idcs + 1]
+    fraction = (points - lower) / (upper - lower)
+
+    return order[idcs], order[idcs + 1], fraction
+
+
+def calc_interpolation_stencil(turbines, latitude, longitude):
+    """Calculate bilinear interpolation weights of grid points for each turbine location. The
+    result depends only on turbine locations and the grid, therefore it can be calculated once
+    and re-used for every month of ERA5 data.
+
+    Parameters
+    ----------
+    turbines : xr.DataSet
+        as returned by load_turbines()
+    latitude : array_like
+        latitude coordinates of the grid, e.g. ``wind_velocity.latitude``
+    longitude : array_like
+        longitude coordinates of the grid, e.g. ``wind_velocity.longitude``
+
+    Returns
+    -------
+    xr.Dataset
+        ``latitude_idx``, ``longitude_idx`` and ``weight`` with dims = turbines, corner (4 grid
+        points surrounding each turbine), grid coordinates are stored as coords latitude and
+        longitude
+
+    """
+    lat_lower, lat_upper, lat_fraction = _linear_weights(latitude, turbines.ylat.values)
+    lon_lower, lon_upper, lon_fraction = _linear_weights(longitude, turbines.xlong.values)
+
+    latitude_idx = np.column_stack((lat_lower, lat_lower, lat_upper, lat_upper))
+    longitude_idx = np.column_stack((lon_lower, lon_upper, lon_lower, lon_upper))
+    weight = np.column_stack((
+        (1. - lat_fraction) * (1. - lon_fraction),
+        (1. - lat_fraction) * lon_fraction,
+        lat_fraction * (1. - lon_fraction),
+        lat_fraction * lon_fraction,
+    ))
+
+    stencil = xr.Dataset({
+        'latitude_idx': (('turbines', 'corner'), latitude_idx),
+        'longitude_idx': (('turbines', 'corner'), longitude_idx),
+        'weight': (('turbines', 'corner'), weight),
+        'xlong': ('turbines', turbines.xlong.values),
+        'ylat': ('turbines', turbines.ylat.values),
+    },
+        coords={
+            'latitude': np.asarray(latitude),
+            'longitude': np.asarray(longitude),
+        }
+    )
+    return stencil
+
+
+def stencil_to_sparse(stencil, dtype=COMPUTE_DTYPE):
+    """Convert the stencil to a sparse matrix of shape (turbines, latitude * longitude), which
+    maps a flattened grid field to values at turbine locations.
+
+    Parameters
+    ----------
+    stencil : xr.Dataset
+        as returned by calc_interpolation_stencil()
+    dtype : str or np.dtype
+        dtype of weights, float32 weights keep float32 fields in float32 when interpolating
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+
+    """
+    num_turbines = stencil.sizes['turbines']
+    num_longitude = stencil.sizes['longitude']
+    shape = num_turbines, stencil.sizes['latitude'] * num_longitude
+
+    rows = np.repeat(np.arange(num_turbines), stencil.sizes['corner'])
+    cols = (stencil.latitude_idx.values * num_longitude + stencil.longitude_idx.values).flatten()
+
+    # duplicates (e.g. weight 0 at the grid boundary) are summed up
+    return scipy.sparse.csr_matrix((stencil.weight.values.flatten(), (rows, cols)), shape=shape,
+                                   dtype=dtype)
+
+
+def interpolate_at_turbines(field, stencil, weights=None):
+    """Interpolate a gridded field at turbine locations using a precomputed stencil, i.e. a sparse
+    matrix product per time stamp instead of calculating interpolation weights every time.
+
+    Parameters
+    ----------
+    field : xr.DataArray
+        with dims latitude and longitude (and any other dims, e.g. time), grid must be the same
+        as used for the stencil
+    stencil : xr.Dataset
+        as returned by calc_interpolation_stencil()
+    weights : scipy.sparse.csr_matrix
+        as returned by stencil_to_sparse(), will be calculated if not given
+
+    Returns
+    -------
+    xr.DataArray
+        dims = (other dims of ``field``..., turbines)
+
+    """
+    if not (np.array_equal(field.latitude.values, stencil.latitude.values) and
+            np.array_equal(field.longitude.values, stencil.longitude.values)):
+        raise ValueError("grid of field does not match grid of interpolation stencil")
+
+    if weights is None:
+        weights = stencil_to_sparse(stencil)
+
+    field_at_turbines = _apply_sparse(field, weights, core_dims=['latitude', 'longitude'])
+
+    return field_at_turbines.assign_coords(longitude=('turbines', stencil.xlong.values),
+                                           latitude=('turbines', stencil.ylat.values))
+
+
+def _apply_sparse(field, weights, core_dims):
+    """Multiply sparse matrix ``weights`` of shape (turbines, product of sizes of core_dims) with
+    ``field`` (lazily if field is a dask array)."""
+    num_turbines = weights.shape[0]
+
+    def interpolate(values):
+        other_shape = values.shape[:-len(core_dims)]
+        values_flat = values.reshape(-1, weights.shape[1])
+        return (weights @ values_flat.T).T.reshape(other_shape + (num_turbines,))
+
+    return xr.apply_ufunc(
+        interpolate, field,
+        input_core_dims=[core_dims],
+        output_core_dims=[['turbines']],
+        dask='parallelized',
+        output_dtypes=[np.result_type(field.dtype, weights.dtype)],
+        dask_gufunc_kwargs={'output_sizes': {'turbines': num_turbines}},
+    )
+
+
+def calc_grid_cells(stencil):
+    """Reduce the grid to the cells which are needed to interpolate at turbine locations. Turbines
+    are heavily clustered, so there are much less grid cells than turbines.
+
+    Parameters
+    ----------
+    stencil : xr.Dataset
+        as returned by calc_interpolation_stencil()
+
+    Returns
+    -------
+    xr.Dataset
+        ``cell_idx`` and ``weight`` with dims = turbines, corner: index of the grid cell in dim
+        cells and its weight for each turbine, ``latitude_idx`` and ``longitude_idx`` with
+        dim = cells: indices in the original grid, coords latitude and longitude with dim = cells
+
+    """
+    num_longitude = stencil.sizes['longitude']
+    grid_idcs = stencil.latitude_idx.values * num_longitude + stencil.longitude_idx.values
+
+    grid_idcs_cells, cell_idx = np.unique(grid_idcs, return_inverse=True)
+    latitude_idx = grid_idcs_cells // num_longitude
+    longitude_idx = grid_idcs_cells % num_longitude
+
+    grid_cells = xr.Dataset({
+        'cell_idx': (('turbines', 'corner'), cell_idx.reshape(grid_idcs.shape)),
+        'weight': (('turbines', 'corner'), stencil.weight.values),
+        'xlong': ('turbines', stencil.xlong.values),
+        'ylat': ('turbines', stencil.ylat.values),
+        'latitude_idx': ('cells', latitude_idx),
+        'longitude_idx': ('cells', longitude_idx),
+    },
+        coords={
+            'latitude': ('cells', stencil.latitude.values[latitude_idx]),
+            'longitude': ('cells', stencil.longitude.values[longitude_idx]),
+        }
+    )
+    return grid_cells
+
+
+def select_grid_cells(wind_velocity, grid_cells):
+    """Pick time series of grid cells from a gridded field.
+
+    Parameters
+    ----------
+    wind_velocity : xr.Dataset or xr.DataArray
+        dims latitude and longitude must match the grid used to calculate ``grid_cells``
+    grid_cells : xr.Dataset
+        as returned by calc_grid_cells()
+
+    Returns
+    -------
+    same type as wind_velocity, dims latitude and longitude replaced by dim = cells
+
+    """
+    return wind_velocity.isel(latitude=grid_cells.latitude_idx,
+                              longitude=grid_cells.longitude_idx)
+
+
+def cells_to_sparse(grid_cells, dtype=COMPUTE_DTYPE):
+    """Same as stencil_to_sparse(), but mapping grid cells (instead of the full grid) to turbine
+    locations, shape: (turbines, cells)."""
+    num_turbines = grid_cells.sizes['turbines']
+    rows = np.repeat(np.arange(num_turbines), grid_cells.sizes['corner'])
+    return scipy.sparse.csr_matrix((grid_cells.weight.values.flatten(),
+                                    (rows, grid_cells.cell_idx.values.flatten())),
+                                   shape=(num_turbines, grid_cells.sizes['cells']),
+                                   dtype=dtype)
+
+
+def interpolate_cells_at_turbines(field, grid_cells, weights=None):
+    """Same as interpolate_at_turbines(), but for fields given only at grid cells.
+
+    Parameters
+    ----------
+    field : xr.DataArray
+        with dim cells, as returned by select_grid_cells()
+    grid_cells : xr.Dataset
+        as returned by calc_grid_cells()
+    weights : scipy.sparse.csr_matrix
+        as returned by cells_to_sparse(), will be calculated if not given
+
+    Returns
+    -------
+    xr.DataArray
+        dims = (other dims of ``field``..., turbines)
+
+    """
+    if weights is None:
+        weights = cells_to_sparse(grid_cells)
+
+    # coordinates along cells would conflict with coordinates along turbines
+    field = field.drop_vars([name for name, coord in field.coords.items()
+                             if 'cells' in coord.dims])
+
+    field_at_turbines = _apply_sparse(field, weights, core_dims=['cells'])
+
+    return field_at_turbines.assign_coords(longitude=('turbines', grid_cells.xlong.values),
+                                           latitude=('turbines', grid_cells.ylat.values))
+
+
+def calc_wind_speed_from_cells(wind_velocity_cells):
+    """Interpolate wind velocity stored for grid cells at turbine locations and calculate wind
+    speed (lazily if data is a dask array).
+
+    Parameters
+    ----------
+    wind_velocity_cells : xr.Dataset
+        u100 and v100 with dims = time, cells and the grid cells as returned by calc_grid_cells(),
+        see also storage.append_wind_velocity_cells()
+
+    Returns
+    -------
+    xr.DataArray
+        dims = time, turbines
+
+    """
+    u100, v100 = _wind_velocity_cells_at_turbines(wind_velocity_cells)
+    return ((u100**2 + v100**2)**0.5).astype(COMPUTE_DTYPE, copy=False)
+
+
+def calc_wind_direction_from_cells(wind_velocity_cells):
+    """Same as calc_wind_speed_from_cells(), but calculates wind direction in rad (between -np.pi
+    and np.pi, i.e. 0 is east, np.pi/2 is north)."""
+    u100, v100 = _wind_velocity_cells_at_turbines(wind_velocity_cells)
+    return np.arctan2(v100, u100).astype(COMPUTE_DTYPE, copy=False)
+
+
+def _wind_velocity_cells_at_turbines(wind_velocity_cells):
+    weights = cells_to_sparse(wind_velocity_cells)
+    u100 = interpolate_cells_at_turbines(wind_velocity_cells.u100, wind_velocity_cells, weights)
+    v100 = interpolate_cells_at_turbines(wind_velocity_cells.v100, wind_velocity_cells, weights)
+    return u100, v100
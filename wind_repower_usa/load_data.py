@@ -1,27 +1,44 @@
+import os
 import json
+import hashlib
+import logging
 
+import numpy as np
 import pandas as pd
 import xarray as xr
 
-from wind_repower_usa.config import INTERIM_DIR, EXTERNAL_DIR
+from wind_repower_usa.chunks import chunk_for_reduction, disk_chunks, plan_chunks
+from wind_repower_usa.config import INTERIM_DIR, EXTERNAL_DIR, WIND_SPEED_STORAGE, COMPUTE_DTYPE
+from wind_repower_usa.interpolation import calc_wind_speed_from_cells
+from wind_repower_usa.interpolation import calc_wind_direction_from_cells
+from wind_repower_usa.storage import WIND_SPEED_STORE, open_store, select_months
+from wind_repower_usa.storage import stored_months, wind_speed_store, WIND_VELOCITY_CELLS_STORE
 from wind_repower_usa.turbine_models import ge15_77
 
 NUM_TURBINES = 58000
 
 
-def load_turbines():
+def load_turbines(columns=None):
     """Load list of all turbines from CSV file. Includes location, capacity,
     etc. Missing values are replaced with NaN values.
 
     The file uswtdb_v1_2_20181001.xml contains more information about the fields.
 
+    Parameters
+    ----------
+    columns : list of str
+        load only these columns (xlong is always needed), default: all columns
+
     Returns
     -------
     xr.DataSet
 
     """
-    turbines_dataframe = pd.read_csv(EXTERNAL_DIR / 'wind_turbines_usa' /
-                                     'uswtdb_v1_3_20190107.csv')
+    if columns is not None and 'xlong' not in columns:
+        columns = list(columns) + ['xlong']
+
+    turbines_dataframe = read_csv_cached(EXTERNAL_DIR / 'wind_turbines_usa' /
+                                         'uswtdb_v1_3_20190107.csv', columns=columns)
 
     # TODO is this really how it is supposed to be done?
     turbines_dataframe.index = turbines_dataframe.index.rename('turbines')
@@ -36,6 +53,78 @@ def load_turbines():
     return turbines
 
 
+def read_csv_cached(fname, columns=None, cache_dir=INTERIM_DIR / 'csv_cache'):
+    """Read a CSV file using a binary columnar cache. The cache is an uncompressed npz file with
+    one array per column (strings are stored as categoricals) and is keyed by the hash of the CSV
+    content, i.e. it is rebuilt automatically if the CSV file changes. Only requested columns are
+    read from the cache.
+
+    Parameters
+    ----------
+    fname : pathlib.Path
+    columns : list of str
+        default: all columns
+    cache_dir : pathlib.Path
+
+    Returns
+    -------
+    pd.DataFrame
+
+    """
+    content_hash = hashlib.sha1(fname.read_bytes()).hexdigest()
+    cache_fname = cache_dir / f'{fname.stem}-{content_hash}.npz'
+
+    if not cache_fname.exists():
+        logging.info("Creating cache %s for %s...", cache_fname, fname)
+        _write_csv_cache(pd.read_csv(fname), cache_fname)
+
+        for outdated_cache_fname in cache_dir.glob(f'{fname.stem}-*.npz'):
+            if outdated_cache_fname != cache_fname:
+                outdated_cache_fname.unlink()
+
+    with np.load(cache_fname, allow_pickle=False) as cache:
+        all_columns = list(cache['columns'])
+        if columns is None:
+            columns = all_columns
+
+        missing_columns = set(columns) - set(all_columns)
+        if missing_columns:
+            raise ValueError(f"columns not found in {fname}: {sorted(missing_columns)}")
+
+        data = {}
+        for column in all_columns:
+            if column not in columns:
+                continue
+            if column in cache.files:
+                data[column] = cache[column]
+            else:
+                codes = cache[f'{column}.codes']
+                values = cache[f'{column}.categories'].astype(object)[codes]
+                values[codes == -1] = np.nan
+                data[column] = values
+
+    return pd.DataFrame(data)
+
+
+def _write_csv_cache(dataframe, cache_fname):
+    arrays = {'columns': np.array(dataframe.columns, dtype=str)}
+    for column in dataframe.columns:
+        values = dataframe[column]
+        if pd.api.types.is_numeric_dtype(values):
+            arrays[column] = values.values
+        else:
+            categorical = pd.Categorical(values)
+            arrays[f'{column}.codes'] = categorical.codes
+            arrays[f'{column}.categories'] = np.array(categorical.categories, dtype=str)
+
+    # write to a temporary file first: other processes might read the cache concurrently
+    cache_fname.parent.mkdir(parents=True, exist_ok=True)
+    cache_fname_tmp = cache_fname.with_name(f'{cache_fname.name}.{os.getpid()}.part')
+    with open(cache_fname_tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(cache_fname_tmp, cache_fname)
+
+
 def load_generated_energy_gwh():
     with open(EXTERNAL_DIR / 'energy_generation' / 'ELEC.GEN.WND-US-99.M.json', 'r') as f:
         generated_energy_json = json.load(f)
@@ -49,8 +138,21 @@ def load_generated_energy_gwh():
                         name="Generated energy per month [GWh]")
 
 
-def load_wind_velocity(year, month):
-    """month/year can be list or int"""
+def load_wind_velocity(year, month, reduce_along=None):
+    """Load wind velocity as downloaded from ERA5.
+
+    Parameters
+    ----------
+    year : int or list of ints
+    month : int or list of ints
+    reduce_along : str or None
+        dimension the caller is going to reduce, used to choose dask chunks, see plan_chunks()
+
+    Returns
+    -------
+    xr.Dataset
+
+    """
     try:
         iter(year)
     except TypeError:
@@ -65,13 +167,20 @@ def load_wind_velocity(year, month):
               'wind_velocity_usa_{y}-{m:02d}.nc'.format(m=m, y=y)
               for m in month for y in year]
 
-    # TODO how to calculate this better? Could be performance or RAM issue!
-    chunk_size_total = 1e6
-    time_chunk_size = int(chunk_size_total / NUM_TURBINES)
+    # chunks cannot span multiple files, so one file is enough for planning, latitude and
+    # longitude are not chunked because interpolation needs the whole grid
+    with xr.open_dataset(fnames[0]) as wind_velocity:
+        u100 = wind_velocity.u100
+        chunks = plan_chunks(dict(u100.sizes), u100.dtype.itemsize,
+                             reduce_along=reduce_along,
+                             disk_chunks={**disk_chunks(u100),
+                                          'latitude': u100.sizes['latitude'],
+                                          'longitude': u100.sizes['longitude']},
+                             name='wind_velocity')
 
     wind_velocity_datasets = [
         xr.open_dataset(fname,
-                        chunks={'time': time_chunk_size})
+                        chunks=chunks)
         for fname in fnames]
 
     wind_velocity = xr.concat(wind_velocity_datasets, dim='time')
@@ -79,17 +188,24 @@ def load_wind_velocity(year, month):
     return wind_velocity
 
 
-def load_wind_speed(years, months):
-    """Load wind speed from processed data files.
+def load_wind_speed(years, months, reduce_along=None):
+    """Load wind speed from the consolidated store (see storage.append_wind_speed()). If the store
+    does not exist yet, the processed monthly data files are used instead. If WIND_SPEED_STORAGE
+    is set to 'grid_cells', wind speed is interpolated lazily from grid cells instead.
 
     Parameters
     ----------
     years : int or list of ints
     months : int or list of ints
+    reduce_along : str or None
+        dimension the caller is going to reduce, 'time' picks the turbine-major store (see
+        storage.rechunk_wind_speed()) if it exists and contains all requested months, also used
+        to choose dask chunks, see plan_chunks()
 
     Returns
     -------
     xr.DataArray
+        dtype = COMPUTE_DTYPE (converted lazily if stored with a different dtype)
 
     """
     try:
@@ -102,21 +218,145 @@ def load_wind_speed(years, months):
     except TypeError:
         months = [months]
 
+    if WIND_SPEED_STORAGE == 'grid_cells':
+        return calc_wind_speed_from_cells(
+            _load_wind_velocity_cells(years, months, reduce_along, name='wind_speed'))
+
+    store = wind_speed_store(reduce_along)
+    if store != WIND_SPEED_STORE and not ({(year, month) for year in years for month in months}
+                                          <= stored_months(store)):
+        logging.warning("Store %s is not up to date, run scripts/rechunk_wind_speed.py", store)
+        store = WIND_SPEED_STORE
+
+    if store.exists():
+        wind_speed = select_months(open_store(store), years, months).wind_speed
+        wind_speed = chunk_for_reduction(wind_speed, reduce_along, name='wind_speed')
+        return wind_speed.astype(COMPUTE_DTYPE, copy=False)
+
     fnames = [INTERIM_DIR / 'wind_speed_usa_era5' /
               'wind_speed_usa_era5-{}-{:02d}.nc'.format(year, month)
               for year in years for month in months]
 
-    # TODO how to calculate this better? Could be performance or RAM issue!
-    chunk_size_total = 1e6
-    time_chunk_size = int(chunk_size_total / NUM_TURBINES)
+    # chunks cannot span multiple files, so one file is enough for planning
+    with xr.open_dataarray(fnames[0]) as wind_speed:
+        chunks = plan_chunks(dict(wind_speed.sizes), wind_speed.dtype.itemsize,
+                             reduce_along=reduce_along,
+                             disk_chunks=disk_chunks(wind_speed),
+                             name='wind_speed')
 
     wind_speed = xr.open_mfdataset(fnames,
-                                   chunks={'time': time_chunk_size})
+                                   chunks=chunks)
 
     if len(wind_speed.data_vars) != 1:
         raise ValueError("This is not a DataArray")
 
-    return wind_speed.__xarray_dataarray_variable__
+    return wind_speed.__xarray_dataarray_variable__.astype(COMPUTE_DTYPE, copy=False)
+
+
+def stored_wind_speed_dtype(year, month):
+    """Data type of wind speed on disk, i.e. before decoding and conversion to COMPUTE_DTYPE in
+    load_wind_speed(), e.g. int16 if written with WIND_SPEED_ENCODING.
+
+    Parameters
+    ----------
+    year : int
+    month : int
+        only used if wind speed is stored in monthly files
+
+    Returns
+    -------
+    np.dtype
+
+    """
+    if WIND_SPEED_STORAGE == 'grid_cells':
+        variable = open_store(WIND_VELOCITY_CELLS_STORE).u100
+    elif WIND_SPEED_STORE.exists():
+        variable = open_store(WIND_SPEED_STORE).wind_speed
+    else:
+        fname = (INTERIM_DIR / 'wind_speed_usa_era5' /
+                 'wind_speed_usa_era5-{}-{:02d}.nc'.format(year, month))
+        with xr.open_dataarray(fname) as variable:
+            pass
+    return np.dtype(variable.encoding.get('dtype', variable.dtype))
+
+
+def _load_wind_velocity_cells(years, months, reduce_along, name):
+    """Open the store of wind velocity per grid cell with dask chunks for interpolation at all
+    turbines, see load_wind_speed()."""
+    wind_velocity_cells = select_months(open_store(WIND_VELOCITY_CELLS_STORE), years, months)
+
+    # interpolation needs all cells and results in chunks with all turbines
+    chunks = plan_chunks({'time': wind_velocity_cells.sizes['time'],
+                          'turbines': wind_velocity_cells.sizes['turbines']},
+                         np.dtype(np.float64).itemsize,
+                         reduce_along=reduce_along,
+                         disk_chunks={**disk_chunks(wind_velocity_cells.u100),
+                                      'turbines': wind_velocity_cells.sizes['turbines']},
+                         name=name)
+    return wind_velocity_cells.chunk({'time': chunks['time'], 'cells': -1})
+
+
+def load_wind_direction(years, months, reduce_along=None):
+    """Load wind direction at turbine locations as written by scripts/calc_wind_speed.py together
+    with wind speed, i.e. interpolated from the same ERA5 wind velocity. This avoids reading the
+    ERA5 grid again for wind direction analyses. If WIND_SPEED_STORAGE is set to 'grid_cells',
+    wind direction is interpolated lazily from grid cells instead (as wind speed).
+
+    Parameters
+    ----------
+    years : int or list of ints
+    months : int or list of ints
+    reduce_along : str or None
+        dimension the caller is going to reduce, used to choose dask chunks, see plan_chunks()
+
+    Returns
+    -------
+    xr.DataArray
+        direction the wind blows to in rad (between -np.pi and np.pi, i.e. 0 is east, np.pi/2 is
+        north), dims = time, turbines, dtype = COMPUTE_DTYPE
+
+    """
+    try:
+        iter(years)
+    except TypeError:
+        years = [years]
+
+    try:
+        iter(months)
+    except TypeError:
+        months = [months]
+
+    if WIND_SPEED_STORAGE == 'grid_cells':
+        return calc_wind_direction_from_cells(
+            _load_wind_velocity_cells(years, months, reduce_along, name='wind_direction'))
+
+    fnames = [INTERIM_DIR / 'wind_direction_usa_era5' /
+              'wind_direction_usa_era5-{}-{:02d}.nc'.format(year, month)
+              for year in years for month in months]
+
+    # chunks cannot span multiple files, so one file is enough for planning
+    with xr.open_dataarray(fnames[0]) as wind_direction:
+        chunks = plan_chunks(dict(wind_direction.sizes), wind_direction.dtype.itemsize,
+                             reduce_along=reduce_along,
+                             disk_chunks=disk_chunks(wind_direction),
+                             name='wind_direction')
+
+    wind_direction = xr.open_mfdataset(fnames, chunks=chunks)
+
+    if len(wind_direction.data_vars) != 1:
+        raise ValueError("This is not a DataArray")
+
+    wind_direction = wind_direction.__xarray_dataarray_variable__.astype(COMPUTE_DTYPE, copy=False)
+
+    # rounding to the resolution of WIND_DIRECTION_ENCODING leads to values slightly outside of
+    # [-pi, pi], which would be ignored in histograms
+    return wind_direction.clip(-np.pi, np.pi)
+
+
+def load_interpolation_stencil():
+    """Load weights for interpolation of ERA5 grid at turbine locations, see
+    calc_interpolation_stencil()."""
+    return xr.open_dataset(INTERIM_DIR / 'interpolation' / 'interpolation_stencil_era5.nc')
 
 
 def load_optimal_locations(turbine_model, distance_factor):
@@ -127,14 +367,23 @@ def load_optimal_locations(turbine_model, distance_factor):
     return is_optimal_location
 
 
-def load_simulated_energy_per_location(turbine_model, capacity_scaling=False):
+def load_simulated_energy_per_location(turbine_model, capacity_scaling=False, per_year=False):
+    """Load simulated energy per turbine location [GWh/yr], long-term annual mean or for each year
+    (dims = year, turbines) if ``per_year``, see scripts/calc_simulated_energy_per_location.py."""
     scaling_str = '' if not capacity_scaling else '_capacity_scaled'
+    per_year_str = '' if not per_year else '_per_year'
     simulated_energy_per_location = xr.open_dataarray(
         INTERIM_DIR / 'simulated_energy_per_location' /
-        f'simulated_energy_{turbine_model.file_name}{scaling_str}_gwh.nc')
+        f'simulated_energy_{turbine_model.file_name}{scaling_str}{per_year_str}_gwh.nc')
     return simulated_energy_per_location
 
 
+def load_wind_speed_histogram(years):
+    """Load wind speed histogram per turbine location, see calc_wind_speed_histogram()."""
+    return xr.open_dataset(INTERIM_DIR / 'wind_speed_histogram' /
+                           f'wind_speed_histogram_{years[0]}-{years[-1]}.nc')
+
+
 def load_repower_potential(turbine_model_new, distance_factor):
     turbine_model_old = ge15_77
     if turbine_model_new == 'mixed':
@@ -160,6 +409,12 @@ def load_prevail_wind_direction():
     return prevail_wind_direction
 
 
+def load_directivity_profile():
+    """Load prevailing wind direction and directivity for several directivity widths (dims =
+    turbines, directivity_width), see calc_directivity_profile()."""
+    return xr.open_dataset(INTERIM_DIR / 'wind-direction' / 'directivity_profile.nc')
+
+
 def load_distance_factors():
     return xr.open_dataarray(INTERIM_DIR / 'distances_in_direction' / 'distance_factors.nc')
 
@@ -0,0 +1,212 @@
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+
+import dask
+import psutil
+import xarray as xr
+
+from wind_repower_usa.chunks import set_memory_budget
+from wind_repower_usa.config import NUM_PROCESSES, MEMORY_BUDGET_BYTES, PREFETCH_DEPTH
+from wind_repower_usa.storage import write_netcdf_atomic
+
+
+def checkpoint_fname(checkpoint_dir, year, month):
+    return checkpoint_dir / f'checkpoint-{year}-{month:02d}.nc'
+
+
+# data needed by all tasks of a pool, sent once to each worker process instead of pickling it
+# with every task, see create_pool()
+_worker_data = {}
+
+
+def set_worker_data(worker_data):
+    """Set data returned by get_worker_data() in the current process, done by create_pool() in
+    each worker process. Call it directly to run tasks in the current process."""
+    _worker_data.clear()
+    _worker_data.update(worker_data or {})
+
+
+def get_worker_data(name):
+    """Return data passed as ``worker_data`` to create_pool() (or set_worker_data())."""
+    return _worker_data[name]
+
+
+def _init_worker(memory_budget_bytes, worker_data):
+    set_memory_budget(memory_budget_bytes)
+
+    # parallelism comes from processes, threads would compete for the same cores
+    dask.config.set(scheduler='synchronous')
+
+    set_worker_data(worker_data)
+
+
+def create_pool(num_processes, memory_budget_bytes=None, worker_data=None):
+    """Create a process pool for computations with dask in each worker process.
+
+    Parameters
+    ----------
+    num_processes : int
+    memory_budget_bytes : float
+        memory available for each worker process, default: MEMORY_BUDGET_BYTES if configured,
+        otherwise available memory divided by ``num_processes``, see set_memory_budget()
+    worker_data : dict
+        data needed by all tasks (e.g. turbines), sent once to each worker process, available
+        there via get_worker_data()
+
+    Returns
+    -------
+    multiprocessing.pool.Pool
+
+    """
+    if memory_budget_bytes is None and MEMORY_BUDGET_BYTES is None:
+        memory_budget_bytes = psutil.virtual_memory().available / num_processes
+
+    # spawn instead of fork: forking while other threads hold the logging lock can deadlock
+    context = multiprocessing.get_context('spawn')
+    return context.Pool(processes=num_processes, initializer=_init_worker,
+                        initargs=(memory_budget_bytes, worker_data))
+
+
+def _run_month(params):
+    calc_month, year, month, fname = params
+    t0 = time.time()
+    result = calc_month(year, month)
+    write_netcdf_atomic(result, fname)
+    return year, month, time.time() - t0
+
+
+def calc_months_parallel(calc_month, years, months, checkpoint_dir, num_processes=NUM_PROCESSES,
+                         memory_budget_bytes=None, worker_data=None):
+    """Run ``calc_month(year, month)`` for all months in a process pool. The result of each month
+    is written to ``checkpoint_dir`` as soon as it is finished, months which have been checkpointed
+    already are skipped, i.e. an interrupted run continues where it stopped.
+
+    Parameters
+    ----------
+    calc_month : callable
+        takes year and month, returns xr.DataArray or xr.Dataset with dim time, needs to be
+        picklable (e.g. a module level function or a functools.partial of it)
+    years : iterable of int
+    months : iterable of int
+    checkpoint_dir : pathlib.Path
+        created if it does not exist, needs to be removed manually if parameters of
+        ``calc_month`` are changed
+    num_processes : int
+        number of worker processes, 1 to run in the current process
+    memory_budget_bytes : float
+        see create_pool()
+    worker_data : dict
+        data needed by ``calc_month`` for all months, see create_pool()
+
+    Returns
+    -------
+    xr.DataArray or xr.Dataset
+        results of all months concatenated along time in time order, a Dataset with a single
+        variable is returned as DataArray
+
+    """
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+
+    year_months = [(year, month) for year in years for month in months]
+    params = [(calc_month, year, month, checkpoint_fname(checkpoint_dir, year, month))
+              for year, month in year_months
+              if not checkpoint_fname(checkpoint_dir, year, month).exists()]
+
+    logging.info("Calculating %s months (%s months checkpointed already) in %s processes...",
+                 len(params), len(year_months) - len(params), num_processes)
+
+    t0 = time.time()
+
+    def log_progress(num_done, year, month, duration):
+        eta = (time.time() - t0) / num_done * (len(params) - num_done)
+        logging.info("Finished %s-%02d in %.1fs (%s/%s), ETA: %.0fs", year, month, duration,
+                     num_done, len(params), eta)
+
+    if num_processes == 1:
+        set_worker_data(worker_data)
+        for num_done, param in enumerate(params, start=1):
+            log_progress(num_done, *_run_month(param))
+    elif params:
+        with create_pool(num_processes, memory_budget_bytes, worker_data=worker_data) as pool:
+            for num_done, result in enumerate(pool.imap_unordered(_run_month, params), start=1):
+                log_progress(num_done, *result)
+
+    results = []
+    for year, month in year_months:
+        with xr.open_dataset(checkpoint_fname(checkpoint_dir, year, month)) as result:
+            results.append(result.load())
+
+    merged = xr.concat(results, dim='time').sortby('time')
+
+    # DataArrays are stored as Dataset with a single variable in netCDF files
+    if len(merged.data_vars) == 1:
+        merged = merged[list(merged.data_vars)[0]]
+    return merged
+
+
+_END_OF_MONTHS = object()
+
+
+def prefetch_months(load_month, year_months, depth=PREFETCH_DEPTH):
+    """Iterate over months while loading the next months on a background thread, i.e. reading
+    data for the next month overlaps with computations for the current month.
+
+    Parameters
+    ----------
+    load_month : callable
+        takes year and month, returns data in memory (e.g. ``load_wind_speed(year,
+        month).load()``), called on a background thread, reading netCDF files releases the GIL
+    year_months : iterable of tuple
+        (year, month) in the order to be processed, e.g. all months of YEARS and MONTHS
+    depth : int
+        maximum number of months loaded in advance, i.e. at most ``depth + 1`` months are in
+        memory at the same time
+
+    Yields
+    ------
+    year, month, data
+        ``data`` is the return value of ``load_month(year, month)``, exceptions raised in
+        ``load_month`` are re-raised here
+
+    """
+    loaded = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def put(item):
+        # blocks while the queue is full, but gives up if the consumer stopped iterating
+        while not stopped.is_set():
+            try:
+                loaded.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def load_all():
+        try:
+            for year, month in year_months:
+                if not put((year, month, load_month(year, month), None)):
+                    return
+        except Exception as e:
+            put((None, None, None, e))
+            return
+        put(_END_OF_MONTHS)
+
+    loader = threading.Thread(target=load_all, name='prefetch_months', daemon=True)
+    loader.start()
+
+    try:
+        while True:
+            item = loaded.get()
+            if item is _END_OF_MONTHS:
+                break
+            year, month, data, exception = item
+            if exception is not None:
+                raise exception
+            yield year, month, data
+    finally:
+        stopped.set()
+        loader.join()
@@ -0,0 +1,247 @@
+import logging
+
+import numpy as np
+from scipy.interpolate import interp1d
+
+# in m/s, all breakpoints of power curves in turbine_models are multiples of this, so lookup is
+# exact (up to floating point rounding), see is_on_grid()
+DEFAULT_RESOLUTION = 0.01
+
+# breakpoints closer than this to a grid point (in multiples of the resolution) are on the grid
+GRID_TOLERANCE = 1e-6
+
+
+def _grid_position(wind_speed, resolution, num_grid_points, out):
+    """Position of wind speeds on the uniform grid: integer index and fraction to the next grid
+    point. ``out`` is used to store the fraction and might be identical to ``wind_speed``."""
+    position = np.multiply(wind_speed, 1. / resolution, out=out)
+    np.clip(position, 0, num_grid_points - 1, out=position)
+
+    # NaN leads to an arbitrary index (clipped when used), but the fraction stays NaN
+    with np.errstate(invalid='ignore'):
+        idcs = position.astype(np.int32)
+    fraction = np.subtract(position, idcs, out=position)
+    return idcs, fraction
+
+
+class PowerCurve:
+    """Piecewise linear power curve evaluated by a lookup table on a uniform grid of wind speeds
+    with linear blending between grid points. Drop-in replacement for ``interp1d`` power curves,
+    but without binary search and with less temporary arrays. Wind speeds below 0 or above the
+    last wind speed of the curve are clipped, NaN values are propagated.
+
+    Parameters
+    ----------
+    wind_speeds : array_like
+        in m/s, increasing
+    generation_kw : array_like
+        power output in kW for each wind speed
+    resolution : float
+        resolution of the lookup table in m/s, all ``wind_speeds`` need to be multiples of it,
+        otherwise values near breakpoints differ from linear interpolation, see is_on_grid()
+
+    """
+    def __init__(self, wind_speeds, generation_kw, resolution=DEFAULT_RESOLUTION):
+        self.x = np.asarray(wind_speeds, dtype=np.float64)
+        self.y = np.asarray(generation_kw, dtype=np.float64)
+        self.resolution = resolution
+
+        num_grid_points = int(np.ceil(self.x[-1] / resolution)) + 1
+        grid = np.arange(num_grid_points) * resolution
+        self.table = np.interp(grid, self.x, self.y)
+
+        # slope to the next grid point, 0 after the last one
+        self.slopes = np.append(np.diff(self.table), 0.)
+
+        self._tables_float32 = None
+
+    @classmethod
+    def from_interp1d(cls, power_curve, resolution=DEFAULT_RESOLUTION):
+        """Compile a power curve given as ``scipy.interpolate.interp1d``."""
+        return cls(power_curve.x, power_curve.y, resolution=resolution)
+
+    def _tables(self, dtype):
+        if dtype == np.float32:
+            if self._tables_float32 is None:
+                self._tables_float32 = (self.table.astype(np.float32),
+                                        self.slopes.astype(np.float32))
+            return self._tables_float32
+        return self.table, self.slopes
+
+    def __call__(self, wind_speed, out=None):
+        """Evaluate power curve.
+
+        Parameters
+        ----------
+        wind_speed : array_like
+            in m/s, float32 input is evaluated in float32
+        out : np.ndarray
+            output array, same shape as wind_speed, can be ``wind_speed`` itself to evaluate in
+            place
+
+        Returns
+        -------
+        np.ndarray
+            power output in kW
+
+        """
+        wind_speed = np.asarray(wind_speed)
+        dtype = wind_speed.dtype if wind_speed.dtype == np.float32 else np.float64
+        if out is None:
+            out = np.empty(wind_speed.shape, dtype=dtype)
+
+        table, slopes = self._tables(out.dtype)
+
+        idcs, fraction = _grid_position(wind_speed, self.resolution, len(table), out=out)
+        fraction *= np.take(slopes, idcs, mode='clip')
+        fraction += np.take(table, idcs, mode='clip')
+        return fraction
+
+    def __repr__(self):
+        return f'PowerCurve(resolution={self.resolution}, num_points={len(self.x)})'
+
+
+class PowerCurves:
+    """Several power curves on a common lookup table, evaluated at once: the position of wind
+    speeds on the grid is calculated only once for all curves. Power curves with breakpoints not
+    on the grid are evaluated one by one, see compile_power_curve().
+
+    Parameters
+    ----------
+    power_curves : list of PowerCurve or interp1d
+    resolution : float
+        resolution of the lookup table in m/s
+
+    """
+    def __init__(self, power_curves, resolution=DEFAULT_RESOLUTION):
+        self.power_curves = [compile_power_curve(power_curve, resolution)
+                             for power_curve in power_curves]
+        self.resolution = resolution
+
+        # pad shorter tables with their last value, i.e. same behavior as clipping
+        tables = [power_curve.table for power_curve in self.power_curves
+                  if isinstance(power_curve, PowerCurve)]
+        num_grid_points = max((len(table) for table in tables), default=1)
+        self.tables = np.array([np.pad(table, (0, num_grid_points - len(table)), mode='edge')
+                                for table in tables]).reshape(len(tables), num_grid_points)
+        self.slopes = np.diff(self.tables, axis=1, append=self.tables[:, -1:])
+
+    def __len__(self):
+        return len(self.power_curves)
+
+    def _tables(self, dtype):
+        """Table and slopes for each power curve, None for curves evaluated without table."""
+        tables = iter(zip(self.tables.astype(dtype), self.slopes.astype(dtype)))
+        return [next(tables) if isinstance(power_curve, PowerCurve) else (None, None)
+                for power_curve in self.power_curves]
+
+    def __call__(self, wind_speed, out=None):
+        """Evaluate all power curves.
+
+        Parameters
+        ----------
+        wind_speed : array_like
+            in m/s
+        out : np.ndarray
+            output array of shape (number of power curves,) + wind_speed.shape
+
+        Returns
+        -------
+        np.ndarray
+            power output in kW, shape: (number of power curves,) + wind_speed.shape
+
+        """
+        wind_speed = np.asarray(wind_speed)
+        dtype = wind_speed.dtype if wind_speed.dtype == np.float32 else np.float64
+        if out is None:
+            out = np.empty((len(self),) + wind_speed.shape, dtype=dtype)
+
+        idcs, fraction = _grid_position(wind_speed, self.resolution, self.tables.shape[1],
+                                        out=np.empty(wind_speed.shape, dtype=out.dtype))
+
+        for power_curve, (table, slopes), out_curve in zip(self.power_curves,
+                                                           self._tables(out.dtype), out):
+            if table is None:
+                out_curve[...] = power_curve(wind_speed)
+                continue
+            np.take(slopes, idcs, mode='clip', out=out_curve)
+            out_curve *= fraction
+            out_curve += np.take(table, idcs, mode='clip')
+        return out
+
+    def sum(self, wind_speed, axis=0):
+        """Evaluate all power curves and sum along an axis of ``wind_speed``. Needs memory only
+        for two arrays of the size of ``wind_speed``, independent of the number of curves.
+
+        Parameters
+        ----------
+        wind_speed : array_like
+            in m/s
+        axis : int
+            axis of wind_speed to sum along
+
+        Returns
+        -------
+        np.ndarray
+            sum of power output in kW (float64), shape: (number of power curves,) + shape of
+            wind_speed without ``axis``
+
+        """
+        wind_speed = np.asarray(wind_speed)
+        dtype = wind_speed.dtype if wind_speed.dtype == np.float32 else np.float64
+
+        idcs, fraction = _grid_position(wind_speed, self.resolution, self.tables.shape[1],
+                                        out=np.empty(wind_speed.shape, dtype=dtype))
+
+        generation = np.empty(wind_speed.shape, dtype=dtype)
+        generation_offset = np.empty(wind_speed.shape, dtype=dtype)
+
+        result = []
+        for power_curve, (table, slopes) in zip(self.power_curves, self._tables(dtype)):
+            if table is None:
+                result.append(power_curve(wind_speed).sum(axis=axis, dtype=np.float64))
+                continue
+            np.take(slopes, idcs, mode='clip', out=generation)
+            generation *= fraction
+            generation += np.take(table, idcs, mode='clip', out=generation_offset)
+            result.append(generation.sum(axis=axis, dtype=np.float64))
+
+        return np.array(result)
+
+
+def is_on_grid(wind_speeds, resolution=DEFAULT_RESOLUTION):
+    """True if all ``wind_speeds`` are multiples of ``resolution``, i.e. a lookup table of this
+    resolution contains all breakpoints of a power curve and is exact."""
+    position = np.asarray(wind_speeds, dtype=np.float64) / resolution
+    return bool(np.all(np.abs(position - np.round(position)) < GRID_TOLERANCE))
+
+
+def compile_power_curve(power_curve, resolution=DEFAULT_RESOLUTION):
+    """Convert a power curve to a PowerCurve if possible. Power curves with breakpoints which are
+    not multiples of ``resolution`` cannot be represented exactly by the lookup table and are
+    returned as ``interp1d`` instead.
+
+    Parameters
+    ----------
+    power_curve : PowerCurve or interp1d
+        anything with attributes ``x`` and ``y`` defining a piecewise linear function
+
+    Returns
+    -------
+    PowerCurve or interp1d
+
+    """
+    if not (hasattr(power_curve, 'x') and hasattr(power_curve, 'y')):
+        raise TypeError(f"cannot compile power curve of type {type(power_curve)}, "
+                        "needs attributes x and y")
+    if not is_on_grid(power_curve.x, resolution):
+        logging.warning("Breakpoints of power curve are not multiples of %sm/s, evaluating it "
+                        "without lookup table", resolution)
+        if isinstance(power_curve, PowerCurve):
+            # clipped as PowerCurve
+            return interp1d(power_curve.x, power_curve.y, bounds_error=False,
+                            fill_value=(power_curve.y[0], power_curve.y[-1]))
+        return power_curve
+    if isinstance(power_curve, PowerCurve) and power_curve.resolution == resolution:
+        return power_curve
+    return PowerCurve(power_curve.x, power_curve.y, resolution=resolution)
@@ -0,0 +1,384 @@
+import os
+import shutil
+import logging
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from wind_repower_usa.config import INTERIM_DIR
+from wind_repower_usa.interpolation import select_grid_cells
+
+WIND_SPEED_STORE = INTERIM_DIR / 'wind_speed_usa_era5' / 'wind_speed_usa_era5.zarr'
+
+# same data as WIND_SPEED_STORE, but chunked for reductions along time (per turbine analyses)
+WIND_SPEED_STORE_TURBINE_MAJOR = (INTERIM_DIR / 'wind_speed_usa_era5' /
+                                  'wind_speed_usa_era5-turbine_major.zarr')
+
+# u100/v100 only for ERA5 grid cells surrounding turbines, see calc_grid_cells()
+WIND_VELOCITY_CELLS_STORE = (INTERIM_DIR / 'wind_speed_usa_era5' /
+                             'wind_velocity_cells_usa_era5.zarr')
+
+# one day per chunk: every month consists of complete days, therefore appending month by month
+# never writes to partial chunks
+WIND_SPEED_CHUNK_HOURS = 24
+
+# one (leap) year of a small block of turbines per chunk, i.e. ~18MB for float64
+TURBINE_MAJOR_CHUNKS = {'time': 24 * 366, 'turbines': 256}
+
+# wind speed is stored as int16 with a resolution of 0.01m/s (i.e. up to 327m/s), xarray decodes
+# lazily chunk by chunk when reading, files written without this encoding can be read as before
+WIND_SPEED_ENCODING = {
+    'dtype': 'int16',
+    'scale_factor': 0.01,
+    'add_offset': 0.,
+    '_FillValue': np.iinfo(np.int16).min,
+}
+
+# wind direction in rad (between -pi and pi) is stored as int16 with a resolution of 1e-4 rad,
+# i.e. way below the width of direction bins in wind roses
+WIND_DIRECTION_ENCODING = {
+    'dtype': 'int16',
+    'scale_factor': 1e-4,
+    'add_offset': 0.,
+    '_FillValue': np.iinfo(np.int16).min,
+}
+
+# lossless compression on top of WIND_SPEED_ENCODING for netCDF files, Zarr stores are compressed
+# by default
+NETCDF_COMPRESSION = {'zlib': True, 'complevel': 4, 'shuffle': True}
+
+# name of unnamed DataArrays in netCDF files written by xarray
+DATAARRAY_VARIABLE = '__xarray_dataarray_variable__'
+
+
+def open_store(store=WIND_SPEED_STORE):
+    """Open a consolidated Zarr store lazily, dask chunks match chunks on disk.
+
+    Parameters
+    ----------
+    store : pathlib.Path
+
+    Returns
+    -------
+    xr.Dataset
+
+    """
+    return xr.open_zarr(str(store), consolidated=True)
+
+
+def wind_speed_store(reduce_along=None):
+    """Pick the store layout matching the dimension which is reduced by the caller.
+
+    Parameters
+    ----------
+    reduce_along : str or None
+        'time' for per turbine analyses, 'turbines' or None for time series
+
+    Returns
+    -------
+    pathlib.Path
+
+    """
+    if reduce_along == 'time' and WIND_SPEED_STORE_TURBINE_MAJOR.exists():
+        return WIND_SPEED_STORE_TURBINE_MAJOR
+    return WIND_SPEED_STORE
+
+
+def stored_months(store=WIND_SPEED_STORE):
+    """Return a set of tuples (year, month) for all months available in the store. Only the time
+    index is read (consolidated metadata + one small array)."""
+    if not store.exists():
+        return set()
+
+    time = pd.DatetimeIndex(open_store(store).time.values)
+    return set(zip(time.year, time.month))
+
+
+def append_wind_speed(wind_speed, store=WIND_SPEED_STORE):
+    """Append wind speed to the consolidated store, creates the store if it does not exist.
+
+    Parameters
+    ----------
+    wind_speed : xr.DataArray
+        dims = time, turbines as returned by calc_wind_speed_at_turbines(), should cover complete
+        days and needs to start after the last time stamp in the store
+    store : pathlib.Path
+
+    """
+    wind_speed = wind_speed.rename('wind_speed').transpose('time', 'turbines')
+    _append_to_store(wind_speed.to_dataset(), store, encoding={'wind_speed': WIND_SPEED_ENCODING})
+
+
+def append_wind_velocity_cells(wind_velocity, grid_cells, store=WIND_VELOCITY_CELLS_STORE):
+    """Append u100 and v100 of grid cells around turbines to the store, creates the store if it
+    does not exist. ``grid_cells`` is stored along with the data on creation.
+
+    Parameters
+    ----------
+    wind_velocity : xr.Dataset
+        as returned by load_wind_velocity(), should cover complete days and needs to start after
+        the last time stamp in the store
+    grid_cells : xr.Dataset
+        as returned by calc_grid_cells()
+    store : pathlib.Path
+
+    """
+    wind_velocity_cells = select_grid_cells(wind_velocity[['u100', 'v100']], grid_cells)
+    wind_velocity_cells = wind_velocity_cells.transpose('time', 'cells')
+    wind_velocity_cells = wind_velocity_cells.drop_vars(['latitude', 'longitude'])
+    _append_to_store(xr.merge([wind_velocity_cells, grid_cells]), store)
+
+
+def is_encoded(wind_speed):
+    """True if ``wind_speed`` has been read from a file or store with WIND_SPEED_ENCODING."""
+    return (np.dtype(wind_speed.encoding.get('dtype', wind_speed.dtype)) == np.int16 and
+            'scale_factor' in wind_speed.encoding)
+
+
+def _append_to_store(dataset, store, encoding=None):
+    if dataset.sizes['time'] % WIND_SPEED_CHUNK_HOURS != 0:
+        raise ValueError("data needs to cover complete days to append to the store, "
+                         f"got {dataset.sizes['time']} time stamps")
+
+    if encoding is None:
+        encoding = {}
+
+    # appending in parallel or lazily does not work safely, chunks would be written partially
+    dataset = dataset.load()
+
+    if not store.exists():
+        logging.info("Creating store %s...", store)
+        encoding = {name: {'chunks': (WIND_SPEED_CHUNK_HOURS,) + variable.shape[1:],
+                           **encoding.get(name, {})}
+                    for name, variable in dataset.data_vars.items() if 'time' in variable.dims}
+        for name in encoding:
+            # encoding of the source file (e.g. netCDF compression) is not valid for Zarr
+            dataset[name].encoding = {}
+        dataset.to_zarr(str(store), mode='w-', consolidated=True, encoding=encoding)
+        return
+
+    stored_time = open_store(store).time.values
+    if dataset.time.values.min() <= stored_time.max():
+        raise ValueError("can only append data after the last time stamp in the store: "
+                         f"{stored_time.max()}")
+
+    # everything not depending on time has been written already on creation
+    dataset = dataset.drop_vars([name for name, variable in dataset.variables.items()
+                                 if 'time' not in variable.dims])
+    for variable in dataset.data_vars.values():
+        # appended data is encoded as the data in the store
+        variable.encoding = {}
+    dataset.to_zarr(str(store), append_dim='time', consolidated=True)
+
+
+def write_netcdf_atomic(data, fname, encoding=None):
+    """Write ``data`` to a temporary file next to ``fname`` and rename it afterwards, i.e.
+    ``fname`` exists only if it has been written completely (even if the process crashes). An
+    existing file ``fname`` is replaced.
+
+    Parameters
+    ----------
+    data : xr.Dataset or xr.DataArray
+    fname : pathlib.Path
+    encoding : dict
+        see ``xr.Dataset.to_netcdf()``
+
+    """
+    fname_part = fname.with_name(f'{fname.name}.{os.getpid()}.part')
+    try:
+        data.to_netcdf(fname_part, encoding=encoding)
+        os.replace(fname_part, fname)
+    finally:
+        if fname_part.exists():
+            fname_part.unlink()
+
+
+def write_wind_speed(wind_speed, fname):
+    """Write wind speed (e.g. of one month) atomically to a netCDF file using WIND_SPEED_ENCODING
+    and compression.
+
+    Parameters
+    ----------
+    wind_speed : xr.DataArray
+        as returned by calc_wind_speed_at_turbines()
+    fname : pathlib.Path
+
+    """
+    _write_encoded(wind_speed, fname, WIND_SPEED_ENCODING)
+
+
+def write_wind_direction(wind_direction, fname):
+    """Write wind direction (e.g. of one month) atomically to a netCDF file using
+    WIND_DIRECTION_ENCODING and compression.
+
+    Parameters
+    ----------
+    wind_direction : xr.DataArray
+        as returned by calc_wind_speed_and_direction_at_turbines()
+    fname : pathlib.Path
+
+    """
+    _write_encoded(wind_direction, fname, WIND_DIRECTION_ENCODING)
+
+
+def _write_encoded(data, fname, encoding):
+    name = DATAARRAY_VARIABLE if data.name is None else data.name
+    data = data.copy(deep=False)
+    data.encoding = {}
+    write_netcdf_atomic(data, fname, encoding={name: {**encoding, **NETCDF_COMPRESSION}})
+
+
+def select_months(data, years, months):
+    """Select all time stamps in ``years`` and ``months`` of ``data`` (without reading any data but
+    the time index).
+
+    Parameters
+    ----------
+    data : xr.Dataset or xr.DataArray
+    years : list of int
+    months : list of int
+
+    Returns
+    -------
+    same type as data
+
+    """
+    time = pd.DatetimeIndex(data.time.values)
+    idcs = np.isin(time.year, years) & np.isin(time.month, months)
+
+    missing = {(year, month) for year in years for month in months} - set(
+        zip(time.year[idcs], time.month[idcs]))
+    if missing:
+        raise ValueError(f"months missing in data: {sorted(missing)}")
+
+    idcs = np.nonzero(idcs)[0]
+    if np.all(np.diff(idcs) == 1):
+        # contiguous time range: a slice avoids fancy indexing of every dask chunk
+        idcs = slice(idcs[0], idcs[-1] + 1)
+
+    return data.isel(time=idcs)
+
+
+def rechunk_wind_speed(source=WIND_SPEED_STORE, target=WIND_SPEED_STORE_TURBINE_MAJOR,
+                       chunks=None, memory_budget_bytes=2e9):
+    """Copy the wind speed store to a second store with large chunks along time and small chunks
+    along turbines. This is done out-of-core: for each time slab of one chunk length, as many
+    turbine chunks as fit into ``memory_budget_bytes`` are read at once and written as complete
+    chunks to ``target``. An existing ``target`` is overwritten.
+
+    Parameters
+    ----------
+    source : pathlib.Path
+    target : pathlib.Path
+    chunks : dict
+        chunk size for dims time and turbines, default: TURBINE_MAJOR_CHUNKS
+    memory_budget_bytes : float
+        maximum size of data loaded into memory at once (approximately)
+
+    """
+    if chunks is None:
+        chunks = TURBINE_MAJOR_CHUNKS
+
+    wind_speed = open_store(source).wind_speed
+    num_time_stamps = wind_speed.sizes['time']
+    num_turbines = wind_speed.sizes['turbines']
+
+    time_chunk = min(chunks['time'], num_time_stamps)
+    turbine_chunk = min(chunks['turbines'], num_turbines)
+
+    # a block consists of complete target chunks, at least one
+    block_bytes = time_chunk * turbine_chunk * wind_speed.dtype.itemsize
+    turbines_per_block = turbine_chunk * max(1, int(memory_budget_bytes // block_bytes))
+
+    logging.info("Rechunking %s to %s (chunks: time=%s, turbines=%s, %s turbines per block)...",
+                 source, target, time_chunk, turbine_chunk, turbines_per_block)
+
+    # writes coordinates and metadata only, data is written block by block below
+    template = wind_speed.chunk({'time': time_chunk, 'turbines': turbine_chunk}).to_dataset()
+    template = template.assign_coords({name: coord.variable.load()
+                                       for name, coord in wind_speed.coords.items()})
+    template.wind_speed.encoding = {}
+    template.to_zarr(str(target), mode='w', compute=False, consolidated=True,
+                     encoding={'wind_speed': {'chunks': (time_chunk, turbine_chunk),
+                                              **WIND_SPEED_ENCODING}})
+
+    for time_start in range(0, num_time_stamps, time_chunk):
+        time_slice = slice(time_start, min(time_start + time_chunk, num_time_stamps))
+        for turbines_start in range(0, num_turbines, turbines_per_block):
+            turbines_slice = slice(turbines_start,
+                                   min(turbines_start + turbines_per_block, num_turbines))
+            logging.debug("Rechunking block time=%s, turbines=%s", time_slice, turbines_slice)
+
+            block = wind_speed.isel(time=time_slice, turbines=turbines_slice).load()
+            block = block.drop_vars(list(block.coords)).to_dataset()
+            block.to_zarr(str(target), region={'time': time_slice, 'turbines': turbines_slice})
+
+
+def _store_swap_paths(store):
+    return store.with_name(f'{store.name}.part'), store.with_name(f'{store.name}.old')
+
+
+def recover_store_swap(store):
+    """Finish or roll back an interrupted encode_wind_speed_store(): the encoded copy
+    ``<store>.part`` is complete once the original store has been moved to ``<store>.old``, before
+    that an existing ``<store>.part`` is incomplete and removed.
+
+    Parameters
+    ----------
+    store : pathlib.Path
+
+    """
+    store_part, store_old = _store_swap_paths(store)
+
+    if not store.exists() and store_old.exists():
+        if store_part.exists():
+            logging.info("Finishing interrupted swap of %s...", store)
+            os.replace(store_part, store)
+        else:
+            logging.info("Rolling back interrupted swap of %s...", store)
+            os.replace(store_old, store)
+
+    if store_old.exists():
+        logging.info("Removing stale %s", store_old)
+        shutil.rmtree(store_old)
+    if store_part.exists():
+        logging.info("Removing incomplete %s", store_part)
+        shutil.rmtree(store_part)
+
+
+def encode_wind_speed_store(store, memory_budget_bytes=2e9):
+    """Re-encode a wind speed store written without WIND_SPEED_ENCODING, keeping its chunks. The
+    encoded copy is written next to ``store`` and replaces it afterwards. Leftovers of an
+    interrupted run are cleaned up first, see recover_store_swap().
+
+    Parameters
+    ----------
+    store : pathlib.Path
+    memory_budget_bytes : float
+        see rechunk_wind_speed()
+
+    Returns
+    -------
+    bool
+        False if the store was encoded already
+
+    """
+    recover_store_swap(store)
+
+    wind_speed = open_store(store).wind_speed
+    if is_encoded(wind_speed):
+        return False
+
+    chunks = {dim: chunks[0] for dim, chunks in zip(wind_speed.dims, wind_speed.chunks)}
+    store_part, store_old = _store_swap_paths(store)
+    rechunk_wind_speed(store, store_part, chunks=chunks, memory_budget_bytes=memory_budget_bytes)
+
+    # os.replace() fails for non-empty directories as target
+    if store_old.exists():
+        shutil.rmtree(store_old)
+    os.replace(store, store_old)
+    os.replace(store_part, store)
+    shutil.rmtree(store_old)
+
+    return True
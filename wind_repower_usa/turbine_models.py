@@ -1,3 +1,5 @@
+import logging
+from functools import lru_cache
 from collections import namedtuple
 
 import numpy as np
@@ -16,6 +18,7 @@ Turbine = namedtuple('Turbine', ('name',
 
 def new_turbine_models():
     """Return all turbine models used for repowering."""
+    se_34m114 = nrel_sam_turbine(file_name='se_34m114', **NREL_SAM_TURBINES['se_34m114'])
     return se_34m114, e138ep3, se_42m140, e126
 
 
@@ -24,7 +27,8 @@ def turbine_from_nrel_sam(wind_turbine_model, file_name, name=None):
     wind_speeds = [float(x) for x in wind_turbine_model['Wind Speed Array'].split('|')]
     generation_kw = [float(x) for x in wind_turbine_model['Power Curve Array'].split('|')]
 
-    assert generation_kw[-1] == 0., "no cut-off in power curve, need to be fixed manually"
+    if generation_kw[-1] != 0.:
+        raise ValueError("no cut-off in power curve, need to be fixed manually")
 
     wind_speeds += [70.]
     generation_kw += [0.]
@@ -44,15 +48,89 @@ def turbine_from_nrel_sam(wind_turbine_model, file_name, name=None):
     return turbine
 
 
-wind_turbine_models = pd.read_csv(EXTERNAL_DIR / 'nrel-sam-powercurves' /
-                                  'nrel-sam-wind-turbines.csv', skiprows=[1, 2])
+@lru_cache(maxsize=1)
+def load_nrel_sam_table():
+    """Load the NREL SAM table of wind turbines (power curves etc). Parsed only on first call."""
+    return pd.read_csv(EXTERNAL_DIR / 'nrel-sam-powercurves' / 'nrel-sam-wind-turbines.csv',
+                       skiprows=[1, 2])
 
 
-se_34m114 = turbine_from_nrel_sam(wind_turbine_models.iloc[267], 'se_34m114',
-                                  name='Senvion 3.4M114 (3.4MW, 114m)')
-vestas_v42_600 = turbine_from_nrel_sam(wind_turbine_models.iloc[145], 'vestas_v42_600')
-northwind100 = turbine_from_nrel_sam(wind_turbine_models.iloc[118], 'northwind100')
-e44 = turbine_from_nrel_sam(wind_turbine_models.iloc[165], 'e44')
+@lru_cache(maxsize=None)
+def nrel_sam_turbine(model, file_name=None, name=None):
+    """Build a turbine model from the NREL SAM table on demand, cached for later calls.
+
+    Parameters
+    ----------
+    model : str or int
+        value of the column 'Name' or row index in the NREL SAM table
+    file_name : str
+        machine-readable name, default: derived from the name in the table
+    name : str
+        human readable name, default: name in the table
+
+    Returns
+    -------
+    Turbine
+
+    """
+    wind_turbine_models = load_nrel_sam_table()
+    if isinstance(model, str):
+        rows = wind_turbine_models[wind_turbine_models['Name'] == model]
+        if len(rows) != 1:
+            raise ValueError(f"found {len(rows)} turbine models with name '{model}'")
+        wind_turbine_model = rows.iloc[0]
+    else:
+        wind_turbine_model = wind_turbine_models.iloc[model]
+
+    if file_name is None:
+        file_name = ''.join(c if c.isalnum() else '_' for c in wind_turbine_model['Name']).lower()
+
+    return turbine_from_nrel_sam(wind_turbine_model, file_name, name=name)
+
+
+def all_nrel_sam_turbines():
+    """Return turbine models for all rows of the NREL SAM table. Power curves without cut-off
+    cannot be used without manual fixes and are skipped. Names which differ only in special
+    characters lead to the same file name, the row index is appended to these file names.
+
+    Returns
+    -------
+    list of Turbine
+
+    """
+    turbines = {}
+    for idx, name in enumerate(load_nrel_sam_table()['Name']):
+        try:
+            turbines[idx] = nrel_sam_turbine(idx)
+        except ValueError as e:
+            logging.warning("Skipping turbine model '%s' (row %s): %s", name, idx, e)
+
+    file_names = pd.Series({idx: turbine.file_name for idx, turbine in turbines.items()})
+    duplicated = file_names.duplicated(keep=False)
+    for idx in file_names.index[duplicated]:
+        turbines[idx] = turbines[idx]._replace(file_name=f'{file_names[idx]}_{idx}')
+
+    file_names = [turbine.file_name for turbine in turbines.values()]
+    if len(set(file_names)) != len(file_names):
+        raise ValueError("file names of turbine models are not unique")
+
+    return list(turbines.values())
+
+
+# turbine models from the NREL SAM table are available as module attributes, but the CSV file is
+# parsed only on first access, see __getattr__()
+NREL_SAM_TURBINES = {
+    'se_34m114': dict(model=267, name='Senvion 3.4M114 (3.4MW, 114m)'),
+    'vestas_v42_600': dict(model=145),
+    'northwind100': dict(model=118),
+    'e44': dict(model=165),
+}
+
+
+def __getattr__(file_name):
+    if file_name in NREL_SAM_TURBINES:
+        return nrel_sam_turbine(file_name=file_name, **NREL_SAM_TURBINES[file_name])
+    raise AttributeError(f"module {__name__!r} has no attribute {file_name!r}")
 
 
 def power_curve_ge15_77():
@@ -2,17 +2,158 @@ import logging
 
 import numpy as np
 import xarray as xr
-from scipy.ndimage import uniform_filter
+from scipy.ndimage import uniform_filter1d
 
 from wind_repower_usa.calculations import calc_simulated_energy
+from wind_repower_usa.chunks import chunk_for_reduction
+from wind_repower_usa.config import COMPUTE_DTYPE, MONTHS
 from wind_repower_usa.constants import KM_TO_METER
+from wind_repower_usa.energy_kernel import BufferPool, energy_dtype
 from wind_repower_usa.geographic_coordinates import geolocation_distances
-from wind_repower_usa.load_data import load_turbines
+from wind_repower_usa.load_data import load_turbines, load_wind_direction, load_wind_speed
+from wind_repower_usa.pipeline import prefetch_months
 from wind_repower_usa.util import turbine_locations, edges_to_center, choose_samples
 
+# np.histogram() accumulates blocks of this size, same here to get identical results
+HISTOGRAM_BLOCK = 65536
+
+# number of values binned at once in calc_direction_histograms() (limits temporary arrays)
+DIRECTION_HISTOGRAM_BLOCK_SIZE = 2**22
+
+# relative to bin width, see _histogram_bin_indices()
+BIN_EDGE_TOLERANCE = 1e-3
+
+# relative to the maximum, maxima of smoothed wind roses within this tolerance are considered equal
+# in calc_directivity_profile(), i.e. the first one is taken independent of rounding errors
+PREVAIL_DIRECTION_TIE_RTOL = 1e-9
+
+# hours processed at once in calc_wind_rose_streaming(), limits memory independent of time range
+WIND_ROSE_CHUNK_HOURS = 24 * 7
+
+
+def _histogram_bin_indices(values, bin_edges, range_):
+    """Bin index for each value, identical to np.histogram() for equal bins: the index is
+    estimated arithmetically and compared exactly with ``bin_edges`` for values close to an edge.
+    Values outside of ``range_`` or NaN get index ``len(bin_edges) - 1``, i.e. they end up in an
+    extra bin."""
+    first_edge, last_edge = range_
+    num_bins = len(bin_edges) - 1
+
+    is_valid = None
+    if not (values.min() >= first_edge and values.max() <= last_edge):
+        is_valid = (values >= first_edge) & (values <= last_edge)
+
+    position = np.subtract(values, first_edge, dtype=np.float64)
+    position *= num_bins / (last_edge - first_edge)
+    if is_valid is not None:
+        position[~is_valid] = 0.
+
+    indices = position.astype(np.intp)
+
+    # the right edge belongs to the last bin
+    np.minimum(indices, num_bins - 1, out=indices)
+
+    # rounding errors (of float32 bin edges too) are much smaller than this, so all values which
+    # might be assigned to the wrong bin are binned exactly
+    position -= indices
+    near_edge = (position < BIN_EDGE_TOLERANCE) | (position > 1. - BIN_EDGE_TOLERANCE)
+    indices[near_edge] = np.searchsorted(bin_edges[1:-1], values[near_edge], side='right')
+
+    if is_valid is not None:
+        indices[~is_valid] = num_bins
+    return indices
+
+
+def calc_direction_histograms(directions, weights, bins, range_=(-np.pi, np.pi)):
+    """Weighted histograms of directions for all turbines at once using a single ``np.bincount()``
+    per block of values (with index ``turbine * bins + bin``). Identical to calling
+    ``np.histogram(..., density=True)`` for each turbine.
+
+    Parameters
+    ----------
+    directions : np.ndarray
+        dims = (time, turbines), NaN values are ignored
+    weights : np.ndarray
+        same shape as directions
+    bins : int
+    range_ : tuple of float
+
+    Returns
+    -------
+    histograms : np.ndarray
+        shape (turbines, bins), density, i.e. integral over bins is 1 for each turbine
+    bin_edges : np.ndarray
+        shape (bins + 1,)
+
+    """
+    bin_edges = direction_bin_edges(bins, range_, dtype=directions.dtype)
+
+    # one extra bin for values outside of range_
+    histograms = np.zeros((directions.shape[1], bins + 1), dtype=weights.dtype)
+    accumulate_direction_histograms(histograms, directions, weights, bin_edges, range_)
+
+    return histograms_to_density(histograms, bin_edges), bin_edges
+
+
+def direction_bin_edges(bins, range_=(-np.pi, np.pi), dtype=np.float64):
+    """Bin edges as used by ``np.histogram(..., bins=bins, range=range_)`` for values of type
+    ``dtype``."""
+    first_edge, last_edge = range_
+    bin_type = np.result_type(first_edge, last_edge, dtype)
+    return np.linspace(first_edge, last_edge, bins + 1, endpoint=True, dtype=bin_type)
+
+
+def accumulate_direction_histograms(histograms, directions, weights, bin_edges,
+                                    range_=(-np.pi, np.pi)):
+    """Add weighted counts of ``directions`` per turbine and bin to ``histograms`` (in place), see
+    calc_direction_histograms().
+
+    Parameters
+    ----------
+    histograms : np.ndarray
+        shape (turbines, bins + 1), the last bin counts values outside of ``range_`` and NaN
+    directions : np.ndarray
+        dims = (time, turbines)
+    weights : np.ndarray
+        same shape as directions
+    bin_edges : np.ndarray
+        as returned by direction_bin_edges()
+    range_ : tuple of float
+
+    """
+    num_time_stamps, num_turbines = directions.shape
+    num_bins = histograms.shape[1]
+
+    time_block = min(num_time_stamps, HISTOGRAM_BLOCK)
+    turbines_block = max(1, DIRECTION_HISTOGRAM_BLOCK_SIZE // time_block)
+
+    for turbines_start in range(0, num_turbines, turbines_block):
+        turbines_slice = slice(turbines_start, min(turbines_start + turbines_block, num_turbines))
+        histograms_block = histograms[turbines_slice]
+        turbine_idcs = np.arange(histograms_block.shape[0]) * num_bins
+
+        for time_start in range(0, num_time_stamps, time_block):
+            time_slice = slice(time_start, time_start + time_block)
+            indices = _histogram_bin_indices(directions[time_slice, turbines_slice], bin_edges,
+                                             range_)
+            indices += turbine_idcs
+            histograms_block += np.bincount(
+                indices.ravel(),
+                weights=weights[time_slice, turbines_slice].ravel(),
+                minlength=histograms_block.size).reshape(histograms_block.shape).astype(
+                    histograms.dtype)
+
+
+def histograms_to_density(histograms, bin_edges):
+    """Normalize weighted counts as accumulated by accumulate_direction_histograms(), i.e. the
+    integral over bins is 1 for each turbine. Returns shape (turbines, bins)."""
+    histograms = histograms[:, :len(bin_edges) - 1]
+    bin_widths = np.asarray(np.diff(bin_edges), float)
+    return histograms / bin_widths / histograms.sum(axis=1, keepdims=True)
+
 
 def calc_wind_rose(turbines, wind_speed, wind_velocity, power_curve=None, bins=70,
-                   directivity_width=15, num_samples=1000):
+                   directivity_width=15, num_samples=1000, buffers=None):
     """Calculate prevailing wind direction for each turbine location in ``turbines``. A wind rose is
     calculated by the amount of energy produced by wind blowing in a certain wind direction using a
     specific power curve. Note that definition of wind rose differs slightly from usual
@@ -33,6 +174,9 @@ def calc_wind_rose(turbines, wind_speed, wind_velocity, power_curve=None, bins=7
     directivity_width : float (in degree)
         see directivity below
     num_samples : int
+    buffers : energy_kernel.BufferPool
+        buffers for energy and temporary arrays, pass the same pool for repeated calls to avoid
+        allocations
 
     Returns
     -------
@@ -57,9 +201,10 @@ def calc_wind_rose(turbines, wind_speed, wind_velocity, power_curve=None, bins=7
 
     wind_speed, wind_velocity = choose_samples(wind_speed, wind_velocity,
                                                num_samples=num_samples, dim='time')
+    wind_speed = chunk_for_reduction(wind_speed, reduce_along='time', name='wind_speed')
 
     logging.info("Interpolating wind velocity at turbine locations...")
-    # interpolation is already done, but only stored as wind speed, u/v components not separately
+    # interpolation is already done, see load_wind_direction() and calc_wind_rose_streaming()
     wind_velocity_at_turbines = wind_velocity.interp(
         longitude=xr.DataArray(turbines.xlong.values, dims='turbines'),
         latitude=xr.DataArray(turbines.ylat.values, dims='turbines'),
@@ -72,48 +217,40 @@ def calc_wind_rose(turbines, wind_speed, wind_velocity, power_curve=None, bins=7
     # FIXME compare differences between 100m and 10m
     logging.info("Calculate wind directions...")
     directions = np.arctan2(wind_velocity_at_turbines.v100,
-                            wind_velocity_at_turbines.u100).compute()
+                            wind_velocity_at_turbines.u100).astype(COMPUTE_DTYPE).compute()
+
+    if buffers is None:
+        buffers = BufferPool()
 
     energy = calc_simulated_energy(wind_speed,
                                    turbines,
                                    power_curve=power_curve,
                                    sum_along='',
-                                   only_built_turbines=False)
-
-    boxcar_width_angle = np.radians(directivity_width)
-
-    wind_roses_list = []
-
-    directivity = []
-    prevail_wind_direction = []
+                                   only_built_turbines=False,
+                                   out=buffers.get('energy', (wind_speed.sizes['time'],
+                                                              wind_speed.sizes['turbines']),
+                                                   dtype=energy_dtype(wind_speed)),
+                                   buffers=buffers)
 
     logging.info("Calculate distribution of directions per turbine location...")
-    # would be great to use np.histogramdd() instead of this loop but somehow doesn't seem to work
-    for turbine_idx in range(directions.values.shape[1]):
-        hist = np.histogram(directions.values.T[turbine_idx, :],
-                            weights=energy.values.T[turbine_idx, :],
-                            range=(-np.pi, np.pi), bins=bins, density=True)
-        values, bin_edges = hist
-        wind_roses_list.append(values)
+    wind_roses, bin_edges = calc_direction_histograms(
+        directions.transpose('time', 'turbines').values,
+        energy.transpose('time', 'turbines').values,
+        bins=bins)
 
-        # TODO calculating this inside loop is bad, should yield same results every iteration
-        bin_centers = edges_to_center(bin_edges)
+    return _wind_rose_results(wind_roses, bin_edges, turbines, bins, directivity_width,
+                              num_samples)
 
-        boxcar_width = int(np.round(boxcar_width_angle / (2 * np.pi) * bins))
-
-        #
-        convoluted = uniform_filter(values, boxcar_width, mode='wrap')
 
-        # In case of multiple maxima it might make sense to take the central one or so,
-        # but this can only occur if wind speed is equally strong in an interval larger than
-        # boxcar_width.
-        prevail_wind_direction.append(bin_centers[np.argmax(convoluted)])
+def _wind_rose_results(wind_roses, bin_edges, turbines, bins, directivity_width, num_samples):
+    """Smooth wind roses (density, shape (turbines, bins)) along direction and return wind_rose,
+    prevail_wind_direction and directivity as DataArrays, see calc_wind_rose()."""
+    bin_centers = edges_to_center(bin_edges)
 
-        # TODO this value might not really make sense that way, actually one needs a whole
-        #  profile for different values of boxcar_width
-        directivity.append(np.max(convoluted) * boxcar_width_angle)
+    prevail_wind_direction, directivity = _prevail_wind_direction(wind_roses, bin_centers,
+                                                                  directivity_width)
 
-    wind_rose = xr.DataArray(wind_roses_list,
+    wind_rose = xr.DataArray(wind_roses,
                              dims=('turbines', 'direction'),
                              coords={'direction': bin_centers,
                                      'turbines': turbines.turbines})
@@ -136,6 +273,299 @@ def calc_wind_rose(turbines, wind_speed, wind_velocity, power_curve=None, bins=7
     return wind_rose, prevail_wind_direction_xr, directivity
 
 
+def _prevail_wind_direction(wind_roses, bin_centers, directivity_width):
+    """Prevailing wind direction and directivity for wind roses of shape (turbines, bins), see
+    calc_wind_rose()."""
+    boxcar_width_angle = np.radians(directivity_width)
+    boxcar_width = int(np.round(boxcar_width_angle / (2 * np.pi) * len(bin_centers)))
+
+    # smoothing along direction for all turbines at once, no smoothing for boxcar_width <= 1 (as
+    # uniform_filter() does)
+    convoluted = wind_roses
+    if boxcar_width > 1:
+        convoluted = uniform_filter1d(wind_roses, boxcar_width, axis=1, mode='wrap')
+
+    # In case of multiple maxima it might make sense to take the central one or so,
+    # but this can only occur if wind speed is equally strong in an interval larger than
+    # boxcar_width.
+    prevail_wind_direction = bin_centers[np.argmax(convoluted, axis=1)]
+
+    # see calc_directivity_profile() for directivity for several values of directivity_width
+    directivity = np.max(convoluted, axis=1) * boxcar_width_angle
+
+    return prevail_wind_direction, directivity
+
+
+def calc_directivity_profile(wind_rose, directivity_widths):
+    """Calculate prevailing wind direction and directivity (see calc_wind_rose()) for several
+    values of ``directivity_width`` at once. The wind rose is smoothed along direction by a
+    moving average with wrap around (same window as ``uniform_filter1d(..., mode='wrap')``), each
+    moving average is a difference of circular cumulative sums, which are calculated only once.
+
+    Maxima which are equal up to PREVAIL_DIRECTION_TIE_RTOL are considered as ties, the first one
+    is taken as prevailing wind direction. Therefore results might differ from calc_wind_rose()
+    (which takes the maximum of ``uniform_filter1d()``) if there are (nearly) equal maxima.
+
+    Parameters
+    ----------
+    wind_rose : xr.DataArray
+        as returned by calc_wind_rose(), dims = turbines, direction
+    directivity_widths : array_like
+        in degree, between 0 and 360
+
+    Returns
+    -------
+    prevail_wind_direction : xr.DataArray
+        direction in rad for each turbine location and width, dims = turbines, directivity_width
+    directivity : xr.DataArray
+        percentage of energy in an angle of ``directivity_width`` around prevail_wind_direction,
+        dims = turbines, directivity_width
+
+    """
+    directivity_widths = np.atleast_1d(directivity_widths)
+    if np.any((directivity_widths <= 0) | (directivity_widths > 360)):
+        raise ValueError("directivity_widths need to be between 0 and 360 degree")
+
+    wind_roses = wind_rose.transpose('turbines', 'direction').values
+    num_turbines, bins = wind_roses.shape
+    bin_centers = wind_rose.direction.values
+
+    # windows wrapping around are contiguous in three copies of the wind rose
+    cumsums = np.zeros((num_turbines, 3 * bins + 1))
+    np.cumsum(np.tile(wind_roses, 3), axis=1, out=cumsums[:, 1:])
+
+    prevail_wind_direction = np.empty((num_turbines, len(directivity_widths)))
+    directivity = np.empty((num_turbines, len(directivity_widths)))
+
+    for i, directivity_width in enumerate(directivity_widths):
+        boxcar_width_angle = np.radians(directivity_width)
+        boxcar_width = int(np.round(boxcar_width_angle / (2 * np.pi) * bins))
+
+        # no smoothing for boxcar_width <= 1 (as uniform_filter() does)
+        convoluted = wind_roses
+        if boxcar_width > 1:
+            start = bins - boxcar_width // 2
+            convoluted = (cumsums[:, start + boxcar_width:start + boxcar_width + bins] -
+                          cumsums[:, start:start + bins]) / boxcar_width
+
+        # first of (nearly) equal maxima, cumulative sums add rounding errors of the order of
+        # machine precision which must not decide between equal values
+        max_values = convoluted.max(axis=1)
+        is_max = convoluted >= max_values[:, np.newaxis] * (1 - PREVAIL_DIRECTION_TIE_RTOL)
+        prevail_wind_direction[:, i] = bin_centers[np.argmax(is_max, axis=1)]
+        directivity[:, i] = max_values * boxcar_width_angle
+
+    coords = {'turbines': wind_rose.turbines.values, 'directivity_width': directivity_widths}
+    dims = ('turbines', 'directivity_width')
+    return (xr.DataArray(prevail_wind_direction, dims=dims, coords=coords),
+            xr.DataArray(directivity, dims=dims, coords=coords))
+
+
+def _load_wind_month(year, month):
+    wind_speed = load_wind_speed(year, month, reduce_along='turbines').load()
+    wind_direction = load_wind_direction(year, month, reduce_along='turbines').load()
+    return wind_speed, wind_direction
+
+
+def calc_wind_rose_streaming(turbines, years, months=MONTHS, power_curve=None, bins=70,
+                             directivity_width=15, chunk_hours=WIND_ROSE_CHUNK_HOURS):
+    """Calculate wind roses as in calc_wind_rose(), but using all hours of ``years`` instead of
+    random samples. Months are read one after another (the next one is loaded while the current
+    one is processed) and ``chunk_hours`` time stamps are processed at once: energy weighted
+    histograms are accumulated in a fixed buffer of shape (turbines, bins + 1), i.e. memory does
+    not depend on the number of years.
+
+    Wind speed and wind direction at turbine locations are read as written by
+    scripts/calc_wind_speed.py, i.e. ERA5 wind velocity is not needed.
+
+    Parameters
+    ----------
+    turbines : xr.DataSet
+        as returned by load_turbines()
+    years : iterable of int
+    months : iterable of int
+    power_curve : callable
+        a function mapping wind speed to power
+    bins : int
+        bins for histogram of distribution of energy (~wind speed) over direction
+    directivity_width : float (in degree)
+        see calc_wind_rose()
+    chunk_hours : int
+        number of time stamps processed at once
+
+    Returns
+    -------
+    wind_rose, prevail_wind_direction, directivity : xr.DataArray
+        see calc_wind_rose(), ``num_samples`` is the number of hours used
+
+    """
+    buffers = BufferPool()
+
+    bin_edges = direction_bin_edges(bins, dtype=COMPUTE_DTYPE)
+    histograms = np.zeros((turbines.sizes['turbines'], bins + 1))
+    num_samples = 0
+
+    year_months = [(year, month) for year in years for month in months]
+    for year, month, (wind_speed, wind_direction) in prefetch_months(_load_wind_month,
+                                                                     year_months):
+        logging.info("Accumulate wind roses for %s-%02d...", year, month)
+
+        wind_speed = wind_speed.transpose('time', 'turbines')
+        wind_direction = wind_direction.transpose('time', 'turbines')
+        if not np.array_equal(wind_speed.time.values, wind_direction.time.values):
+            raise ValueError(f"time stamps of wind speed and wind direction differ for "
+                             f"{year}-{month:02d}")
+
+        for time_start in range(0, wind_speed.sizes['time'], chunk_hours):
+            time_slice = slice(time_start, time_start + chunk_hours)
+            wind_speed_chunk = wind_speed.isel(time=time_slice)
+
+            energy = calc_simulated_energy(wind_speed_chunk,
+                                           turbines,
+                                           power_curve=power_curve,
+                                           sum_along='',
+                                           only_built_turbines=False,
+                                           out=buffers.get('energy', wind_speed_chunk.shape,
+                                                           dtype=energy_dtype(wind_speed_chunk)),
+                                           buffers=buffers)
+
+            accumulate_direction_histograms(histograms,
+                                            wind_direction.values[time_slice],
+                                            energy.values,
+                                            bin_edges)
+            num_samples += wind_speed_chunk.sizes['time']
+
+    wind_roses = histograms_to_density(histograms, bin_edges)
+
+    return _wind_rose_results(wind_roses, bin_edges, turbines, bins, directivity_width,
+                              num_samples)
+
+
+def calc_wind_rose_adaptive(turbines, wind_speed, wind_direction, power_curve=None, bins=70,
+                            directivity_width=15, batch_size=1000, tolerance=None,
+                            num_stable_batches=2, max_samples=None, seed=42):
+    """Calculate wind roses as in calc_wind_rose() from random hours, but instead of a fixed
+    number of samples, hours are drawn in batches until the prevailing wind direction has
+    converged. Wind roses are updated incrementally after each batch, turbines which have
+    converged already are not part of later batches.
+
+    Hours are drawn without replacement, i.e. if all hours have been used, the wind rose is
+    exact for turbines which have not converged yet.
+
+    Parameters
+    ----------
+    turbines : xr.DataSet
+        as returned by load_turbines()
+    wind_speed : xr.DataArray
+        dims = time, turbines as returned by load_wind_speed()
+    wind_direction : xr.DataArray
+        same dims and time stamps as ``wind_speed``, as returned by load_wind_direction()
+    power_curve : callable
+        a function mapping wind speed to power
+    bins : int
+        bins for histogram of distribution of energy (~wind speed) over direction
+    directivity_width : float (in degree)
+        see calc_wind_rose()
+    batch_size : int
+        number of hours drawn per batch
+    tolerance : float
+        in rad, a turbine has converged if its prevailing wind direction changes at most by this
+        value for ``num_stable_batches`` consecutive batches, default: width of one bin
+    num_stable_batches : int
+    max_samples : int
+        stop after this number of hours even if not all turbines have converged, default: all
+        hours
+    seed : int
+        seed of the random number generator used to draw hours
+
+    Returns
+    -------
+    wind_rose, prevail_wind_direction, directivity : xr.DataArray
+        see calc_wind_rose(), ``num_samples`` is the maximum number of hours used for a turbine
+    convergence : xr.Dataset
+        ``num_samples`` (hours used) and ``converged`` per turbine
+
+    """
+    if not np.array_equal(wind_speed.time.values, wind_direction.time.values):
+        raise ValueError("time stamps of wind speed and wind direction differ")
+
+    if tolerance is None:
+        tolerance = 2 * np.pi / bins
+
+    num_time_stamps = wind_speed.sizes['time']
+    if max_samples is None:
+        max_samples = num_time_stamps
+    max_samples = min(max_samples, num_time_stamps)
+
+    num_turbines = turbines.sizes['turbines']
+    # RandomState instead of default_rng(), which needs numpy >= 1.17
+    hours = np.random.RandomState(seed).permutation(num_time_stamps)[:max_samples]
+
+    bin_edges = direction_bin_edges(bins, dtype=COMPUTE_DTYPE)
+    bin_centers = edges_to_center(bin_edges)
+    histograms = np.zeros((num_turbines, bins + 1))
+
+    num_samples = np.zeros(num_turbines, dtype=np.int64)
+    num_stable = np.zeros(num_turbines, dtype=np.int64)
+    prevail_wind_direction = np.full(num_turbines, np.nan)
+    converged = np.zeros(num_turbines, dtype=bool)
+
+    buffers = BufferPool()
+
+    for batch_start in range(0, max_samples, batch_size):
+        active = np.nonzero(~converged)[0]
+        if len(active) == 0:
+            break
+
+        time_idcs = np.sort(hours[batch_start:batch_start + batch_size])
+        wind_speed_batch = wind_speed.transpose('time', 'turbines').isel(
+            time=time_idcs, turbines=active).load()
+        wind_direction_batch = wind_direction.transpose('time', 'turbines').isel(
+            time=time_idcs, turbines=active).values
+
+        energy = calc_simulated_energy(wind_speed_batch,
+                                       turbines.isel(turbines=active),
+                                       power_curve=power_curve,
+                                       sum_along='',
+                                       only_built_turbines=False,
+                                       out=buffers.get('energy', wind_speed_batch.shape,
+                                                       dtype=energy_dtype(wind_speed_batch)),
+                                       buffers=buffers)
+
+        histograms_active = histograms[active]
+        accumulate_direction_histograms(histograms_active, wind_direction_batch, energy.values,
+                                        bin_edges)
+        histograms[active] = histograms_active
+        num_samples[active] += len(time_idcs)
+
+        # same as the prevailing wind direction returned in the end
+        prevail_active, _ = _prevail_wind_direction(
+            histograms_to_density(histograms_active, bin_edges), bin_centers, directivity_width)
+
+        # angle between old and new direction, NaN after the first batch
+        change = np.abs((prevail_active - prevail_wind_direction[active] + np.pi) % (2 * np.pi) -
+                        np.pi)
+        num_stable[active] = np.where(change <= tolerance, num_stable[active] + 1, 0)
+        prevail_wind_direction[active] = prevail_active
+        converged[active] = num_stable[active] >= num_stable_batches
+
+        logging.info("Adaptive wind roses: %s hours, %s of %s turbines converged",
+                     batch_start + len(time_idcs), converged.sum(), num_turbines)
+
+    wind_roses = histograms_to_density(histograms, bin_edges)
+    wind_rose, prevail_wind_direction, directivity = _wind_rose_results(
+        wind_roses, bin_edges, turbines, bins, directivity_width, num_samples.max())
+
+    convergence = xr.Dataset({'num_samples': ('turbines', num_samples),
+                              'converged': ('turbines', converged)},
+                             coords={'turbines': turbines.turbines})
+    convergence.attrs['tolerance'] = tolerance
+    convergence.attrs['num_stable_batches'] = num_stable_batches
+    convergence.attrs['batch_size'] = batch_size
+
+    return wind_rose, prevail_wind_direction, directivity, convergence
+
+
 def calc_directions(turbines, prevail_wind_direction=None):
     """Calculate pairwise directions from each turbine location to each other turbine location.
 
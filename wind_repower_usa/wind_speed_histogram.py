@@ -0,0 +1,160 @@
+import dask.array as da
+import numpy as np
+import xarray as xr
+from dask.diagnostics import ProgressBar
+
+from wind_repower_usa.chunks import chunk_for_reduction
+
+# in m/s, breakpoints of power curves in turbine_models are multiples of this (mostly), energy
+# calculated from the histogram is exact for such power curves, see histogram_energy_coefficients()
+SPEED_BIN_WIDTH = 0.1
+
+# in m/s, wind speeds above are counted in the last bin, all power curves are 0 way below this
+MAX_WIND_SPEED = 40.
+
+
+def _histogram_block(wind_speed, num_bins, bin_width):
+    """Count and sum of wind speeds per turbine and bin for a numpy array of dims (time, turbines).
+    NaN values are ignored. Returns shape (turbines, speed_bin, 2)."""
+    num_turbines = wind_speed.shape[1]
+
+    is_valid = ~np.isnan(wind_speed)
+    turbine_idcs = np.broadcast_to(np.arange(num_turbines), wind_speed.shape)[is_valid]
+    wind_speed = wind_speed[is_valid]
+
+    bin_idcs = np.clip((wind_speed / bin_width).astype(np.int64), 0, num_bins - 1)
+    idcs = turbine_idcs * num_bins + bin_idcs
+
+    size = num_turbines * num_bins
+    counts = np.bincount(idcs, minlength=size)
+    sums = np.bincount(idcs, weights=wind_speed, minlength=size)
+
+    return np.stack((counts, sums), axis=-1).reshape(num_turbines, num_bins, 2)
+
+
+def calc_wind_speed_histogram(wind_speed, bin_width=SPEED_BIN_WIDTH,
+                              max_wind_speed=MAX_WIND_SPEED):
+    """Calculate a histogram of wind speeds for each turbine location. Chunks of ``wind_speed`` are
+    processed one after another (if it is a dask array), i.e. this works for many years of data.
+
+    Besides the number of hours per bin, the sum of wind speeds per bin is stored, which allows to
+    calculate energy generation of piecewise linear power curves exactly, see
+    calc_simulated_energy_from_histogram().
+
+    Parameters
+    ----------
+    wind_speed : xr.DataArray
+        dims = time, turbines as returned by load_wind_speed()
+    bin_width : float
+        in m/s
+    max_wind_speed : float
+        in m/s, wind speeds above are counted in the last bin
+
+    Returns
+    -------
+    xr.Dataset
+        ``count`` and ``wind_speed_sum`` with dims = turbines, speed_bin, coords ``speed_bin``
+        (lower edge of bins in m/s) and ``turbines``
+
+    """
+    num_bins = int(round(max_wind_speed / bin_width))
+
+    wind_speed = wind_speed.transpose('time', 'turbines')
+    wind_speed = chunk_for_reduction(wind_speed, reduce_along='time', name='wind_speed')
+
+    if wind_speed.chunks is None:
+        histogram = _histogram_block(wind_speed.values, num_bins, bin_width)
+    else:
+        data = wind_speed.data
+
+        def histogram_block(wind_speed_block):
+            # add time dim of length one, one per time chunk, summed up below
+            return _histogram_block(wind_speed_block, num_bins, bin_width)[np.newaxis]
+
+        histogram = da.map_blocks(
+            histogram_block, data,
+            new_axis=[2, 3],
+            chunks=((1,) * data.numblocks[0], data.chunks[1], (num_bins,), (2,)),
+            dtype=np.float64,
+        ).sum(axis=0)
+
+        with ProgressBar():
+            histogram = histogram.compute()
+
+    coords = {'speed_bin': np.linspace(0., num_bins * bin_width, num_bins, endpoint=False)}
+    if 'turbines' in wind_speed.coords:
+        coords['turbines'] = wind_speed.turbines.values
+
+    wind_speed_histogram = xr.Dataset({
+        'count': (('turbines', 'speed_bin'), histogram[..., 0].astype(np.int64)),
+        'wind_speed_sum': (('turbines', 'speed_bin'), histogram[..., 1]),
+    },
+        coords=coords,
+    )
+    wind_speed_histogram.attrs['bin_width'] = bin_width
+    wind_speed_histogram.attrs['max_wind_speed'] = max_wind_speed
+
+    return wind_speed_histogram
+
+
+def histogram_energy_coefficients(power_curve, speed_bins, bin_width):
+    """Linearize the power curve in each bin: power = intercept + slope * wind_speed for wind
+    speeds inside the bin. Exact if all breakpoints of the power curve are bin edges.
+
+    Parameters
+    ----------
+    power_curve : callable
+        a function mapping wind speed to power
+    speed_bins : np.ndarray
+        lower edges of consecutive bins in m/s
+    bin_width : float
+        in m/s
+
+    Returns
+    -------
+    intercept, slope : np.ndarray
+        one value per bin
+
+    """
+    lower = power_curve(speed_bins)
+
+    # last bin contains also all higher wind speeds, power curves are constant there
+    upper = np.append(lower[1:], lower[-1])
+
+    slope = (upper - lower) / bin_width
+    intercept = lower - slope * speed_bins
+
+    return intercept, slope
+
+
+def calc_simulated_energy_from_histogram(wind_speed_histogram, power_curve):
+    """Estimate generated energy per turbine location using the wind speed histogram, i.e. a dot
+    product of the histogram with the power curve instead of a pass over hourly data.
+
+    Parameters
+    ----------
+    wind_speed_histogram : xr.Dataset
+        as returned by calc_wind_speed_histogram()
+    power_curve : callable
+        a function mapping wind speed to power
+
+    Returns
+    -------
+    simulated_energy_gwh : xr.DataArray
+        Simulated energy summed over the time range of the histogram [GWh], dims = turbines, no
+        capacity scaling, see calc_capacity_scaling()
+
+    """
+    intercept, slope = histogram_energy_coefficients(
+        power_curve,
+        wind_speed_histogram.speed_bin.values,
+        wind_speed_histogram.attrs['bin_width'])
+
+    simulated_energy = (wind_speed_histogram['count'].values @ intercept +
+                        wind_speed_histogram.wind_speed_sum.values @ slope)
+
+    simulated_energy_gwh = xr.DataArray(simulated_energy * 1e-6,
+                                        dims='turbines',
+                                        coords={'turbines': wind_speed_histogram.turbines},
+                                        name="Simulated energy")
+    return simulated_energy_gwh